@@ -0,0 +1,97 @@
+"""
+FAISS index types shared by the vector stores (statute index, case semantic index).
+
+    'flat'      exact search, 4 bytes per dimension
+    'ivf_flat'  inverted lists over k-means cells, full vectors; nprobe cells are searched
+    'ivf_pq'    inverted lists with product quantized codes, ~1 byte per 16 dimensions
+    'hnsw'      HNSW graph over the full vectors; efSearch trades recall for speed
+    'sq8'       scalar quantization to 1 byte per dimension
+    'fp16'      float16, 2 bytes per dimension
+
+Cell and codebook sizes follow the corpus size: about sqrt(n) cells with at
+least 39 training points each, and fewer PQ bits for corpora too small to
+train 256 centroids per sub-quantizer. `manage.py benchmark_vector_index`
+compares the types against 'flat' on real vectors.
+"""
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8', 'fp16')
+# dimensions per product quantizer sub-vector
+PQ_SUBVECTOR_DIMS = 16
+HNSW_NEIGHBOURS = 32
+HNSW_EF_CONSTRUCTION = 80
+MIN_POINTS_PER_CENTROID = 39
+# scalar quantizers learn per-dimension ranges, a few thousand vectors cover them
+MIN_TRAINING_SAMPLE = 4096
+
+
+def ivf_list_count(count):
+    return max(1, min(int(np.sqrt(count)), count // MIN_POINTS_PER_CENTROID))
+
+
+def pq_parameters(dim, count):
+    """(sub-quantizers, bits per code) for `count` training vectors of `dim` dimensions."""
+    sub_quantizers = max(1, dim // PQ_SUBVECTOR_DIMS)
+    while dim % sub_quantizers:
+        sub_quantizers -= 1
+    bits = int(np.log2(max(2, count // MIN_POINTS_PER_CENTROID)))
+    return sub_quantizers, max(1, min(8, bits))
+
+
+def make_vector_index(index_type, dim, count, metric=faiss.METRIC_L2):
+    """Empty index of `index_type` sized for about `count` vectors; train it with train_vector_index()."""
+    if index_type == 'flat':
+        return faiss.IndexFlat(dim, metric)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, HNSW_NEIGHBOURS, metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == 'sq8':
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, metric)
+    if index_type == 'fp16':
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, metric)
+    nlist = ivf_list_count(count)
+    if index_type == 'ivf_flat':
+        return faiss.IndexIVFFlat(faiss.IndexFlat(dim, metric), dim, nlist, metric)
+    if index_type == 'ivf_pq':
+        sub_quantizers, bits = pq_parameters(dim, count)
+        return faiss.IndexIVFPQ(faiss.IndexFlat(dim, metric), dim, nlist, sub_quantizers, bits, metric)
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+
+def training_sample_size(index):
+    """Vectors worth training `index` on, 0 when it needs no training."""
+    if index.is_trained:
+        return 0
+    size = max(MIN_TRAINING_SAMPLE, 64 * getattr(index, 'nlist', 1))
+    pq = getattr(index, 'pq', None)
+    if pq is not None:
+        size = max(size, MIN_POINTS_PER_CENTROID * pq.ksub)
+    return size
+
+
+def train_vector_index(index, vectors, seed=0):
+    """Train `index` on a sample of `vectors` when its type needs training."""
+    size = training_sample_size(index)
+    if not size:
+        return
+    if len(vectors) > size:
+        vectors = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), size, replace=False))]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def build_ann_index(index_type, vectors, metric=faiss.METRIC_L2):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = make_vector_index(index_type, vectors.shape[1], len(vectors), metric)
+    train_vector_index(index, vectors)
+    index.add(vectors)
+    return index
+
+
+def set_search_parameters(index, nprobe=None, ef_search=None):
+    if nprobe is not None and hasattr(index, 'nprobe'):
+        index.nprobe = nprobe
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AlllegalmltoolsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'AllLegalMLTools'
+
+    def ready(self):
+        # management commands (migrate, ...) load the apps too, so this is only enabled in the web
+        # server's environment; the standalone workers are `manage.py run_summary_workers`
+        if settings.SUMMARY_JOB_WORKERS_AUTOSTART:
+            from .jobs import ensure_worker_pool
+            ensure_worker_pool()
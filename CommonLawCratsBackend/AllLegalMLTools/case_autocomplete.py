@@ -0,0 +1,180 @@
+"""
+Prefix index for case title / case number autocomplete.
+
+Every case contributes keys for its normalized case number and for its
+title starting at every word, so "kumar" completes "Ram vs Kumar" too
+(normalized = lower case, punctuation collapsed to single spaces). The keys are stored
+as one sorted, NUL separated UTF-8 blob with offsets, so the range of keys
+starting with a prefix is found with two binary searches. Each key carries
+the row it came from and a score (decision recency), and completions are
+the best scored rows inside that range. A range longer than MAX_SCANNED_KEYS
+is ranked through its first keys only and the completions are flagged as
+truncated: short prefixes get fast answers, not the best ones overall.
+"""
+import os
+import re
+import json
+import threading
+import numpy as np
+from django.conf import settings
+
+from .case_store import get_case_store, make_build_directory, replace_directory, build_lock, IndexUnavailable
+from .case_facets import decision_dates, date_ordinals_of, MISSING_DATE
+
+AUTOCOMPLETE_FORMAT_VERSION = 1
+NORMALIZE_RE = re.compile(r'[^a-z0-9]+')
+# words a title suffix is never started from
+TITLE_STOP_WORDS = {'vs', 'v', 'versus', 'and', 'of', 'the', 'ors', 'anr'}
+# ranges bigger than this are only ranked through their head (and reported as
+# truncated), which keeps a one or two letter prefix within the per keystroke
+# budget on a large corpus
+MAX_SCANNED_KEYS = 200000
+
+
+def normalize_prefix(text):
+    return NORMALIZE_RE.sub(' ', text.lower()).strip()
+
+
+def build_autocomplete_index(case_store=None, index_dir=None):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_AUTOCOMPLETE_INDEX_DIR
+
+    # more recent decisions rank first, undated cases last; the dates are read from this
+    # store, which need not be the one the facet index was built from
+    date_ordinals = date_ordinals_of(decision_dates(case_store)).astype(np.int64)
+    dated = date_ordinals != MISSING_DATE
+    oldest = date_ordinals[dated].min() if dated.any() else 0
+    scores = np.where(dated, date_ordinals - oldest + 1, 0)
+
+    entries = []
+    titles, case_numbers = case_store.column('Case Title'), case_store.column('Case No')
+    for row in range(len(case_store)):
+        case_no = normalize_prefix(case_numbers[row])
+        if case_no:
+            entries.append((case_no, row))
+        words = normalize_prefix(titles[row]).split()
+        for start, word in enumerate(words):
+            if start == 0 or word not in TITLE_STOP_WORDS:
+                entries.append((' '.join(words[start:]), row))
+    entries = sorted(set(entries))
+
+    keys = [key.encode('utf-8') for key, _ in entries]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(key) + 1 for key in keys], out=offsets[1:])
+    rows = np.asarray([row for _, row in entries], dtype=np.uint32)
+
+    tmp_dir = make_build_directory(index_dir)
+    with open(os.path.join(tmp_dir, 'keys.blob'), 'wb') as f:
+        f.write(b''.join(key + b'\0' for key in keys))
+    np.save(os.path.join(tmp_dir, 'key_offsets.npy'), offsets)
+    np.save(os.path.join(tmp_dir, 'key_rows.npy'), rows)
+    np.save(os.path.join(tmp_dir, 'key_scores.npy'), scores[rows].astype(np.int32) if len(rows) else np.empty(0, dtype=np.int32))
+    meta = {
+        'format_version': AUTOCOMPLETE_FORMAT_VERSION,
+        'dataset_version': case_store.version,
+        'keys': len(keys),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(tmp_dir, index_dir)
+    return meta
+
+
+def _read_meta(index_dir):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def autocomplete_index_is_current(case_store, index_dir):
+    meta = _read_meta(index_dir)
+    return bool(meta) and meta['format_version'] == AUTOCOMPLETE_FORMAT_VERSION \
+        and meta['dataset_version'] == case_store.version
+
+
+def ensure_autocomplete_index(case_store=None, index_dir=None, force=False):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_AUTOCOMPLETE_INDEX_DIR
+    if not force and autocomplete_index_is_current(case_store, index_dir):
+        return index_dir
+    with build_lock(index_dir):
+        if force or not autocomplete_index_is_current(case_store, index_dir):
+            build_autocomplete_index(case_store, index_dir)
+    return index_dir
+
+
+class AutocompleteIndex:
+    def __init__(self, directory):
+        self.meta = _read_meta(directory)
+        with open(os.path.join(directory, 'keys.blob'), 'rb') as f:
+            # the blob is small next to the dataset and every lookup touches it, keep it in memory
+            self.blob = f.read()
+        self.offsets = np.load(os.path.join(directory, 'key_offsets.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(directory, 'key_rows.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(directory, 'key_scores.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def key(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def _lower_bound(self, prefix):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix):
+        """[start, end) of the keys starting with `prefix` (bytes)."""
+        start = self._lower_bound(prefix)
+        # every key with the prefix sorts before prefix + the highest byte
+        end = self._lower_bound(prefix + b'\xff')
+        return start, end
+
+    def complete(self, text, limit=10):
+        """
+        (best scored distinct rows whose title or case number starts with `text`, whether only the first
+        MAX_SCANNED_KEYS keys of the prefix were ranked).
+        """
+        prefix = normalize_prefix(text).encode('utf-8')
+        if not prefix:
+            return np.empty(0, dtype=np.int64), False
+        start, end = self.prefix_range(prefix)
+        truncated = end - start > MAX_SCANNED_KEYS
+        end = min(end, start + MAX_SCANNED_KEYS)
+        if start >= end:
+            return np.empty(0, dtype=np.int64), False
+
+        rows = np.asarray(self.rows[start:end], dtype=np.int64)
+        scores = np.asarray(self.scores[start:end])
+        # a case can match through several of its keys, so keep some room for duplicates
+        k = min(len(scores), 4 * limit)
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        best = best[np.lexsort((rows[best], -scores[best]))]
+        rows = rows[best]
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)][:limit], truncated
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_autocomplete_index():
+    """Process wide autocomplete index, opened on first use and built by `manage.py build_case_indexes`."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not autocomplete_index_is_current(get_case_store(), settings.CASE_AUTOCOMPLETE_INDEX_DIR):
+                    raise IndexUnavailable(
+                        "The autocomplete index is missing or out of date, build it with `manage.py build_case_indexes`")
+                _index = AutocompleteIndex(settings.CASE_AUTOCOMPLETE_INDEX_DIR)
+    return _index
@@ -0,0 +1,253 @@
+"""
+Precomputed filter and facet structures over the case dataset.
+
+    judges          -> CSR posting lists judge -> sorted rows, and row -> judge codes
+                       for counting (the judge vocabulary is large and sparse,
+                       so row lists are far smaller than one bitmap per judge)
+    disposal nature -> one packed bitmap per value plus an int16 code per row
+    decision date   -> day ordinal per row and the rows sorted by date with
+                       their sorted ordinals, so a date range is two binary searches
+
+Everything is saved as .npy files in CASE_FACET_INDEX_DIR and memory-mapped.
+"""
+import os
+import re
+import json
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .case_store import get_case_store, make_build_directory, replace_directory, build_lock, IndexUnavailable
+
+FACET_FORMAT_VERSION = 1
+JUDGE_SEPARATOR_RE = re.compile(r'\s*(?:,|&|\band\b)\s*', re.IGNORECASE)
+EPOCH = datetime.date(1970, 1, 1)
+MISSING_DATE = np.iinfo(np.int32).min
+
+
+def normalize_value(value):
+    return ' '.join(value.split()).lower()
+
+
+def split_judges(value):
+    return [judge for judge in (' '.join(part.split()) for part in JUDGE_SEPARATOR_RE.split(value)) if judge]
+
+
+def date_ordinal(value):
+    """Days since 1970-01-01 of a YYYY-MM-DD string or date."""
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return (value - EPOCH).days
+
+
+def decision_dates(case_store):
+    """Decision date of every row as a pandas Series, NaT where it is missing or malformed."""
+    # the scraped dates are day first (dd-mm-yyyy)
+    return pd.to_datetime(pd.Series(case_store.column('Decision Date_left').take(range(len(case_store))), dtype=object),
+                          dayfirst=True, errors='coerce')
+
+
+def date_ordinals_of(dates):
+    """date_ordinal() of every date of `decision_dates()`, MISSING_DATE for NaT."""
+    ordinals = np.full(len(dates), MISSING_DATE, dtype=np.int32)
+    valid = dates.notna().values
+    ordinals[valid] = (dates[valid].dt.normalize() - pd.Timestamp(EPOCH)).dt.days.values
+    return ordinals
+
+
+def build_facet_index(case_store=None, index_dir=None):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_FACET_INDEX_DIR
+    row_count = len(case_store)
+
+    # judges, stored both ways
+    judge_names, judge_codes = [], {}
+    row_judge_offsets = np.zeros(row_count + 1, dtype=np.int64)
+    row_judge_codes = []
+    judges_column = case_store.column('Judges')
+    for row in range(row_count):
+        codes = []
+        for judge in split_judges(judges_column[row]):
+            key = normalize_value(judge)
+            if key not in judge_codes:
+                judge_codes[key] = len(judge_names)
+                judge_names.append(judge)
+            if judge_codes[key] not in codes:
+                codes.append(judge_codes[key])
+        row_judge_codes.extend(codes)
+        row_judge_offsets[row + 1] = row_judge_offsets[row] + len(codes)
+    row_judge_codes = np.asarray(row_judge_codes, dtype=np.int32)
+    row_of_code = np.repeat(np.arange(row_count, dtype=np.uint32), np.diff(row_judge_offsets))
+    order = np.lexsort((row_of_code, row_judge_codes))
+    judge_rows = row_of_code[order]
+    judge_offsets = np.zeros(len(judge_names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_judge_codes, minlength=len(judge_names)), out=judge_offsets[1:])
+
+    # disposal nature, single valued
+    disposal_names, disposal_lookup = [], {}
+    disposal_codes = np.full(row_count, -1, dtype=np.int16)
+    disposal_column = case_store.column('Disposal Nature')
+    for row in range(row_count):
+        value = ' '.join(disposal_column[row].split())
+        if not value:
+            continue
+        key = normalize_value(value)
+        if key not in disposal_lookup:
+            disposal_lookup[key] = len(disposal_names)
+            disposal_names.append(value)
+        disposal_codes[row] = disposal_lookup[key]
+    disposal_bitmaps = np.stack([
+        np.packbits(disposal_codes == code) for code in range(len(disposal_names))
+    ]) if disposal_names else np.zeros((0, (row_count + 7) // 8), dtype=np.uint8)
+
+    # decision dates
+    dates = decision_dates(case_store)
+    date_ordinals = date_ordinals_of(dates)
+    valid = dates.notna().values
+    dated_rows = np.flatnonzero(valid)
+    date_order = dated_rows[np.argsort(date_ordinals[dated_rows], kind='stable')].astype(np.uint32)
+    date_sorted = date_ordinals[date_order]
+    years = np.where(valid, dates.dt.year.fillna(0).values, 0).astype(np.int16)
+
+    tmp_dir = make_build_directory(index_dir)
+    arrays = {
+        'judge_offsets': judge_offsets, 'judge_rows': judge_rows,
+        'row_judge_offsets': row_judge_offsets, 'row_judge_codes': row_judge_codes,
+        'disposal_codes': disposal_codes, 'disposal_bitmaps': disposal_bitmaps,
+        'date_ordinals': date_ordinals, 'date_order': date_order, 'date_sorted': date_sorted, 'years': years,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), array)
+    meta = {
+        'format_version': FACET_FORMAT_VERSION,
+        'dataset_version': case_store.version,
+        'rows': row_count,
+        'judges': judge_names,
+        'disposal_natures': disposal_names,
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(tmp_dir, index_dir)
+    return meta
+
+
+def _read_meta(index_dir):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def facet_index_is_current(case_store, index_dir):
+    meta = _read_meta(index_dir)
+    return bool(meta) and meta['format_version'] == FACET_FORMAT_VERSION \
+        and meta['dataset_version'] == case_store.version
+
+
+def ensure_facet_index(case_store=None, index_dir=None, force=False):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_FACET_INDEX_DIR
+    if not force and facet_index_is_current(case_store, index_dir):
+        return index_dir
+    with build_lock(index_dir):
+        if force or not facet_index_is_current(case_store, index_dir):
+            build_facet_index(case_store, index_dir)
+    return index_dir
+
+
+class FacetIndex:
+    def __init__(self, directory):
+        self.meta = _read_meta(directory)
+        self.rows = self.meta['rows']
+        self.judges = self.meta['judges']
+        self.disposal_natures = self.meta['disposal_natures']
+        self.judge_lookup = {normalize_value(name): code for code, name in enumerate(self.judges)}
+        self.disposal_lookup = {normalize_value(name): code for code, name in enumerate(self.disposal_natures)}
+        for name in ('judge_offsets', 'judge_rows', 'row_judge_offsets', 'row_judge_codes', 'disposal_codes',
+                     'disposal_bitmaps', 'date_ordinals', 'date_order', 'date_sorted', 'years'):
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+    def judge_filter(self, judges):
+        """Rows decided by any of the given judges."""
+        rows = []
+        for judge in judges:
+            code = self.judge_lookup.get(normalize_value(judge))
+            if code is not None:
+                rows.append(self.judge_rows[self.judge_offsets[code]:self.judge_offsets[code + 1]])
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.uint32)
+
+    def disposal_filter(self, values):
+        bitmap = np.zeros(self.disposal_bitmaps.shape[1], dtype=np.uint8)
+        for value in values:
+            code = self.disposal_lookup.get(normalize_value(value))
+            if code is not None:
+                bitmap |= self.disposal_bitmaps[code]
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.rows))
+
+    def date_filter(self, date_from=None, date_to=None):
+        lo = 0 if date_from is None else np.searchsorted(self.date_sorted, date_ordinal(date_from), side='left')
+        hi = len(self.date_sorted) if date_to is None else np.searchsorted(self.date_sorted, date_ordinal(date_to), side='right')
+        return np.sort(self.date_order[lo:hi])
+
+    def candidates(self, judges=None, disposal_natures=None, date_from=None, date_to=None):
+        """Sorted rows matching every given filter, or None when there is no filter."""
+        row_sets = []
+        if judges:
+            row_sets.append(self.judge_filter(judges))
+        if disposal_natures:
+            row_sets.append(self.disposal_filter(disposal_natures))
+        if date_from or date_to:
+            row_sets.append(self.date_filter(date_from, date_to))
+        if not row_sets:
+            return None
+        row_sets.sort(key=len)
+        rows = row_sets[0].astype(np.int64)
+        for other in row_sets[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def counts(self, rows, top=20):
+        """Facet counts over the given matching rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+
+        starts, ends = self.row_judge_offsets[rows], self.row_judge_offsets[rows + 1]
+        lengths = ends - starts
+        # positions of every (row, judge) pair of the matching rows inside row_judge_codes
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        judge_counts = np.bincount(self.row_judge_codes[positions], minlength=len(self.judges))
+
+        disposal = self.disposal_codes[rows]
+        disposal_counts = np.bincount(disposal[disposal >= 0], minlength=len(self.disposal_natures))
+
+        years = self.years[rows]
+        year_values, year_counts = np.unique(years[years > 0], return_counts=True)
+
+        def top_values(names, counts):
+            best = np.argsort(-counts, kind='stable')[:top]
+            return [{'value': names[i], 'count': int(counts[i])} for i in best if counts[i] > 0]
+
+        return {
+            'judges': top_values(self.judges, judge_counts),
+            'disposal_nature': top_values(self.disposal_natures, disposal_counts),
+            'decision_year': [{'value': int(year), 'count': int(count)} for year, count in zip(year_values, year_counts)],
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_facet_index():
+    """Process wide facet index, opened on first use and built by `manage.py build_case_indexes`."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not facet_index_is_current(get_case_store(), settings.CASE_FACET_INDEX_DIR):
+                    raise IndexUnavailable(
+                        "The facet index is missing or out of date, build it with `manage.py build_case_indexes`")
+                _index = FacetIndex(settings.CASE_FACET_INDEX_DIR)
+    return _index
@@ -0,0 +1,311 @@
+"""
+Read-only columnar store for the case dataset (updated_merged_dataset.csv).
+
+The CSV is parsed once and written out as one directory of binary columns:
+every column is a UTF-8 blob with all the cell values concatenated plus an
+int64 offsets array (row i lives in blob[offsets[i]:offsets[i + 1]]).
+Both files are memory-mapped read-only, so every gunicorn worker shares the
+same pages from the OS page cache instead of holding its own DataFrame.
+
+Every case also gets a stable `case_id` (a hash of its Case No and PDF
+Link, independent of the row order) and the store carries an open
+addressing hash table from case id to row, so a case is resolved in O(1)
+without touching the other columns.
+"""
+import os
+import json
+import mmap
+import shutil
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+STORE_FORMAT_VERSION = 3
+META_FILE = 'meta.json'
+CASE_ID_COLUMN = 'case_id'
+
+
+def _column_file_name(column):
+    # column names in the dataset contain spaces ('Case Title', 'Decision Date_left')
+    return ''.join(ch if ch.isalnum() else '_' for ch in column)
+
+
+def make_case_id(case_no, pdf_link):
+    normalized = ' '.join(case_no.lower().split())
+    digest = hashlib.blake2b(f"{normalized}\x1f{pdf_link.strip()}".encode('utf-8'), digest_size=8)
+    return digest.hexdigest()
+
+
+def _case_id_key(case_id):
+    # 16 hex digits -> uint64 key of the hash table
+    if len(case_id) != 16:
+        raise ValueError(case_id)
+    return np.uint64(int(case_id, 16))
+
+
+def build_id_table(case_ids):
+    """Linear probing table with a power of two size and a load factor <= 0.5."""
+    size = 1
+    while size < 2 * max(len(case_ids), 1):
+        size *= 2
+    keys = np.zeros(size, dtype=np.uint64)
+    rows = np.full(size, -1, dtype=np.int64)
+    mask = size - 1
+    for row, case_id in enumerate(case_ids):
+        key = _case_id_key(case_id)
+        slot = int(key) & mask
+        while rows[slot] != -1:
+            if keys[slot] == key:
+                # duplicated rows in the dataset, the first one wins
+                break
+            slot = (slot + 1) & mask
+        else:
+            keys[slot] = key
+            rows[slot] = row
+    return keys, rows
+
+
+class StringColumn:
+    def __init__(self, directory, file_name):
+        self.offsets = np.load(os.path.join(directory, file_name + '.offsets.npy'), mmap_mode='r')
+        blob_path = os.path.join(directory, file_name + '.blob')
+        if os.path.getsize(blob_path) == 0:
+            # mmap refuses zero length files
+            self.blob = b''
+        else:
+            with open(blob_path, 'rb') as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.blob[start:end].decode('utf-8')
+
+    def take(self, rows):
+        return [self[row] for row in rows]
+
+    def find_rows(self, needle):
+        """Return the sorted row numbers whose value contains `needle` (case sensitive)."""
+        needle = needle.encode('utf-8')
+        if not needle:
+            return np.arange(len(self), dtype=np.int64)
+
+        rows = []
+        offsets = self.offsets
+        pos = self.blob.find(needle)
+        while pos != -1:
+            row = int(np.searchsorted(offsets, pos, side='right')) - 1
+            row_end = int(offsets[row + 1])
+            if pos + len(needle) <= row_end:
+                rows.append(row)
+                # one hit per row is enough, jump straight to the next row
+                pos = self.blob.find(needle, row_end)
+            else:
+                # the match straddles two rows, keep looking from the next byte
+                pos = self.blob.find(needle, pos + 1)
+        return np.asarray(rows, dtype=np.int64)
+
+
+def write_string_column(directory, file_name, values):
+    """Write `values` (a sized iterable of str) in the layout StringColumn reads."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(os.path.join(directory, file_name + '.blob'), 'wb') as blob:
+        for i, value in enumerate(values):
+            data = value.encode('utf-8')
+            blob.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(os.path.join(directory, file_name + '.offsets.npy'), offsets)
+
+
+class CaseStore:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.columns = self.meta['columns']
+        self._columns = {}
+        self._id_keys = np.load(os.path.join(directory, 'id_table_keys.npy'), mmap_mode='r')
+        self._id_rows = np.load(os.path.join(directory, 'id_table_rows.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def version(self):
+        # identifies the dataset contents, used to key anything derived from it
+        return self.meta['dataset_version']
+
+    def column(self, name):
+        if name not in self._columns:
+            if name not in self.columns:
+                raise KeyError(name)
+            self._columns[name] = StringColumn(self.directory, _column_file_name(name))
+        return self._columns[name]
+
+    def lookup(self, case_id):
+        """Row of the case with the given id, or None."""
+        try:
+            key = _case_id_key(str(case_id))
+        except ValueError:
+            return None
+        mask = len(self._id_keys) - 1
+        slot = int(key) & mask
+        while self._id_rows[slot] != -1:
+            if self._id_keys[slot] == key:
+                return int(self._id_rows[slot])
+            slot = (slot + 1) & mask
+        return None
+
+    def row(self, row, columns=None):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f"Case index {row} out of range")
+        return {name: self.column(name)[row] for name in (columns or self.columns)}
+
+    def rows(self, rows, columns=None):
+        """Column-wise gather of many rows, returns a list of dicts."""
+        names = columns or self.columns
+        values = [self.column(name).take(rows) for name in names]
+        return [dict(zip(names, row_values)) for row_values in zip(*values)]
+
+
+class IndexUnavailable(Exception):
+    """A search index is missing or out of date. Requests never build one, the management commands do."""
+
+
+def make_build_directory(target_dir):
+    """Empty scratch directory next to `target_dir`, later published with replace_directory()."""
+    tmp_dir = f"{target_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def replace_directory(tmp_dir, target_dir):
+    # readers that already mapped the old files keep working, the files are only unlinked
+    old_dir = f"{target_dir}.old-{os.getpid()}"
+    if os.path.exists(target_dir):
+        os.rename(target_dir, old_dir)
+    os.rename(tmp_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(target_dir):
+    """Exclusive lock shared by all processes building `target_dir`."""
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    with open(f"{target_dir}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _source_hash(csv_path):
+    digest = hashlib.blake2b(digest_size=8)
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_meta(store_dir, meta):
+    tmp_path = os.path.join(store_dir, f"{META_FILE}.tmp-{os.getpid()}")
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(store_dir, META_FILE))
+
+
+def store_is_current(csv_path, store_dir):
+    try:
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get('format_version') != STORE_FORMAT_VERSION:
+        return False
+    if not os.path.exists(csv_path):
+        # the store can be shipped without the CSV it was built from
+        return True
+    signature = _source_signature(csv_path)
+    if all(meta.get(key) == value for key, value in signature.items()):
+        return True
+    # size and mtime are only the cheap check: a fresh checkout or a touch keeps the
+    # content, and with it the dataset version every cache key and index is tied to
+    if meta.get('source_size') != signature['source_size'] or meta.get('source_hash') != _source_hash(csv_path):
+        return False
+    _write_meta(store_dir, {**meta, **signature})
+    return True
+
+
+def build_case_store(csv_path, store_dir):
+    """Convert the CSV into the columnar layout. The new store is swapped in with a rename."""
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    df[CASE_ID_COLUMN] = [make_case_id(case_no, pdf_link) for case_no, pdf_link in zip(df['Case No'], df['PDF Link'])]
+
+    tmp_dir = make_build_directory(store_dir)
+
+    for name in df.columns:
+        write_string_column(tmp_dir, _column_file_name(name), df[name].values)
+
+    id_keys, id_rows = build_id_table(df[CASE_ID_COLUMN].values)
+    np.save(os.path.join(tmp_dir, 'id_table_keys.npy'), id_keys)
+    np.save(os.path.join(tmp_dir, 'id_table_rows.npy'), id_rows)
+
+    # the version depends on the content only, so identical data keeps its version
+    source_hash = _source_hash(csv_path)
+    meta = {
+        'format_version': STORE_FORMAT_VERSION,
+        'rows': len(df),
+        'columns': list(df.columns),
+        'dataset_version': source_hash,
+        'source_hash': source_hash,
+        **_source_signature(csv_path),
+    }
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    replace_directory(tmp_dir, store_dir)
+    return meta
+
+
+def ensure_case_store(csv_path=None, store_dir=None, force=False):
+    """Build the store if it is missing or older than the CSV. Safe to call from several workers at once."""
+    csv_path = csv_path or settings.CASE_DATASET_CSV
+    store_dir = store_dir or settings.CASE_STORE_DIR
+
+    if not force and store_is_current(csv_path, store_dir):
+        return store_dir
+
+    with build_lock(store_dir):
+        # another worker may have finished the build while we were waiting
+        if force or not store_is_current(csv_path, store_dir):
+            build_case_store(csv_path, store_dir)
+    return store_dir
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_case_store():
+    """Process wide CaseStore, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CaseStore(ensure_case_store())
+    return _store
@@ -0,0 +1,105 @@
+"""
+Picking the chunks of a document that go into the summary prompt.
+
+    embedding  every chunk and the start of the document are embedded remotely;
+               the chunks nearest to the start are kept (the original path)
+    tfidf      local: chunks are TF-IDF vectors and scored by cosine similarity
+               to the document centroid, i.e. how central they are
+    textrank   local: PageRank over the sparse chunk similarity graph
+
+The local methods need no API call. All of them return at most `top_k` chunks,
+best first. The default comes from SUMMARY_CHUNK_SELECTION and can be
+overridden per request.
+"""
+import numpy as np
+from django.conf import settings
+
+from .helper_functions_llm import generate_embeddings, index_embeddings, retrieve_similar_chunks
+from .metrics import stage, count
+
+DEFAULT_TOP_K = 5
+TEXTRANK_DAMPING = 0.85
+TEXTRANK_ITERATIONS = 50
+TEXTRANK_TOLERANCE = 1e-6
+
+
+def tfidf_matrix(chunks):
+    """L2 normalized sparse TF-IDF rows, one per chunk."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(sublinear_tf=True, token_pattern=r'(?u)\b[a-zA-Z][a-zA-Z0-9]+\b').fit_transform(chunks)
+
+
+def tfidf_scores(chunks):
+    matrix = tfidf_matrix(chunks)
+    # sum of a chunk's cosine similarities to all chunks = its dot product with the summed
+    # vector, which is O(nnz) instead of building the n x n similarity matrix
+    centroid = np.asarray(matrix.sum(axis=0)).ravel()
+    return matrix @ centroid
+
+
+def textrank_scores(chunks):
+    matrix = tfidf_matrix(chunks)
+    similarity = (matrix @ matrix.T).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+    out_weight = np.asarray(similarity.sum(axis=1)).ravel()
+    out_weight[out_weight == 0] = 1
+    # row normalized transition matrix, transposed so rank flows along the edges
+    transition = similarity.multiply(1 / out_weight[:, None]).T.tocsr()
+    n = len(chunks)
+    rank = np.full(n, 1 / n)
+    for _ in range(TEXTRANK_ITERATIONS):
+        updated = (1 - TEXTRANK_DAMPING) / n + TEXTRANK_DAMPING * (transition @ rank)
+        if np.abs(updated - rank).sum() < TEXTRANK_TOLERANCE:
+            return updated
+        rank = updated
+    return rank
+
+
+def _best(chunks, scores, top_k):
+    top_k = min(top_k, len(chunks))
+    best = np.argsort(-np.asarray(scores), kind='stable')[:top_k]
+    return [chunks[i] for i in best]
+
+
+def select_by_embedding(chunks, query, top_k=DEFAULT_TOP_K):
+    # the query is embedded in the same batched call as the chunks
+    embeddings = generate_embeddings(chunks + [query])
+    with stage('faiss'):
+        # chunks are within the model limit, so the first len(chunks) rows are theirs
+        index = index_embeddings(embeddings[:len(chunks)])
+        return retrieve_similar_chunks(index, embeddings[len(chunks)], chunks, top_k=min(top_k, len(chunks)))
+
+
+def select_by_tfidf(chunks, query=None, top_k=DEFAULT_TOP_K):
+    return _best(chunks, tfidf_scores(chunks), top_k)
+
+
+def select_by_textrank(chunks, query=None, top_k=DEFAULT_TOP_K):
+    return _best(chunks, textrank_scores(chunks), top_k)
+
+
+SELECTION_METHODS = {
+    'embedding': select_by_embedding,
+    'tfidf': select_by_tfidf,
+    'textrank': select_by_textrank,
+}
+
+
+def selection_method(name=None):
+    name = name or settings.SUMMARY_CHUNK_SELECTION
+    if name not in SELECTION_METHODS:
+        raise ValueError(f"Unknown chunk selection '{name}', expected one of {', '.join(sorted(SELECTION_METHODS))}")
+    return name
+
+
+def select_chunks(chunks, query, method=None, top_k=DEFAULT_TOP_K):
+    """The `top_k` chunks the summary is written from, best first."""
+    if len(chunks) <= top_k:
+        # nothing to choose from, keep the whole document in reading order
+        return list(chunks)
+    method = selection_method(method)
+    with stage(f'select_{method}'):
+        selected = SELECTION_METHODS[method](chunks, query, top_k=top_k)
+    count('chunks_total', len(selected), kind='selected')
+    return selected
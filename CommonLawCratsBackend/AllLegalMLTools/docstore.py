@@ -0,0 +1,114 @@
+"""
+Compact docstore of the passages of a vector index, read lazily by vector id.
+
+Files, next to the index:
+    passages.blob / passages.offsets.npy   passage texts, a StringColumn (see case_store.py)
+    passages.pages.npy                     int32 page of every passage, -1 when unknown
+    passages.sources.npy                   int32 position of its source in docstore.json, -1 when unknown
+    docstore.json                          format version, passage count and the source names
+
+Everything is memory-mapped, so opening the docstore costs the same for ten
+passages or ten million and forked workers share the pages. Only `source`
+and `page` are kept of the passage metadata, the only keys the statute
+indexes have.
+
+convert_langchain_docstore() writes this layout for a LangChain
+FAISS.save_local() directory from its pickled index.pkl, swapping in a
+converted copy of the directory.
+"""
+import os
+import json
+import shutil
+import numpy as np
+
+from .case_store import StringColumn, write_string_column, make_build_directory, replace_directory, build_lock
+
+DOCSTORE_FORMAT_VERSION = 1
+DOCSTORE_META_FILE = 'docstore.json'
+DOCSTORE_FILES = {DOCSTORE_META_FILE, 'passages.blob', 'passages.offsets.npy', 'passages.pages.npy', 'passages.sources.npy'}
+
+
+def write_docstore(directory, texts, metadata):
+    sources = list(dict.fromkeys(item['source'] for item in metadata if item.get('source')))
+    source_ids = {source: i for i, source in enumerate(sources)}
+    write_string_column(directory, 'passages', texts)
+    pages = [item['page'] if isinstance(item.get('page'), int) else -1 for item in metadata]
+    np.save(os.path.join(directory, 'passages.pages.npy'), np.asarray(pages, dtype=np.int32))
+    np.save(os.path.join(directory, 'passages.sources.npy'),
+            np.asarray([source_ids.get(item.get('source'), -1) for item in metadata], dtype=np.int32))
+    with open(os.path.join(directory, DOCSTORE_META_FILE), 'w') as f:
+        json.dump({'format_version': DOCSTORE_FORMAT_VERSION, 'count': len(texts), 'sources': sources}, f)
+
+
+def has_docstore(directory):
+    try:
+        with open(os.path.join(directory, DOCSTORE_META_FILE)) as f:
+            return json.load(f)['format_version'] == DOCSTORE_FORMAT_VERSION
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+class Docstore:
+    def __init__(self, directory):
+        with open(os.path.join(directory, DOCSTORE_META_FILE)) as f:
+            self.meta = json.load(f)
+        self.texts = StringColumn(directory, 'passages')
+        self.pages = np.load(os.path.join(directory, 'passages.pages.npy'), mmap_mode='r')
+        self.source_ids = np.load(os.path.join(directory, 'passages.sources.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.texts)
+
+    def text(self, vector_id):
+        return self.texts[vector_id]
+
+    def metadata(self, vector_id):
+        page, source = int(self.pages[vector_id]), int(self.source_ids[vector_id])
+        return {
+            'source': self.meta['sources'][source] if source >= 0 else None,
+            'page': page if page >= 0 else None,
+        }
+
+
+class MemoryDocstore:
+    """Docstore interface over plain lists, for indexes that were not converted yet."""
+
+    def __init__(self, texts, metadata):
+        self._texts = texts
+        self._metadata = metadata
+
+    def __len__(self):
+        return len(self._texts)
+
+    def text(self, vector_id):
+        return self._texts[vector_id]
+
+    def metadata(self, vector_id):
+        return self._metadata[vector_id]
+
+
+def convert_langchain_docstore(directory, output_dir=None):
+    """
+    Write the compact docstore of a FAISS.save_local() directory, by default
+    into that directory. Returns the passage count.
+
+    The files of workers that have the docstore mapped are never rewritten: the
+    directory is copied, the docstore written into the copy and the copy swapped in.
+    """
+    from .statute_index import read_langchain_docstore
+    texts, metadata = read_langchain_docstore(directory)
+    output_dir = output_dir or directory
+    with build_lock(output_dir):
+        tmp_dir = make_build_directory(output_dir)
+        if os.path.isdir(output_dir):
+            for name in os.listdir(output_dir):
+                if name in DOCSTORE_FILES:
+                    continue
+                path = os.path.join(output_dir, name)
+                if os.path.isdir(path):
+                    shutil.copytree(path, os.path.join(tmp_dir, name))
+                else:
+                    shutil.copy2(path, tmp_dir)
+        write_docstore(tmp_dir, texts, metadata)
+        replace_directory(tmp_dir, output_dir)
+    return len(texts)
@@ -1,64 +1,165 @@
-import fitz  
 import faiss
-import tiktoken
 import requests
 import io
 import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 
+from .pdf_downloader import download_pdf
+from .pdf_extraction import iter_pages, clean_text
+from .tokenized_document import TokenizedDocument, get_encoding, token_count, join_within_budget
+from .metrics import stage, count, record_stage
+
 openaiapikey = os.environ['OPENAIAPIKEY']
 
-from openai import OpenAI
-client = OpenAI(
-    api_key=openaiapikey
-)
+from openai import OpenAI, NOT_GIVEN
+
+def make_openai_client(base_url=None):
+    # OPENAI_BASE_URL points the client at another OpenAI compatible server, e.g. the local
+    # stubs of stub_services.py (`manage.py run_stub_services`)
+    return OpenAI(
+        api_key=openaiapikey,
+        base_url=base_url or os.environ.get('OPENAI_BASE_URL') or None
+    )
+
+client = make_openai_client()
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_MAX_TOKENS = 8191
+# known token counts within this many tokens of the limit are measured again: decoded
+# token slices do not always encode back into as many tokens
+EMBEDDING_TOKEN_MARGIN = 16
+# one embeddings request carries many inputs, but stays well below the API per request limits
+EMBEDDING_BATCH_MAX_TOKENS = 100000
+EMBEDDING_BATCH_MAX_INPUTS = 256
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_CACHE_MAX_ENTRIES = 2048  # ~24MB of text-embedding-3-large vectors
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+SUMMARY_MODEL = "gpt-4o-mini"
+# bump whenever the summary prompt changes, cached summaries of older prompts are then ignored
+SUMMARY_PROMPT_VERSION = "1"
+# tokens of document text that go into one summary prompt
+SUMMARY_TOKEN_BUDGET = 8191
+# the chunks of a summary prompt are joined with this
+SUMMARY_SEPARATOR = ' '
 
 def extract_text_from_pdf(pdf_file):
     if pdf_file is None:
         raise ValueError("No PDF file provided")
-    document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    if document.page_count == 0:
-        raise ValueError("The provided PDF file is empty")
-    text = ""
-    for page_num in range(document.page_count):
-        page = document.load_page(page_num)
-        text += page.get_text()
-    return text
-
-def clean_text(text):
-    return text.replace('\n', ' ').replace('\r', ' ').strip()
+    return ''.join(iter_pages(pdf_file.read()))
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
-
-def split_text_into_token_chunks(text, max_tokens, encoding_name="cl100k_base"):
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunk_tokens = tokens[i:i+max_tokens]
-        chunk_text = encoding.decode(chunk_tokens)
-        chunks.append(chunk_text)
-    return chunks
-
-def generate_embeddings(texts):
-    embeddings = []
-    max_token_length = 8191
+    return token_count(string, encoding_name)
+
+def split_text_into_token_chunks(text, max_tokens, encoding_name="cl100k_base", overlap=0):
+    return TokenizedDocument.from_text(text, encoding_name).chunks(max_tokens, overlap)
+
+def _embedding_batches(items):
+    # pack (position, text, token_count) items into requests below the per request token / input limits
+    max_tokens, max_inputs = EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS
+    batch, batch_tokens = [], 0
+    for item in items:
+        if batch and (batch_tokens + item[2] > max_tokens or len(batch) >= max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += item[2]
+    if batch:
+        yield batch
+
+def _embedding_cache_key(text, model):
+    return hashlib.sha1(f"{model}\x00{text}".encode('utf-8')).digest()
+
+def _cached_embedding(key):
+    with _embedding_cache_lock:
+        vector = _embedding_cache.get(key)
+        if vector is not None:
+            _embedding_cache.move_to_end(key)
+        return vector
+
+def _store_embedding(key, vector):
+    with _embedding_cache_lock:
+        _embedding_cache[key] = vector
+        _embedding_cache.move_to_end(key)
+        while len(_embedding_cache) > EMBEDDING_CACHE_MAX_ENTRIES:
+            _embedding_cache.popitem(last=False)
+
+def _embed_batch(batch, model):
+    count('api_calls_total', api='embeddings')
+    count('tokens_total', sum(token_count for _, _, token_count in batch), kind='embedded')
+    response = client.embeddings.create(input=[text for _, text, _ in batch], model=model)
+    # the API returns one item per input, ordered by `index`
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def _embedding_pieces(texts, max_tokens=EMBEDDING_MAX_TOKENS, margin=EMBEDDING_TOKEN_MARGIN,
+                      encoding_name="cl100k_base"):
+    """(text, token_count) pieces of `texts`, each within `max_tokens` once encoded."""
+    encoding = get_encoding(encoding_name)
+    pieces = []
     for text in texts:
-        num_tokens = num_tokens_from_string(text, "cl100k_base")
-        if num_tokens > max_token_length:
-            sub_texts = split_text_into_token_chunks(text, max_token_length)
-            for sub_text in sub_texts:
-                response = client.embeddings.create(input=sub_text, model="text-embedding-3-large").data[0].embedding
-                embeddings.append(response)
+        # chunks of a TokenizedDocument already know their size, trusted unless close to the limit
+        known = getattr(text, 'token_count', None)
+        if known is not None and known <= max_tokens - margin:
+            pieces.append((text, known))
+            continue
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            pieces.append((text, len(tokens)))
+            continue
+        start = 0
+        while start < len(tokens):
+            stop = min(len(tokens), start + max(1, max_tokens - margin))
+            while True:
+                piece = encoding.decode(tokens[start:stop])
+                length = len(encoding.encode(piece))
+                if length <= max_tokens or stop - start <= 1:
+                    break
+                stop -= 1
+            pieces.append((piece, length))
+            start = stop
+    return pieces
+
+def generate_embeddings(texts, model=EMBEDDING_MODEL):
+    """
+    Embed `texts` and return a contiguous float32 matrix (one row per text, texts
+    longer than the model limit are split and contribute one row per part).
+    Many texts go into every API call, calls run concurrently and vectors are cached per process.
+    """
+    pieces = _embedding_pieces(texts)
+
+    vectors = [None] * len(pieces)
+    missing = []
+    for position, (text, token_count) in enumerate(pieces):
+        vector = _cached_embedding(_embedding_cache_key(text, model))
+        if vector is None:
+            missing.append((position, text, token_count))
+        else:
+            vectors[position] = vector
+
+    batches = list(_embedding_batches(missing))
+    with stage('embed'):
+        if len(batches) == 1:
+            results = [_embed_batch(batches[0], model)]
         else:
-            response = client.embeddings.create(input=text, model="text-embedding-3-large").data[0].embedding
-            embeddings.append(response)
-    return np.array(embeddings)
+            with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENCY) as executor:
+                results = list(executor.map(lambda batch: _embed_batch(batch, model), batches))
+    for batch, embeddings in zip(batches, results):
+        for (position, text, _), embedding in zip(batch, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32)
+            vectors[position] = vector
+            _store_embedding(_embedding_cache_key(text, model), vector)
+
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
 
 def index_embeddings(embeddings):
     dimension = embeddings.shape[1]
@@ -70,23 +171,13 @@ def retrieve_similar_chunks(index, query_embedding, texts, top_k=5):
     distances, indices = index.search(np.array([query_embedding]), top_k)
     return [texts[i] for i in indices[0]]
 
-def generate_summary(chunks):
-    max_chunk_length = 8191 
-    truncated_chunks = []
-    current_length = 0
+def summary_messages(chunks):
+    # measured on the joined text, the chunks' own token counts can add up to less
+    text = join_within_budget(chunks, SUMMARY_TOKEN_BUDGET, SUMMARY_SEPARATOR)
 
-    for chunk in chunks:
-        chunk_length = num_tokens_from_string(chunk, "cl100k_base")
-        if current_length + chunk_length > max_chunk_length:
-            break
-        truncated_chunks.append(chunk)
-        current_length += chunk_length
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
+    return [
             {"role": "system", "content": "First of all write the Title of the case first. Summarize the following text into the specified sections: Facts, Issues, Decision (Holding), Reasoning (Rationale), Disposition, Precedent, and Note. Provide at least two points for each section. If any section lacks sufficient information, provide a brief summary for that section. Ensure the output is formatted as a list of points."},
-            {"role": "user", "content": ' '.join(truncated_chunks)},
+            {"role": "user", "content": text},
             {"role": "user", "content": """
                 1. **Facts**: 
                    - This section provides the background and key events that led to the legal dispute. 
@@ -111,12 +202,48 @@ def generate_summary(chunks):
                    - It might highlight unique aspects of the case, procedural issues, or other relevant details.
             """}
         ]
+
+def generate_summary(chunks, timeout=NOT_GIVEN):
+    count('api_calls_total', api='chat')
+    with stage('summarize'):
+        response = client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=summary_messages(chunks),
+            timeout=timeout
+        )
+    return response.choices[0].message.content
+
+def generate_partial_summary(text, timeout=NOT_GIVEN):
+    """Condense one part of a long judgment (or several partial summaries) for the final summary."""
+    count('api_calls_total', api='chat')
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "The following text is one part of a long court judgment, or notes taken from several parts of it. Condense it into a list of points. Keep the parties, facts, issues, arguments, findings, reasoning, decision and disposition it contains, with the sections and precedents cited. Do not add anything that is not in the text."},
+            {"role": "user", "content": text}
+        ],
+        timeout=timeout
     )
     return response.choices[0].message.content
 
+def stream_summary(chunks, timeout=NOT_GIVEN):
+    """Yield the summary text piece by piece as the model produces it."""
+    count('api_calls_total', api='chat')
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=summary_messages(chunks),
+        stream=True,
+        timeout=timeout
+    )
+    first_token = True
+    for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            if first_token:
+                record_stage('summarize_first_token', time.perf_counter() - start)
+                first_token = False
+            yield event.choices[0].delta.content
+    record_stage('summarize', time.perf_counter() - start)
+
 def download_pdf_from_url(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return io.BytesIO(response.content)
-    else:
-        raise ValueError("Unable to download PDF from the provided URL")
+    return io.BytesIO(download_pdf(url))
@@ -0,0 +1,166 @@
+"""
+Background summary jobs, queued in the database (SummaryJob) so no broker is needed.
+
+The summarizer endpoints can enqueue a job and answer at once with its id;
+the client polls summary-jobs/<job_id>/ for the result. Jobs are taken by
+worker threads: standalone processes started with `manage.py run_summary_workers`,
+and/or SUMMARY_JOB_WORKERS threads inside every web process when
+SUMMARY_JOB_WORKERS_AUTOSTART is set (started by AppConfig.ready, so set it in
+the web server's environment only). Every worker also queues the jobs of dead
+workers again. A job is claimed with a conditional UPDATE (status queued ->
+running), so any number of workers in any number of processes can share the
+queue.
+"""
+import os
+import socket
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils.timezone import now
+
+from .models import SummaryJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_document_job(pdf_bytes=None, url=None, selection=None, map_reduce=None):
+    return SummaryJob.objects.create(kind=SummaryJob.DOCUMENT, document=pdf_bytes,
+                                     payload={'url': url, 'selection': selection, 'map_reduce': map_reduce})
+
+
+def enqueue_case_job(case_id, selection=None, map_reduce=None):
+    return SummaryJob.objects.create(kind=SummaryJob.CASE, payload={
+        'case_id': case_id, 'selection': selection, 'map_reduce': map_reduce,
+    })
+
+
+def requeue_stale_jobs():
+    """Jobs whose worker died mid-way are queued again (or failed after too many attempts)."""
+    deadline = now() - timedelta(seconds=settings.SUMMARY_JOB_TIMEOUT)
+    stale = SummaryJob.objects.filter(status=SummaryJob.RUNNING, started_at__lt=deadline)
+    stale.filter(attempts__gte=settings.SUMMARY_JOB_MAX_ATTEMPTS).update(
+        status=SummaryJob.FAILED, error='Job timed out', finished_at=now())
+    stale.update(status=SummaryJob.QUEUED, worker='')
+
+
+def claim_next_job(worker_name):
+    while True:
+        pk = SummaryJob.objects.filter(status=SummaryJob.QUEUED).order_by('id').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        claimed = SummaryJob.objects.filter(pk=pk, status=SummaryJob.QUEUED).update(
+            status=SummaryJob.RUNNING, worker=worker_name, started_at=now(), attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return SummaryJob.objects.get(pk=pk)
+        # another worker was faster, try the next one
+
+
+def run_job(job):
+    # imported here, the pipeline pulls in the OpenAI client
+    from .summarization import summarize_document, summarize_case, case_summary_payload
+    from .pdf_downloader import download_pdf
+    from .case_store import get_case_store
+
+    try:
+        if job.kind == SummaryJob.DOCUMENT:
+            if job.document is not None:
+                pdf_bytes = bytes(job.document)
+            else:
+                pdf_bytes = download_pdf(job.payload['url'])
+            summary, _ = summarize_document(pdf_bytes, selection=job.payload.get('selection'),
+                                            map_reduce=job.payload.get('map_reduce'))
+            result = {'summary': summary}
+        else:
+            case_store = get_case_store()
+            row = case_store.lookup(job.payload['case_id'])
+            if row is None:
+                raise ValueError("Case not found")
+            case = case_store.row(row)
+            summary, _ = summarize_case(case, case_store.version, selection=job.payload.get('selection'),
+                                        map_reduce=job.payload.get('map_reduce'))
+            result = case_summary_payload(case, summary)
+    except Exception as e:
+        logger.exception("Summary job %s failed", job.job_id)
+        SummaryJob.objects.filter(pk=job.pk).update(status=SummaryJob.FAILED, error=str(e), finished_at=now())
+        return
+
+    # the uploaded document is not needed any more once the summary exists
+    SummaryJob.objects.filter(pk=job.pk).update(status=SummaryJob.DONE, result=result, document=None, finished_at=now())
+
+
+def work(worker_name, stop_event, poll_interval=None):
+    poll_interval = settings.SUMMARY_JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            requeue_stale_jobs()
+            job = claim_next_job(worker_name)
+            if job is not None:
+                run_job(job)
+                continue
+        except Exception:
+            logger.exception("Summary worker %s failed to poll the queue", worker_name)
+        finally:
+            close_old_connections()
+        stop_event.wait(poll_interval)
+
+
+class WorkerPool:
+    def __init__(self, size, name_prefix=None):
+        self.size = size
+        self.name_prefix = name_prefix or f"{socket.gethostname()}:{os.getpid()}"
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(
+                target=work, args=(f"{self.name_prefix}:{i}", self.stop_event), daemon=True, name=f"summary-worker-{i}",
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_pid = None
+
+
+def ensure_worker_pool():
+    """Start this process' worker threads, once per process (gunicorn forks after import)."""
+    global _pool, _pool_pid
+    if not settings.SUMMARY_JOB_WORKERS_AUTOSTART or settings.SUMMARY_JOB_WORKERS <= 0:
+        return None
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = WorkerPool(settings.SUMMARY_JOB_WORKERS)
+            _pool.start()
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def job_status(job):
+    data = {
+        'job_id': str(job.job_id),
+        'kind': job.kind,
+        'status': job.status,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == SummaryJob.DONE:
+        data['result'] = job.result
+    elif job.status == SummaryJob.FAILED:
+        data['error'] = job.error
+    return data
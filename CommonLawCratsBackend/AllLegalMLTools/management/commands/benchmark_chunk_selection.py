@@ -0,0 +1,78 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from AllLegalMLTools import helper_functions_llm
+from AllLegalMLTools.case_store import get_case_store
+from AllLegalMLTools.chunk_selection import SELECTION_METHODS, DEFAULT_TOP_K, select_chunks
+from AllLegalMLTools.pdf_downloader import download_pdf
+from AllLegalMLTools.pdf_extraction import iter_clean_pages
+from AllLegalMLTools.summarization import UPLOAD_CHUNK_TOKENS
+from AllLegalMLTools.tokenized_document import TokenizedDocument
+
+
+class Command(BaseCommand):
+    help = ("Compare the chunk selection methods on real documents: selection latency, and how many "
+            "of the chunks picked by the embedding path each method picks too")
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdfs', nargs='*', help="PDF files to use")
+        parser.add_argument('--cases', type=int, default=0, help="Also use this many random cases of the dataset")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-tokens', type=int, default=UPLOAD_CHUNK_TOKENS)
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+        parser.add_argument('--methods', nargs='+', choices=sorted(SELECTION_METHODS), default=sorted(SELECTION_METHODS))
+
+    def documents(self, options):
+        for path in options['pdfs']:
+            with open(path, 'rb') as f:
+                yield path, f.read()
+        if options['cases']:
+            case_store = get_case_store()
+            rows = np.random.default_rng(options['seed']).choice(len(case_store), options['cases'], replace=False)
+            links = case_store.column('PDF Link')
+            for row in rows:
+                try:
+                    yield links[row], download_pdf(links[row])
+                except Exception as e:
+                    self.stderr.write(f"Skipping {links[row]}: {e}")
+
+    def handle(self, *args, **options):
+        methods, top_k = options['methods'], options['top_k']
+        if not options['pdfs'] and not options['cases']:
+            raise CommandError("Give PDF files and/or --cases")
+        if 'embedding' not in methods:
+            methods = ['embedding'] + methods
+
+        latencies = {method: [] for method in methods}
+        overlaps = {method: [] for method in methods}
+        skipped = 0
+        for name, pdf_bytes in self.documents(options):
+            document = TokenizedDocument.from_pages(iter_clean_pages(pdf_bytes))
+            chunks = document.chunks(options['chunk_tokens'])
+            if len(chunks) <= top_k:
+                # every chunk is used, no method has anything to choose
+                skipped += 1
+                continue
+            query = document.text(0, 8191).strip()[:8191]
+            selected = {}
+            for method in methods:
+                # time the cold path, not the per process embedding cache
+                helper_functions_llm._embedding_cache.clear()
+                start = time.perf_counter()
+                selected[method] = {chunk.start for chunk in select_chunks(chunks, query, method, top_k)}
+                latencies[method].append(time.perf_counter() - start)
+            for method in methods:
+                overlaps[method].append(len(selected[method] & selected['embedding']) / len(selected['embedding']))
+            self.stdout.write(f"{name}: {len(chunks)} chunks, " + ', '.join(
+                f"{method} {1000 * latencies[method][-1]:.1f}ms" for method in methods))
+
+        documents = len(latencies['embedding'])
+        self.stdout.write(f"\n{documents} documents compared, {skipped} with at most {top_k} chunks skipped")
+        if not documents:
+            return
+        self.stdout.write(f"{'method':<10} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'overlap':>8}")
+        for method in methods:
+            ms = 1000 * np.asarray(latencies[method])
+            self.stdout.write(f"{method:<10} {np.percentile(ms, 50):>9.1f} {np.percentile(ms, 95):>9.1f} "
+                              f"{ms.mean():>9.1f} {np.mean(overlaps[method]):>8.2f}")
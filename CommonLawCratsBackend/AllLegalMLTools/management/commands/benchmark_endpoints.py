@@ -0,0 +1,358 @@
+import json
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from itertools import count
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from AllLegalMLTools import helper_functions_llm
+from AllLegalMLTools.chunk_selection import select_chunks
+from AllLegalMLTools.models import SummaryCacheEntry
+from AllLegalMLTools.pdf_downloader import download_pdf, cache_pdf
+from AllLegalMLTools.pdf_extraction import iter_clean_pages
+from AllLegalMLTools.stub_services import StubLatency, start_stub_services, sample_pdf
+from AllLegalMLTools.summarization import UPLOAD_CHUNK_TOKENS
+from AllLegalMLTools.tokenized_document import TokenizedDocument
+
+API = '/legal-solutions/'
+SEARCH_QUERIES = ['appeal', 'murder section 302', '"writ petition"', 'land acquisition compensation', 'bail OR anticipatory']
+IPC_QUERIES = ['punishment for murder', 'section 302', 'dishonestly inducing delivery of property',
+               'criminal breach of trust by a public servant', 'wrongful restraint']
+
+
+def unique_pdf(pdf_bytes, n):
+    # bytes after %%EOF are ignored by readers but change the document hash, so every
+    # request misses the summary, extraction and embedding caches
+    return pdf_bytes + f"\n%benchmark {n} {time.time_ns()}\n".encode('ascii')
+
+
+def read_body(response, start=None, first_token=None):
+    # read the whole event stream, noting when the first summary text arrived
+    if not response.streaming:
+        return response.content
+    body = []
+    for part in response.streaming_content:
+        if first_token is not None and not first_token and b'event: token' in part:
+            first_token.append(time.perf_counter() - start)
+        body.append(part)
+    return b''.join(body)
+
+
+class Command(BaseCommand):
+    help = ("Offline benchmark of the pipeline stages and of every legal-solutions/ endpoint, with the OpenAI "
+            "API and the chatbot lambda replaced by the local stub services. Reports p50/p95/p99 latency of "
+            "sequential requests, then latency and throughput with --concurrency clients at once. The database "
+            "writes of the sequential phase are rolled back, the summaries cached by the concurrent phase are "
+            "deleted. Needs the tiktoken encoding files in the local cache (TIKTOKEN_CACHE_DIR) and, for the "
+            "case and IPC endpoints, the case dataset and the IPC index")
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdfs', nargs='*', help="Sample PDFs (synthetic judgments are generated when none are given)")
+        parser.add_argument('--iterations', type=int, default=10, help="Timed requests per endpoint / stage")
+        parser.add_argument('--pages', type=int, default=20, help="Pages of the generated sample PDFs")
+        parser.add_argument('--embedding-latency', type=float, default=0.05)
+        parser.add_argument('--completion-latency', type=float, default=0.3)
+        parser.add_argument('--token-latency', type=float, default=0.0)
+        parser.add_argument('--chatbot-latency', type=float, default=0.5)
+        parser.add_argument('--pdf-latency', type=float, default=0.02)
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Client threads of the concurrent phase, 0 skips it")
+        parser.add_argument('--load-requests', type=int,
+                            help="Requests per endpoint in the concurrent phase, 4 per client by default")
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this file")
+
+    def handle(self, *args, **options):
+        self.iterations = options['iterations']
+        self.concurrency = options['concurrency']
+        self.load_requests = options['load_requests'] or 4 * self.concurrency
+        self.timings = defaultdict(list)
+        self.wall = defaultdict(float)
+        self.load_results = {}
+        latency = StubLatency(
+            embeddings=options['embedding_latency'], completion=options['completion_latency'],
+            completion_token=options['token_latency'], chatbot=options['chatbot_latency'], pdf=options['pdf_latency'],
+        )
+        self.server = start_stub_services(latency=latency)
+        self.samples = []
+        for path in options['pdfs']:
+            with open(path, 'rb') as f:
+                self.samples.append(f.read())
+        if not self.samples:
+            self.samples = [sample_pdf(seed, pages=options['pages']) for seed in range(3)]
+
+        live_client = helper_functions_llm.client
+        helper_functions_llm.client = helper_functions_llm.make_openai_client(base_url=f"{self.server.url}/v1")
+        try:
+            with tempfile.TemporaryDirectory() as pdf_cache_dir, override_settings(
+                PDF_CACHE_DIR=pdf_cache_dir, LAWCHATBOT_URL=self.server.url, LAWCHATBOT_POLL_INTERVAL=0.05,
+                LAWCHATBOT_MAX_POLLS=int(options['chatbot_latency'] / 0.05) + 20, SUMMARY_JOB_WORKERS=0,
+            ):
+                with transaction.atomic():
+                    # one untimed pass first: lazy imports, encoders and connection pools
+                    self.recording = False
+                    self.run_stages(iterations=1)
+                    self.recording = True
+                    self.run_stages()
+                    self.run_endpoints()
+                    transaction.set_rollback(True)
+                if self.concurrency > 0:
+                    # the client threads have database connections of their own, they would wait
+                    # for the transaction above to finish
+                    self.run_load()
+        finally:
+            helper_functions_llm.client = live_client
+            self.server.shutdown()
+        self.report(options['json_path'])
+
+    def sample(self, n):
+        return unique_pdf(self.samples[n % len(self.samples)], n)
+
+    def timed(self, name, call):
+        start = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - start
+        if not self.recording:
+            return result
+        self.timings[name].append(elapsed)
+        self.wall[name] += elapsed
+        return result
+
+    def request(self, name, method, path, expected=200, **kwargs):
+        start = time.perf_counter()
+
+        def call():
+            response = getattr(self.client, method)(API + path, **kwargs)
+            first_token = []
+            response.body = read_body(response, start, first_token)
+            if first_token and self.recording:
+                self.timings[name + ' first token'].append(first_token[0])
+            return response
+        response = self.timed(name, call)
+        if response.status_code != expected or b'event: error' in response.body:
+            self.stderr.write(f"{name}: HTTP {response.status_code} {response.body[:200]!r}")
+        return response
+
+    def run_stages(self, iterations=None):
+        for n in range(iterations or self.iterations):
+            # a new URL every time, so the download is not served by the PDF cache
+            url = f"{self.server.url}/pdf/{1000 + n + self.recording * self.iterations}.pdf"
+            pdf_bytes = unique_pdf(self.timed('stage: download', lambda: download_pdf(url)), n)
+            pages = self.timed('stage: extract', lambda: list(iter_clean_pages(pdf_bytes)))
+            document = self.timed('stage: tokenize', lambda: TokenizedDocument.from_pages(pages))
+            chunks = document.chunks(UPLOAD_CHUNK_TOKENS)
+            query = document.text(0, 8191).strip()[:8191]
+            helper_functions_llm._embedding_cache.clear()
+            selected = self.timed('stage: select (embedding)', lambda: select_chunks(chunks, query, 'embedding'))
+            self.timed('stage: select (tfidf)', lambda: select_chunks(chunks, query, 'tfidf'))
+            self.timed('stage: summarize', lambda: helper_functions_llm.generate_summary(selected))
+
+    def run_endpoints(self):
+        self.client = Client()
+        n = 10000
+        for _ in range(self.iterations):
+            n += 1
+            self.request('case-summarizer (upload)', 'post', 'case-summarizer/',
+                         data={'pdf_file': self.upload(self.sample(n))})
+            self.request('case-summarizer (url)', 'post', 'case-summarizer/',
+                         data={'url': f"{self.server.url}/pdf/{n}.pdf"})
+            self.request('case-summarizer (upload, stream)', 'post', 'case-summarizer/',
+                         data={'pdf_file': self.upload(self.sample(-n)), 'stream': 'true'})
+        cached = self.sample(0)
+        self.client.post(API + 'case-summarizer/', data={'pdf_file': self.upload(cached)})
+        for _ in range(self.iterations):
+            self.request('case-summarizer (cached)', 'post', 'case-summarizer/', data={'pdf_file': self.upload(cached)})
+            response = self.request('case-summarizer (async enqueue)', 'post', 'case-summarizer/', expected=202,
+                                    data={'pdf_file': self.upload(self.sample(n)), 'async': 'true'})
+            self.request('summary-jobs (status)', 'get', f"summary-jobs/{response.json()['job_id']}/")
+            self.request('lawchatbot', 'post', 'lawchatbot/', data={'query': 'punishment for theft'},
+                         content_type='application/json')
+        self.run_statute_endpoints()
+        self.run_case_endpoints()
+
+    def run_statute_endpoints(self):
+        from AllLegalMLTools.statute_index import get_statute_index
+        try:
+            statute_index = get_statute_index()
+        except Exception as e:
+            self.statute_modes = ()
+            self.stderr.write(f"Skipping ipc-search, the IPC index is not available: {e}")
+            return
+        self.statute_modes = ('hybrid', 'lexical', 'vector')
+        if statute_index.lexical is None:
+            self.statute_modes = ('vector',)
+            self.stderr.write("Skipping the lexical and hybrid ipc-search modes, the IPC index has no lexical index "
+                              "(`manage.py build_vector_index --lexical-only`)")
+
+        def search(name, body):
+            return self.request(name, 'post', 'ipc-search/', data=body, content_type='application/json')
+
+        # the first search embeds through a new connection, keep it out of the numbers
+        self.client.post(API + 'ipc-search/', data={'query': 'theft', 'mode': self.statute_modes[0]},
+                         content_type='application/json')
+        for i in range(self.iterations):
+            query = IPC_QUERIES[i % len(IPC_QUERIES)]
+            for mode in self.statute_modes:
+                search(f"ipc-search ({mode})", {'query': query, 'mode': mode})
+            search('ipc-search (batch)', {'queries': IPC_QUERIES, 'mode': self.statute_modes[0]})
+
+    def run_case_endpoints(self):
+        from AllLegalMLTools.case_store import get_case_store, CASE_ID_COLUMN
+        try:
+            case_store = get_case_store()
+        except Exception as e:
+            self.case_store = None
+            self.stderr.write(f"Skipping the case endpoints, the case dataset is not available: {e}")
+            return
+        self.case_store = case_store
+
+        def search(name, body):
+            return self.request(name, 'post', 'case-search-query/', data=body, content_type='application/json')
+
+        # the first call of every index opens it, keep that out of the numbers
+        self.client.post(API + 'case-search-query/', data={'search_query': 'appeal'}, content_type='application/json')
+        response = self.client.post(API + 'case-search-query/', data={'search_query': 'appeal', 'mode': 'semantic'},
+                                    content_type='application/json')
+        # requests never build the semantic index, it is measured only once build_case_indexes has run
+        self.semantic_index = response.status_code != 503
+        if not self.semantic_index:
+            self.stderr.write(f"Skipping semantic case search: {response.json()['error']}")
+        self.client.get(API + 'case-autocomplete/', {'q': 'a'})
+        for i in range(self.iterations):
+            query = SEARCH_QUERIES[i % len(SEARCH_QUERIES)]
+            search('case-search-query (keyword)', {'search_query': query})
+            if self.semantic_index:
+                search('case-search-query (semantic)', {'search_query': query, 'mode': 'semantic'})
+            search('case-search-query (filtered)', {'search_query': query, 'decided_from': '2010-01-01'})
+            self.request('case-autocomplete', 'get', 'case-autocomplete/', data={'q': query[:3]})
+
+        rows = np.random.default_rng(0).choice(len(case_store), min(self.iterations, len(case_store)), replace=False)
+        links = case_store.column('PDF Link')
+        for n, row in enumerate(rows):
+            # the dataset links are served from the PDF cache, the benchmark never leaves the machine
+            cache_pdf(links[row], self.sample(20000 + n))
+        for row in rows:
+            body = {'case_id': case_store.row(row)[CASE_ID_COLUMN]}
+            self.request('case-search-summary', 'post', 'case-search-summary/', data=body, content_type='application/json')
+            self.request('case-search-summary (cached)', 'post', 'case-search-summary/', data=body,
+                         content_type='application/json')
+
+    def run_load(self):
+        # summaries cached from here on are the benchmark's own, removed at the end
+        started = now()
+        cached = self.sample(0)
+        Client().post(API + 'case-summarizer/', data={'pdf_file': self.upload(cached)})
+        try:
+            self.load('case-summarizer (upload)', 'post', 'case-summarizer/',
+                      lambda n: {'data': {'pdf_file': self.upload(self.sample(30000 + n))}})
+            self.load('case-summarizer (cached)', 'post', 'case-summarizer/',
+                      lambda n: {'data': {'pdf_file': self.upload(cached)}})
+            self.load('lawchatbot', 'post', 'lawchatbot/',
+                      lambda n: {'data': {'query': 'punishment for theft'}, 'content_type': 'application/json'})
+            # hybrid and lexical, or vector alone without a lexical index
+            for mode in self.statute_modes[:2]:
+                self.load(f"ipc-search ({mode})", 'post', 'ipc-search/',
+                          lambda n, mode=mode: {'data': {'query': IPC_QUERIES[n % len(IPC_QUERIES)], 'mode': mode},
+                                                'content_type': 'application/json'})
+            if self.case_store is not None:
+                for mode in ('keyword', 'semantic') if self.semantic_index else ('keyword',):
+                    self.load(f"case-search-query ({mode})", 'post', 'case-search-query/',
+                              lambda n, mode=mode: {'data': {'search_query': SEARCH_QUERIES[n % len(SEARCH_QUERIES)],
+                                                             'mode': mode},
+                                                    'content_type': 'application/json'})
+                self.load('case-autocomplete', 'get', 'case-autocomplete/',
+                          lambda n: {'data': {'q': SEARCH_QUERIES[n % len(SEARCH_QUERIES)][:3]}})
+        finally:
+            SummaryCacheEntry.objects.filter(created_at__gte=started).delete()
+
+    def load(self, name, method, path, make_kwargs, expected=200):
+        """
+        --load-requests requests of one endpoint from --concurrency client threads at once. Throughput is
+        the number of requests over the wall time of the whole batch, not 1 / mean latency.
+        """
+        numbers = count()
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def client_thread():
+            client = Client()
+            try:
+                while True:
+                    n = next(numbers)
+                    if n >= self.load_requests:
+                        break
+                    kwargs = make_kwargs(n)
+                    start = time.perf_counter()
+                    try:
+                        response = getattr(client, method)(API + path, **kwargs)
+                        body = read_body(response)
+                        error = None if response.status_code == expected and b'event: error' not in body \
+                            else f"HTTP {response.status_code} {body[:200]!r}"
+                    except Exception as e:
+                        error = repr(e)
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        if error:
+                            errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client_thread) for _ in range(self.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        if errors:
+            self.stderr.write(f"{name} x{self.concurrency}: {len(errors)} failed, first: {errors[0]}")
+        ms = 1000 * np.asarray(latencies)
+        self.load_results[name] = {
+            'count': len(ms),
+            'errors': len(errors),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'throughput_per_s': len(ms) / wall,
+        }
+
+    def upload(self, pdf_bytes):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile('judgment.pdf', pdf_bytes, content_type='application/pdf')
+
+    def report(self, json_path):
+        results = {}
+        # sequential requests: one at a time, so "seq req/s" is only 1 / mean latency
+        self.stdout.write(f"{'sequential':<44} {'n':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9} "
+                          f"{'seq req/s':>9}")
+        for name, timings in self.timings.items():
+            ms = 1000 * np.asarray(timings)
+            results[name] = {
+                'count': len(ms),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'mean_ms': float(ms.mean()),
+                'sequential_per_s': len(ms) / self.wall[name] if self.wall[name] else None,
+            }
+            r = results[name]
+            throughput = '-' if r['sequential_per_s'] is None else f"{r['sequential_per_s']:.1f}"
+            self.stdout.write(f"{name:<44} {r['count']:>4} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+                              f"{r['mean_ms']:>9.1f} {throughput:>9}")
+        if self.load_results:
+            self.stdout.write('')
+            self.stdout.write(f"{f'{self.concurrency} concurrent clients':<44} {'n':>4} {'errors':>6} {'p50 ms':>9} "
+                              f"{'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+            for name, r in self.load_results.items():
+                self.stdout.write(f"{name:<44} {r['count']:>4} {r['errors']:>6} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                                  f"{r['p99_ms']:>9.1f} {r['throughput_per_s']:>9.1f}")
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump({'sequential': results,
+                           'concurrent': {'clients': self.concurrency, 'endpoints': self.load_results}}, f, indent=2)
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import numpy as np
+import faiss
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from AllLegalMLTools.ann_index import INDEX_TYPES, make_vector_index, train_vector_index, set_search_parameters
+from AllLegalMLTools.statute_index import EmbeddingStore
+
+
+class Command(BaseCommand):
+    help = ("Compare the FAISS index types of ann_index.py on the vectors of a real index: recall@k against "
+            "exact search, query latency, build (training) time and index size")
+
+    def add_arguments(self, parser):
+        parser.add_argument('index_dir', nargs='?', default=settings.IPC_VECTOR_INDEX_DIR,
+                            help="Index whose vectors to use: its embedding store, or a flat index.faiss")
+        parser.add_argument('--vectors', help="Use the vectors of this .npy file instead")
+        parser.add_argument('--types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES))
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=100,
+                            help="Vectors held out of the index as queries (unless --query-file is given)")
+        parser.add_argument('--query-file', help="Text queries, one per line, embedded with --embedding-model")
+        parser.add_argument('--embedding-model', default=settings.IPC_EMBEDDING_MODEL)
+        parser.add_argument('--nprobe', type=int, default=settings.IPC_VECTOR_NPROBE)
+        parser.add_argument('--ef-search', type=int, default=settings.IPC_VECTOR_EF_SEARCH)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', help="Also write the results to this file")
+
+    def load_vectors(self, options):
+        if options['vectors']:
+            return np.load(options['vectors'])
+        index_dir = options['index_dir']
+        store_dir = f"{index_dir}.embeddings"
+        if os.path.isdir(store_dir):
+            store = EmbeddingStore(store_dir)
+            if store.vectors:
+                return np.vstack(list(store.vectors.values()))
+        index_path = os.path.join(index_dir, 'index.faiss')
+        if not os.path.exists(index_path):
+            raise CommandError(f"No embedding store or index.faiss for {index_dir}")
+        index = faiss.read_index(index_path)
+        if not isinstance(index, faiss.IndexFlat):
+            raise CommandError(f"{index_path} is not a flat index, its vectors cannot be read back; use --vectors")
+        return index.reconstruct_n(0, index.ntotal)
+
+    def split(self, vectors, options):
+        if options['query_file']:
+            from AllLegalMLTools.helper_functions_llm import generate_embeddings
+            with open(options['query_file']) as f:
+                texts = [line.strip() for line in f if line.strip()]
+            if not texts:
+                raise CommandError(f"No queries in {options['query_file']}")
+            queries = np.ascontiguousarray(generate_embeddings(texts, model=options['embedding_model']), dtype=np.float32)
+            faiss.normalize_L2(queries)
+            return vectors, queries
+        count = min(options['queries'], len(vectors) // 10)
+        if count <= 0:
+            raise CommandError(f"{len(vectors)} vectors are too few to hold out queries")
+        held_out = np.zeros(len(vectors), dtype=bool)
+        held_out[np.random.default_rng(options['seed']).choice(len(vectors), count, replace=False)] = True
+        return vectors[~held_out], vectors[held_out]
+
+    def handle(self, *args, **options):
+        vectors = np.ascontiguousarray(self.load_vectors(options), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        database, queries = self.split(vectors, options)
+        k = min(options['k'], len(database))
+        self.stdout.write(f"{len(database)} vectors of {database.shape[1]} dimensions, {len(queries)} queries, k={k}")
+
+        exact = faiss.IndexFlatL2(database.shape[1])
+        exact.add(database)
+        _, truth = exact.search(queries, k)
+
+        results = []
+        for index_type in options['types']:
+            started = time.perf_counter()
+            index = make_vector_index(index_type, database.shape[1], len(database))
+            train_vector_index(index, database, seed=options['seed'])
+            trained = time.perf_counter()
+            index.add(database)
+            built = time.perf_counter()
+            set_search_parameters(index, nprobe=options['nprobe'], ef_search=options['ef_search'])
+
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query[None, :], k)
+                latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            _, found = index.search(queries, k)
+            batch_seconds = time.perf_counter() - start
+
+            recall = np.mean([len(np.intersect1d(row, expected)) / k for row, expected in zip(found, truth)])
+            size = len(faiss.serialize_index(index))
+            results.append({
+                'index_type': index_type,
+                f'recall_at_{k}': float(recall),
+                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'p95_ms': float(np.percentile(latencies, 95) * 1000),
+                'batch_qps': len(queries) / batch_seconds if batch_seconds else float('inf'),
+                'train_s': trained - started,
+                'build_s': built - started,
+                'size_mb': size / 1e6,
+                'bytes_per_vector': size / len(database),
+            })
+
+        self.stdout.write(f"{'':<10} {f'recall@{k}':>9} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} "
+                          f"{'train s':>8} {'build s':>8} {'size MB':>8} {'B/vector':>9}")
+        for r in results:
+            self.stdout.write(f"{r['index_type']:<10} {r[f'recall_at_{k}']:>9.3f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+                              f"{r['batch_qps']:>10.0f} {r['train_s']:>8.2f} {r['build_s']:>8.2f} {r['size_mb']:>8.2f} "
+                              f"{r['bytes_per_vector']:>9.0f}")
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'vectors': len(database), 'dim': int(database.shape[1]), 'queries': len(queries), 'k': k,
+                           'results': results}, f, indent=2)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AllLegalMLTools.case_store import ensure_case_store, CaseStore
+from AllLegalMLTools.search_index import ensure_case_search_index
+from AllLegalMLTools.case_facets import ensure_facet_index
+from AllLegalMLTools.case_autocomplete import ensure_autocomplete_index
+from AllLegalMLTools.semantic_search import ensure_semantic_index, EMBEDDING_BACKENDS, SEMANTIC_INDEX_TYPES
+
+
+class Command(BaseCommand):
+    help = "Build the columnar case store and the search indexes derived from it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', default=settings.CASE_DATASET_CSV, help="Path of the case dataset CSV")
+        parser.add_argument('--store-dir', default=settings.CASE_STORE_DIR, help="Output directory of the columnar store")
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the store is up to date")
+        parser.add_argument('--semantic-backend', choices=sorted(EMBEDDING_BACKENDS), default=settings.CASE_SEMANTIC_BACKEND,
+                            help="Embedding backend of the semantic index")
+        parser.add_argument('--semantic-index-type', choices=SEMANTIC_INDEX_TYPES, default=settings.CASE_SEMANTIC_INDEX_TYPE)
+        parser.add_argument('--skip-semantic', action='store_true', help="Do not build the semantic index")
+
+    def handle(self, *args, **options):
+        store_dir = ensure_case_store(options['csv'], options['store_dir'], force=options['force'])
+        case_store = CaseStore(store_dir)
+        self.stdout.write(self.style.SUCCESS(
+            f"Case store ready at {store_dir}: {len(case_store)} cases, {len(case_store.columns)} columns"
+        ))
+
+        index_dir = ensure_case_search_index(case_store, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Search index ready at {index_dir}"))
+
+        index_dir = ensure_facet_index(case_store, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Facet index ready at {index_dir}"))
+
+        index_dir = ensure_autocomplete_index(case_store, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Autocomplete index ready at {index_dir}"))
+
+        if not options['skip_semantic']:
+            index_dir = ensure_semantic_index(
+                case_store, force=options['force'],
+                backend_name=options['semantic_backend'], index_type=options['semantic_index_type'],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Semantic index ready at {index_dir}"))
@@ -0,0 +1,57 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from AllLegalMLTools.statute_index import ensure_statute_index, ensure_lexical_index
+from AllLegalMLTools.ann_index import INDEX_TYPES
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the statute vector index served by ipc-search/. Only passages that are new or changed "
+        "since the last build are embedded; an interrupted build resumes where it stopped. The BM25 index of "
+        "the lexical and hybrid modes is built with it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdfs', nargs='*', help="Statute PDFs to index (default: IPC_SOURCE_PDFS)")
+        parser.add_argument('--index-dir', default=settings.IPC_VECTOR_INDEX_DIR, help="Output directory of the index")
+        parser.add_argument('--embedding-model', default=settings.IPC_EMBEDDING_MODEL)
+        parser.add_argument('--chunk-size', type=int, default=settings.IPC_CHUNK_SIZE, help="Characters per passage")
+        parser.add_argument('--chunk-overlap', type=int, default=settings.IPC_CHUNK_OVERLAP,
+                            help="Characters a passage repeats of the previous one")
+        parser.add_argument('--index-type', choices=INDEX_TYPES, default=settings.IPC_VECTOR_INDEX_TYPE,
+                            help="FAISS index type, see AllLegalMLTools/ann_index.py")
+        parser.add_argument('--checkpoint-size', type=int, default=settings.IPC_EMBEDDING_CHECKPOINT_SIZE,
+                            help="Passages embedded between two checkpoints")
+        parser.add_argument('--force', action='store_true', help="Rebuild even if the index is up to date")
+        parser.add_argument('--lexical-only', action='store_true',
+                            help="Only build the BM25 index of an existing index directory, e.g. the prebuilt LangChain one")
+
+    def handle(self, *args, **options):
+        if options['chunk_overlap'] >= options['chunk_size']:
+            raise CommandError("--chunk-overlap must be smaller than --chunk-size")
+        started = time.monotonic()
+        if options['lexical_only']:
+            ensure_lexical_index(options['index_dir'], force=options['force'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Lexical index of {options['index_dir']} ready in {time.monotonic() - started:.1f}s"))
+            return
+
+        def progress(done, total):
+            self.stdout.write(f"Embedded {done}/{total} new passages")
+
+        index_dir, meta = ensure_statute_index(
+            options['pdfs'] or None, options['index_dir'], force=options['force'],
+            embedding_model=options['embedding_model'], chunk_size=options['chunk_size'],
+            overlap=options['chunk_overlap'], index_type=options['index_type'], batch_size=options['checkpoint_size'], progress=progress,
+        )
+        if meta is None:
+            # written by an older version, or a lexical index built differently since
+            ensure_lexical_index(index_dir)
+            self.stdout.write(self.style.SUCCESS(f"Vector index at {index_dir} is up to date"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Vector index ready at {index_dir}: {meta['passage_count']} passages, {meta['embedded']} newly embedded, "
+            f"in {time.monotonic() - started:.1f}s"
+        ))
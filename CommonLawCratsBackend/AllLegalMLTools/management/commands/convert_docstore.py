@@ -0,0 +1,25 @@
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from AllLegalMLTools.docstore import convert_langchain_docstore
+
+
+class Command(BaseCommand):
+    help = "Convert the pickled LangChain docstore (index.pkl) of a vector index into the compact memory-mapped docstore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('index_dir', nargs='?', default=settings.IPC_VECTOR_INDEX_DIR,
+                            help="FAISS.save_local() directory (default: IPC_VECTOR_INDEX_DIR)")
+        parser.add_argument('--output-dir', help="Write the docstore here instead of next to index.pkl")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(os.path.join(options['index_dir'], 'index.pkl')):
+            raise CommandError(f"No index.pkl in {options['index_dir']}")
+        started = time.monotonic()
+        count = convert_langchain_docstore(options['index_dir'], options['output_dir'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Docstore of {count} passages written to {options['output_dir'] or options['index_dir']} "
+            f"in {time.monotonic() - started:.2f}s"
+        ))
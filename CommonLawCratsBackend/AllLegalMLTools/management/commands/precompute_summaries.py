@@ -0,0 +1,165 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from openai import RateLimitError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from AllLegalMLTools.case_store import get_case_store, CASE_ID_COLUMN
+from AllLegalMLTools.case_facets import get_facet_index, date_ordinal
+from AllLegalMLTools.chunk_selection import selection_method
+from AllLegalMLTools.summarization import summarize_case, case_summary_key
+from AllLegalMLTools import summary_cache
+
+BATCH_SIZE = 500
+
+
+class RateLimiter:
+    """Spaces out the case starts and holds every worker back after a rate limit error."""
+
+    def __init__(self, per_minute=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+        self.paused_until = 0.0
+
+    def wait(self):
+        with self.lock:
+            start = max(time.monotonic(), self.next_start, self.paused_until)
+            self.next_start = start + self.interval
+        time.sleep(max(0.0, start - time.monotonic()))
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after(error, attempt):
+    """Seconds the API asked us to wait, or an exponential backoff when it did not say."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(60.0, 2.0 ** attempt)
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the cases of the dataset ahead of time. The summaries are pinned in the summary "
+        "cache, which case-search-summary/ reads first, and are never evicted. Every summary is stored "
+        "as soon as it is written, so an interrupted run resumes where it stopped when started again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case-id', action='append', default=[], help="Only this case (repeatable)")
+        parser.add_argument('--judge', action='append', default=[], help="Only cases heard by this judge (repeatable)")
+        parser.add_argument('--disposal-nature', action='append', default=[], help="Only cases with this disposal (repeatable)")
+        parser.add_argument('--decided-from', help="Only cases decided on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--decided-to', help="Only cases decided on or before this date (YYYY-MM-DD)")
+        parser.add_argument('--limit', type=int, help="Summarize at most this many cases")
+        parser.add_argument('--workers', type=int, default=4, help="Cases summarized at the same time")
+        parser.add_argument('--max-per-minute', type=float, help="Start at most this many cases per minute")
+        parser.add_argument('--max-retries', type=int, default=5, help="Attempts per case after rate limit errors")
+        parser.add_argument('--selection', help="Chunk selection method, as the endpoint's selection field")
+        parser.add_argument('--map-reduce', action='store_true', default=None, help="Summarize long cases by map-reduce")
+
+    def rows(self, case_store, options):
+        if options['case_id']:
+            rows = [case_store.lookup(case_id) for case_id in options['case_id']]
+            missing = [case_id for case_id, row in zip(options['case_id'], rows) if row is None]
+            if missing:
+                raise CommandError(f"Unknown case ids: {', '.join(missing)}")
+            rows = np.array(sorted(set(rows)), dtype=np.int64)
+        else:
+            for value in (options['decided_from'], options['decided_to']):
+                if value:
+                    try:
+                        date_ordinal(value)
+                    except ValueError:
+                        raise CommandError("--decided-from and --decided-to must be dates formatted as YYYY-MM-DD")
+            rows = get_facet_index().candidates(
+                judges=options['judge'], disposal_natures=options['disposal_nature'],
+                date_from=options['decided_from'], date_to=options['decided_to'],
+            )
+            if rows is None:
+                rows = np.arange(len(case_store), dtype=np.int64)
+        return rows if options['limit'] is None else rows[:options['limit']]
+
+    def handle(self, *args, **options):
+        try:
+            selection = selection_method(options['selection'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        map_reduce = options['map_reduce']
+        case_store = get_case_store()
+        rows = self.rows(case_store, options)
+        limiter = RateLimiter(options['max_per_minute'])
+        self.stdout.write(f"{len(rows)} cases selected, dataset version {case_store.version}")
+
+        def summarize(case):
+            close_old_connections()
+            try:
+                for attempt in range(options['max_retries'] + 1):
+                    limiter.wait()
+                    try:
+                        summary, cache_hit = summarize_case(case, case_store.version, selection=selection,
+                                                            map_reduce=map_reduce)
+                        break
+                    except RateLimitError as e:
+                        if attempt == options['max_retries']:
+                            raise
+                        limiter.pause(retry_after(e, attempt))
+                summary_cache.pin_summary(case_summary_key(case, case_store.version, selection, map_reduce))
+                return cache_hit
+            finally:
+                close_old_connections()
+
+        done = skipped = reused = 0
+        failed = []
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            pending = {}
+            try:
+                for start in range(0, len(rows), BATCH_SIZE):
+                    cases = case_store.rows(rows[start:start + BATCH_SIZE])
+                    keys = [case_summary_key(case, case_store.version, selection, map_reduce) for case in cases]
+                    # summaries pinned by an earlier run are the checkpoint
+                    finished = summary_cache.pinned_keys(keys)
+                    skipped += len(finished)
+                    for case, key in zip(cases, keys):
+                        if key in finished:
+                            continue
+                        # keep the queue short so an interrupted run has little in flight
+                        while len(pending) >= 2 * options['workers']:
+                            completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in completed:
+                                done, reused = self.collect(future, pending.pop(future), done, reused, failed)
+                        pending[executor.submit(summarize, case)] = case
+                for future in list(pending):
+                    done, reused = self.collect(future, pending.pop(future), done, reused, failed)
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                self.stdout.write(self.style.WARNING("Interrupted, run the command again to resume"))
+                raise
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{done} summaries precomputed ({reused} from the cache), {skipped} already done, "
+            f"{len(failed)} failed in {elapsed:.1f}s"
+        ))
+        for case_id, error in failed:
+            self.stdout.write(self.style.ERROR(f"{case_id}: {error}"))
+
+    def collect(self, future, case, done, reused, failed):
+        try:
+            cache_hit = future.result()
+        except Exception as e:
+            failed.append((case[CASE_ID_COLUMN], e))
+            return done, reused
+        done += 1
+        reused += cache_hit
+        if done % 100 == 0:
+            self.stdout.write(f"{done} summaries precomputed")
+        return done, reused
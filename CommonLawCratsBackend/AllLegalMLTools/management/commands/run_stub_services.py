@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from AllLegalMLTools.stub_services import StubServer, StubLatency
+
+
+class Command(BaseCommand):
+    help = "Serve local stand-ins for the OpenAI API and the chatbot lambda (see AllLegalMLTools/stub_services.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--embedding-latency', type=float, default=0.05, help="Seconds per embeddings request")
+        parser.add_argument('--completion-latency', type=float, default=0.3, help="Seconds before a completion starts")
+        parser.add_argument('--token-latency', type=float, default=0.0, help="Seconds between streamed completion tokens")
+        parser.add_argument('--chatbot-latency', type=float, default=0.5, help="Seconds until a chatbot query completes")
+        parser.add_argument('--pdf-latency', type=float, default=0.02, help="Seconds per sample PDF download")
+
+    def handle(self, *args, **options):
+        latency = StubLatency(
+            embeddings=options['embedding_latency'], completion=options['completion_latency'],
+            completion_token=options['token_latency'], chatbot=options['chatbot_latency'], pdf=options['pdf_latency'],
+        )
+        server = StubServer((options['host'], options['port']), latency)
+        self.stdout.write(self.style.SUCCESS(f"Stub services on {server.url}"))
+        self.stdout.write(f"  OPENAI_BASE_URL={server.url}/v1\n  LAWCHATBOT_URL={server.url}\n  sample PDFs: {server.url}/pdf/<n>.pdf")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
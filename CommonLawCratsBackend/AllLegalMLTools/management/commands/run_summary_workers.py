@@ -0,0 +1,29 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AllLegalMLTools.jobs import WorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run background summary workers that take jobs from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Number of worker threads")
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(options['workers'])
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping, waiting for the running jobs to finish")
+            pool.stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        pool.start()
+        self.stdout.write(self.style.SUCCESS(f"{options['workers']} summary workers running (poll interval {settings.SUMMARY_JOB_POLL_INTERVAL}s)"))
+        # wait on the event rather than join() so the signal handlers get to run
+        while not pool.stop_event.wait(1):
+            pass
+        pool.stop()
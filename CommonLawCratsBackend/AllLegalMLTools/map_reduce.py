@@ -0,0 +1,78 @@
+"""
+Map-reduce summarization of judgments longer than one summary prompt.
+
+The whole document is cut into at most SUMMARY_MAP_MAX_GROUPS groups (of at
+least SUMMARY_TOKEN_BUDGET tokens each) which are condensed concurrently: the
+map stage. The partial summaries are then combined SUMMARY_REDUCE_FAN_OUT at a
+time until they fit into one prompt: the reduce stages. The final summary is
+written from what is left, like from the selected chunks of a short document.
+
+The calls run in a bounded thread pool shared by the whole process. Every stage
+has a timeout; parts that miss it are left out instead of delaying the summary,
+so the latency stays about the same however long the document is.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+
+from .helper_functions_llm import generate_partial_summary, SUMMARY_TOKEN_BUDGET, SUMMARY_SEPARATOR
+from .tokenized_document import token_count
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.SUMMARY_MAP_WORKERS, thread_name_prefix='summary-map')
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def run_stage(texts, timeout, stage_name):
+    """Partial summaries of `texts`, in order, leaving out the ones that failed or missed the timeout."""
+    futures = [_get_pool().submit(generate_partial_summary, text, timeout) for text in texts]
+    with stage(stage_name):
+        done, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    results = []
+    for future in futures:
+        if future not in done:
+            continue
+        if future.exception() is not None:
+            logger.warning("A %s call failed: %s", stage_name, future.exception())
+            continue
+        results.append(future.result())
+    if not results:
+        raise TimeoutError(f"No part of the document was summarized within the {stage_name} timeout")
+    if len(results) < len(texts):
+        logger.warning("%d of %d parts left out of the %s stage", len(texts) - len(results), len(texts), stage_name)
+    return results
+
+
+def map_groups(document):
+    group_tokens = max(SUMMARY_TOKEN_BUDGET, -(-len(document) // settings.SUMMARY_MAP_MAX_GROUPS))
+    return document.chunks(group_tokens)
+
+
+def reduce_partials(partials):
+    fan_out = max(2, settings.SUMMARY_REDUCE_FAN_OUT)
+    # the partials are measured joined like in the final prompt, their summed counts can be lower
+    while len(partials) > 1 and token_count(SUMMARY_SEPARATOR.join(partials)) > SUMMARY_TOKEN_BUDGET:
+        groups = ['\n\n'.join(partials[i:i + fan_out]) for i in range(0, len(partials), fan_out)]
+        partials = run_stage(groups, settings.SUMMARY_REDUCE_TIMEOUT, 'reduce')
+    return partials
+
+
+def map_reduce_inputs(document):
+    """Texts the final summary of a long TokenizedDocument is written from."""
+    return reduce_partials(run_stage(map_groups(document), settings.SUMMARY_MAP_TIMEOUT, 'map'))
@@ -0,0 +1,276 @@
+"""
+Pipeline instrumentation: counters and latency histograms, exposed in the
+Prometheus text format on /metrics.
+
+    with stage('extract'):          time a block into legal_tools_stage_seconds{stage="extract"}
+    count('pdf_pages', pages)       add to a counter (see METRICS for the names)
+
+Stage timings of the current request are also collected by MetricsMiddleware,
+which records the request latency per endpoint and, when METRICS_SERVER_TIMING
+is on, adds them to the response as a Server-Timing header.
+
+Every process keeps its own registry. With several worker processes set
+METRICS_DIR to a directory shared by them: each process then writes a snapshot
+of its registry there (at most once per METRICS_FLUSH_INTERVAL seconds) and
+/metrics adds all snapshots up. Snapshots of processes that are gone are
+deleted, their totals leave the sums like after a counter reset.
+
+/metrics answers requests from METRICS_ALLOWED_IPS and staff users only.
+"""
+import os
+import json
+import ipaddress
+import time
+import atexit
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+PREFIX = 'legal_tools_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRICS_FLUSH_INTERVAL = 1.0
+
+# name -> (type, help)
+METRICS = {
+    'stage_seconds': ('histogram', "Time spent in each stage of the legal tools pipelines"),
+    'request_seconds': ('histogram', "Latency of the legal tools endpoints"),
+    'requests_total': ('counter', "Requests handled, by endpoint and status"),
+    'pdf_downloads_total': ('counter', "PDF downloads, by cache result"),
+    'pdf_bytes_downloaded_total': ('counter', "Bytes of PDF read from the network"),
+    'pdf_documents_total': ('counter', "PDF documents extracted"),
+    'pdf_pages_total': ('counter', "PDF pages extracted"),
+    'tokens_total': ('counter', "Tokens of text, by what they were counted for"),
+    'chunks_total': ('counter', "Chunks, by what they were counted for"),
+    'api_calls_total': ('counter', "Calls of the external APIs"),
+    'summary_cache_total': ('counter', "Summary cache lookups, by result"),
+    'summary_single_flight_total': ('counter', "Uncached summary requests, by whether they did the work or waited for it"),
+}
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.last_flush = 0.0
+
+    def inc(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), dict(h, buckets=list(h['buckets']))]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def maybe_flush(self, force=False):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory or (not force and time.monotonic() - self.last_flush < METRICS_FLUSH_INTERVAL):
+            return
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+
+
+registry = Registry()
+atexit.register(lambda: registry.maybe_flush(force=True))
+
+
+def count(name, value=1, **labels):
+    registry.inc(name, value, labels)
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, labels)
+
+
+def record_stage(name, seconds):
+    observe('stage_seconds', seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+class TimedIterator:
+    """Wraps an iterator, timing only the time spent producing its items (recorded when it is exhausted)."""
+
+    def __init__(self, iterable, name):
+        self.iterator = iter(iterable)
+        self.name = name
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            record_stage(self.name, self.elapsed)
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as another user
+        return True
+    return True
+
+
+def _merged_snapshots():
+    snapshots = []
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        registry.maybe_flush(force=True)
+        for name in os.listdir(directory):
+            pid, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            path = os.path.join(directory, name)
+            if pid.isdigit() and not _process_alive(int(pid)):
+                # an exited or restarted worker, a new process with its pid would overwrite the file anyway
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    else:
+        snapshots.append(registry.snapshot())
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], h['buckets'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+    return counters, histograms
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def exposition():
+    """All metrics in the Prometheus text format."""
+    counters, histograms = _merged_snapshots()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+            continue
+        for (metric, labels), h in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, bucket_count in zip(LATENCY_BUCKETS, h['buckets']):
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {h['sum']}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {h['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_allowed(request):
+    """Staff users, or a client address inside one of the METRICS_ALLOWED_IPS addresses / networks."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden("Metrics are only served to METRICS_ALLOWED_IPS and staff users\n")
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """Times every legal tools request and optionally reports its stages in a Server-Timing header."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/legal-solutions/'):
+            return self.get_response(request)
+        timings = []
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        elapsed = time.perf_counter() - start
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.url_name if match and match.url_name else 'unknown'
+        observe('request_seconds', elapsed, endpoint=endpoint)
+        count('requests_total', endpoint=endpoint, status=response.status_code)
+        if settings.METRICS_SERVER_TIMING:
+            # a streamed response is timed until its headers were ready, the stages run afterwards
+            entries = [f"{name};dur={1000 * seconds:.1f}" for name, seconds in timings]
+            entries.append(f"total;dur={1000 * elapsed:.1f}")
+            response['Server-Timing'] = ', '.join(entries)
+        return response
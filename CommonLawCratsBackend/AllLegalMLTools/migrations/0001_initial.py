@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('summary', models.TextField()),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('size_bytes', models.IntegerField()),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
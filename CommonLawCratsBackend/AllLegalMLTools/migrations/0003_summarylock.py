@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AllLegalMLTools', '0002_summaryjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('owner', models.CharField(max_length=100)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
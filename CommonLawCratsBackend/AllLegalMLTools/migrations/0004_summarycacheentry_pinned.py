@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AllLegalMLTools', '0003_summarylock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='summarycacheentry',
+            name='pinned',
+            field=models.BooleanField(default=False),
+        ),
+    ]
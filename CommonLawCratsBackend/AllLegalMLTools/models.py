@@ -1,3 +1,58 @@
+import uuid
 from django.db import models
 
 # Create your models here.
+
+
+class SummaryCacheEntry(models.Model):
+    # sha256 of the document (pdf bytes or case id + dataset version) together with the model and prompt version
+    key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField()
+    model = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20)
+    size_bytes = models.IntegerField()
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(db_index=True)   # LRU eviction order
+    pinned = models.BooleanField(default=False)            # written by precompute_summaries, never evicted
+
+    def __str__(self):
+        return self.key
+
+
+class SummaryJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    DOCUMENT = 'document'   # uploaded pdf or pdf url, case-summarizer/
+    CASE = 'case'           # case of the dataset, case-search-summary/
+    KIND_CHOICES = [(DOCUMENT, 'Document'), (CASE, 'Case')]
+
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    payload = models.JSONField(default=dict)               # url / case id, whatever the job needs
+    document = models.BinaryField(null=True, blank=True)  # uploaded pdf bytes
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} job {self.job_id} ({self.status})"
+
+
+class SummaryLock(models.Model):
+    # summary cache key of the summary being written, see single_flight.py
+    key = models.CharField(max_length=64, unique=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()   # another process may take the lock over after this
+
+    def __str__(self):
+        return f"{self.key} ({self.owner})"
@@ -0,0 +1,60 @@
+"""
+Cursor pagination and incremental JSON streaming for the search endpoints.
+
+Cursors are opaque to the client: a base64 encoded offset bound to the
+dataset version, so a cursor taken before the dataset was rebuilt is
+rejected instead of silently pointing into a different result list.
+"""
+import json
+import base64
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(offset, version):
+    payload = json.dumps({'o': offset, 'v': version}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor, version):
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        offset = int(payload['o'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if payload.get('v') != version or offset < 0:
+        raise InvalidCursor("Cursor has expired, please repeat the search")
+    return offset
+
+
+def parse_limit(value, default, maximum):
+    if value in (None, ''):
+        return default
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+def stream_json_rows(header, rows, footer, batch_size=200):
+    """
+    Yield a JSON object `{**header, "results": [...rows], **footer}` piece by piece.
+    `rows` is an iterable of row batches (lists of dicts), so the caller can build them lazily.
+    """
+    head = json.dumps(header)
+    yield head[:-1] + (', ' if header else '') + '"results": ['
+    first = True
+    for batch in rows:
+        for start in range(0, len(batch), batch_size):
+            chunk = ','.join(json.dumps(row) for row in batch[start:start + batch_size])
+            if not chunk:
+                continue
+            yield chunk if first else ',' + chunk
+            first = False
+    tail = json.dumps(footer)
+    yield ']' + (', ' + tail[1:] if footer else '}')
@@ -0,0 +1,212 @@
+"""
+Downloader for case PDFs.
+
+All downloads go through one pooled keep-alive session per process, are read
+in chunks with a timeout, and are cut off at PDF_DOWNLOAD_MAX_BYTES. Responses
+are cached on disk in PDF_CACHE_DIR, keyed by a hash of the URL:
+
+    <key>.pdf   the body
+    <key>.json  url, ETag, Last-Modified, size and when it was last validated
+
+A cached PDF younger than PDF_CACHE_FRESH_SECONDS is served without touching
+the network; an older one is revalidated with a conditional GET, and a 304
+serves it again. The modification time of the .pdf file records its last use;
+when the cache grows past PDF_CACHE_MAX_BYTES the least recently used entries
+are deleted.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from .metrics import stage, count
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+POOL_SIZE = 16
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+class PDFTooLarge(ValueError):
+    pass
+
+
+class PDFDownloadError(ValueError):
+    """The PDF server failed, refused or timed out."""
+
+
+def get_session():
+    """Process wide session, created again after a fork so sockets are never shared."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=('GET',))
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def _paths(url, cache_dir):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key + '.pdf'), os.path.join(cache_dir, key + '.json')
+
+
+def _read_entry(url, cache_dir):
+    pdf_path, meta_path = _paths(url, cache_dir)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(pdf_path, 'rb') as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+    if meta.get('url') != url or meta.get('size') != len(body):
+        return None, None
+    return meta, body
+
+
+def _write_file(path, data, cache_dir):
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _write_entry(url, meta, body, cache_dir):
+    pdf_path, meta_path = _paths(url, cache_dir)
+    # body first: a reader only trusts a body whose size matches the metadata
+    if body is not None:
+        _write_file(pdf_path, body, cache_dir)
+    _write_file(meta_path, json.dumps(meta).encode('utf-8'), cache_dir)
+
+
+def _touch(url, cache_dir):
+    try:
+        os.utime(_paths(url, cache_dir)[0])
+    except OSError:
+        pass
+
+
+def evict(cache_dir=None, max_bytes=None):
+    """Delete least recently used PDFs until the cache fits in `max_bytes`."""
+    cache_dir = cache_dir or settings.PDF_CACHE_DIR
+    max_bytes = settings.PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        entries, total = [], 0
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.pdf'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            for doomed in (path, path[:-len('.pdf')] + '.json'):
+                try:
+                    os.unlink(doomed)
+                except OSError:
+                    pass
+            total -= size
+
+
+def _fetch(url, headers, max_bytes, timeout):
+    try:
+        with get_session().get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                return response, None
+            if response.status_code != 200:
+                raise PDFDownloadError(f"Unable to download PDF from the provided URL (HTTP {response.status_code})")
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise PDFTooLarge(f"PDF is larger than {max_bytes} bytes")
+            body = bytearray()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body += chunk
+                if len(body) > max_bytes:
+                    raise PDFTooLarge(f"PDF is larger than {max_bytes} bytes")
+            return response, bytes(body)
+    except requests.RequestException as e:
+        # timeouts, connection errors and retries given up on
+        raise PDFDownloadError(f"Unable to download PDF from the provided URL ({type(e).__name__})") from e
+
+
+def cache_pdf(url, body, cache_dir=None):
+    """Put a PDF into the cache as a fresh download of `url`, e.g. to seed an offline benchmark."""
+    cache_dir = cache_dir or settings.PDF_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_entry(url, {'url': url, 'etag': None, 'last_modified': None, 'size': len(body),
+                       'validated_at': time.time()}, body, cache_dir)
+
+
+def download_pdf(url, cache_dir=None, max_bytes=None, timeout=None):
+    """Bytes of the PDF at `url`, from the disk cache whenever it is still valid."""
+    with stage('download'):
+        return _download_pdf(url, cache_dir, max_bytes, timeout)
+
+
+def _download_pdf(url, cache_dir, max_bytes, timeout):
+    cache_dir = cache_dir or settings.PDF_CACHE_DIR
+    max_bytes = settings.PDF_DOWNLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    timeout = timeout or settings.PDF_DOWNLOAD_TIMEOUT
+    os.makedirs(cache_dir, exist_ok=True)
+
+    meta, body = _read_entry(url, cache_dir)
+    headers = {}
+    if meta is not None:
+        if time.time() - meta['validated_at'] < settings.PDF_CACHE_FRESH_SECONDS:
+            _touch(url, cache_dir)
+            count('pdf_downloads_total', cache='fresh')
+            return body
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    response, fetched = _fetch(url, headers, max_bytes, timeout)
+    if fetched is None:
+        if meta is None:
+            raise PDFDownloadError("Unable to download PDF from the provided URL")
+        # 304 Not Modified, the cached copy is still current
+        count('pdf_downloads_total', cache='revalidated')
+        meta['validated_at'] = time.time()
+        _write_entry(url, meta, None, cache_dir)
+        _touch(url, cache_dir)
+        return body
+
+    count('pdf_downloads_total', cache='miss')
+    count('pdf_bytes_downloaded_total', len(fetched))
+    if 'no-store' not in response.headers.get('Cache-Control', ''):
+        _write_entry(url, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': len(fetched),
+            'validated_at': time.time(),
+        }, fetched, cache_dir)
+        try:
+            evict(cache_dir)
+        except OSError:
+            logger.exception("PDF cache eviction failed")
+    return fetched
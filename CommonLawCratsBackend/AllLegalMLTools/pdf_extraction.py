@@ -0,0 +1,166 @@
+"""
+PDF text extraction.
+
+iter_pages() yields the text of every page in order. Small documents are read
+in the calling thread; documents with at least PDF_PARALLEL_MIN_PAGES pages are
+split into page ranges that are extracted in a process pool (PyMuPDF holds the
+GIL), and the pages of each range are yielded as soon as it and the ranges
+before it are done, so the caller can start working on the first pages while
+the rest is still being extracted. The document is written to a temporary file
+once and the workers open that path, rather than each task receiving a pickled
+copy of the bytes.
+
+Extracted pages are kept in a per process LRU cache keyed by the SHA-256 of the
+document bytes, bounded by PDF_PAGE_CACHE_MAX_BYTES of UTF-8 encoded text.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+import fitz
+from django.conf import settings
+
+from .metrics import count
+
+# newlines and carriage returns become spaces, in one str.translate pass
+CLEAN_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
+
+_page_cache = OrderedDict()
+_page_cache_bytes = 0
+_page_cache_lock = threading.Lock()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def document_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def clean_text(text):
+    return text.translate(CLEAN_TABLE).strip()
+
+
+def _open(pdf_bytes):
+    document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    if document.page_count == 0:
+        raise ValueError("The provided PDF file is empty")
+    return document
+
+
+def _extract_range(path, start, stop):
+    # runs in the pool's worker processes
+    with fitz.open(path, filetype="pdf") as document:
+        return [document.load_page(page_num).get_text() for page_num in range(start, stop)]
+
+
+def _get_pool():
+    """Process pool of this process, created on first use (and again after a fork)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawned workers, forking a threaded web server is not safe
+            _pool = ProcessPoolExecutor(max_workers=settings.PDF_EXTRACTION_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def cached_pages(key):
+    with _page_cache_lock:
+        pages = _page_cache.get(key)
+        if pages is not None:
+            _page_cache.move_to_end(key)
+        return pages
+
+
+def _pages_size(pages):
+    return sum(len(page.encode('utf-8')) for page in pages)
+
+
+def cache_pages(key, pages):
+    global _page_cache_bytes
+    size = _pages_size(pages)
+    max_bytes = settings.PDF_PAGE_CACHE_MAX_BYTES
+    if size > max_bytes:
+        return
+    with _page_cache_lock:
+        if key in _page_cache:
+            return
+        _page_cache[key] = pages
+        _page_cache_bytes += size
+        while _page_cache_bytes > max_bytes:
+            _, evicted = _page_cache.popitem(last=False)
+            _page_cache_bytes -= _pages_size(evicted)
+
+
+def _page_ranges(page_count, workers):
+    # a few ranges per worker, so the first pages are ready early and the load stays even
+    size = max(1, -(-page_count // (workers * 2)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _iter_extracted(pdf_bytes):
+    document = _open(pdf_bytes)
+    page_count = document.page_count
+    if page_count < settings.PDF_PARALLEL_MIN_PAGES or settings.PDF_EXTRACTION_WORKERS <= 1:
+        with document:
+            for page_num in range(page_count):
+                yield document.load_page(page_num).get_text()
+        return
+    document.close()
+
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    futures = []
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf_bytes)
+        pool = _get_pool()
+        futures = [pool.submit(_extract_range, path, start, stop)
+                   for start, stop in _page_ranges(page_count, settings.PDF_EXTRACTION_WORKERS)]
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        # ranges already running still read the file
+        wait(futures)
+        os.unlink(path)
+
+
+def iter_pages(pdf_bytes):
+    """Text of every page of the PDF, in order."""
+    if not pdf_bytes:
+        raise ValueError("No PDF file provided")
+    key = document_hash(pdf_bytes)
+    pages = cached_pages(key)
+    if pages is not None:
+        yield from pages
+        return
+
+    pages = []
+    for page in _iter_extracted(pdf_bytes):
+        pages.append(page)
+        yield page
+    count('pdf_documents_total')
+    count('pdf_pages_total', len(pages))
+    cache_pages(key, tuple(pages))
+
+
+def iter_clean_pages(pdf_bytes):
+    """Pages with newlines replaced, ready to be tokenized one by one."""
+    for page in iter_pages(pdf_bytes):
+        yield page.translate(CLEAN_TABLE)
+
+
+def extract_pages(pdf_bytes):
+    return list(iter_pages(pdf_bytes))
+
+
+def extract_text(pdf_bytes):
+    """Cleaned text of the whole document: the pages are joined and cleaned once each."""
+    return clean_text(''.join(iter_pages(pdf_bytes)))
@@ -0,0 +1,325 @@
+"""
+BM25 inverted index with compact, memory-mapped posting lists.
+
+Layout of an index directory:
+    meta.json              -> doc count, average doc length, BM25 parameters, fields
+    terms.json             -> vocabulary, term -> term id
+    term_offsets.npy       -> int64, postings of term t are [term_offsets[t]:term_offsets[t + 1]]
+    postings_docs.npy      -> uint32 doc ids, sorted inside every posting list
+    postings_tf.npy        -> float32 (field weighted) term frequencies
+    position_offsets.npy   -> int64, positions of posting i are [position_offsets[i]:position_offsets[i + 1]]
+    positions.npy          -> uint32 token positions inside the document, sorted inside every posting
+    doc_lengths.npy        -> float32 (field weighted) document lengths
+
+Query syntax: whitespace separated terms are AND-ed, `OR` separates
+alternatives and "double quoted" text is a phrase,
+e.g.  `murder "common intention" OR culpable homicide`
+Phrases are matched on the stored positions, the documents are never read.
+"""
+import os
+import re
+import json
+import threading
+import numpy as np
+from django.conf import settings
+
+from .case_store import get_case_store, make_build_directory, replace_directory, build_lock, IndexUnavailable
+
+INDEX_FORMAT_VERSION = 2
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# fields of the case dataset that are searchable, with their weight in the term frequency
+CASE_SEARCH_FIELDS = {'Case Title': 2.0, 'Case No': 2.0, 'details': 1.0}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def parse_query(query):
+    """
+    Split a query into OR-ed clauses. Every clause is a pair (terms, phrases):
+    all terms must match and every phrase (a list of terms) must appear verbatim.
+    """
+    clauses = []
+    terms, phrases = [], []
+    for match in QUERY_RE.finditer(query):
+        phrase, word = match.groups()
+        if word == 'OR':
+            if terms or phrases:
+                clauses.append((terms, phrases))
+            terms, phrases = [], []
+        elif word is not None:
+            terms.extend(tokenize(word))
+        else:
+            phrase_terms = tokenize(phrase)
+            if len(phrase_terms) == 1:
+                terms.extend(phrase_terms)
+            elif phrase_terms:
+                phrases.append(phrase_terms)
+    if terms or phrases:
+        clauses.append((terms, phrases))
+    return clauses
+
+
+class SearchResult:
+    def __init__(self, docs, scores, total, matched=None):
+        self.docs = docs        # doc ids, best first
+        self.scores = scores
+        self.total = total      # number of matching documents, not only the returned top-k
+        # every matching doc id (sorted), used for facet counts
+        self.matched = docs if matched is None else matched
+
+    def __len__(self):
+        return len(self.docs)
+
+
+class BM25Index:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, 'terms.json')) as f:
+            self.terms = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode='r')
+
+        self.term_offsets = load('term_offsets.npy')
+        self.postings_docs = load('postings_docs.npy')
+        self.postings_tf = load('postings_tf.npy')
+        self.position_offsets = load('position_offsets.npy')
+        self.positions = load('positions.npy')
+        self.doc_lengths = load('doc_lengths.npy')
+        self.doc_count = self.meta['doc_count']
+        self.avg_doc_length = self.meta['avg_doc_length'] or 1.0
+        self.k1 = self.meta['k1']
+        self.b = self.meta['b']
+
+    def posting_range(self, term):
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return 0, 0
+        return int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+
+    def postings(self, term):
+        start, end = self.posting_range(term)
+        return self.postings_docs[start:end], self.postings_tf[start:end]
+
+    def position_keys(self, term, docs):
+        """doc << 32 | position of every occurrence of `term` in `docs` (sorted doc ids that all contain it)."""
+        start, end = self.posting_range(term)
+        postings = start + np.searchsorted(self.postings_docs[start:end], docs)
+        first = self.position_offsets[postings]
+        lengths = self.position_offsets[postings + 1] - first
+        # the positions of all those postings, gathered in one go
+        index = np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return (np.repeat(docs.astype(np.int64), lengths) << 32) + self.positions[index].astype(np.int64)
+
+    def phrase_docs(self, docs, phrase):
+        """The `docs` (sorted, containing every term of `phrase`) in which the terms of `phrase` follow each other."""
+        starts = None
+        for offset, term in enumerate(phrase):
+            keys = self.position_keys(term, docs)
+            # where the phrase would start if this occurrence is its offset-th term
+            keys = keys[(keys & 0xFFFFFFFF) >= offset] - offset
+            starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+            if len(starts) == 0:
+                break
+        return np.unique(starts >> 32).astype(docs.dtype)
+
+    def idf(self, doc_freq):
+        return np.log1p((self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def match(self, clauses, candidates=None):
+        """Sorted doc ids matching any clause."""
+        matched = np.empty(0, dtype=np.uint32)
+        for terms, phrases in clauses:
+            clause_terms = set(terms)
+            for phrase in phrases:
+                clause_terms.update(phrase)
+            # intersect the shortest posting lists first
+            posting_lists = sorted((self.postings(term)[0] for term in clause_terms), key=len)
+            docs = posting_lists[0]
+            for other in posting_lists[1:]:
+                if len(docs) == 0:
+                    break
+                docs = np.intersect1d(docs, other, assume_unique=True)
+            if candidates is not None:
+                # filter before the (comparatively expensive) phrase check
+                docs = np.intersect1d(docs, candidates, assume_unique=True)
+
+            for phrase in phrases:
+                if len(docs) == 0:
+                    break
+                docs = self.phrase_docs(docs, phrase)
+
+            matched = np.union1d(matched, docs)
+        return matched
+
+    def score(self, docs, terms):
+        scores = np.zeros(len(docs), dtype=np.float32)
+        lengths = self.doc_lengths[docs]
+        norm = self.k1 * (1 - self.b + self.b * lengths / self.avg_doc_length)
+        for term in set(terms):
+            term_docs, term_tf = self.postings(term)
+            if len(term_docs) == 0:
+                continue
+            # position of every candidate inside the posting list, both are sorted
+            pos = np.searchsorted(term_docs, docs)
+            pos[pos == len(term_docs)] = 0
+            present = term_docs[pos] == docs
+            tf = np.where(present, term_tf[pos], 0)
+            scores += self.idf(len(term_docs)) * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k=10, candidates=None):
+        """
+        Ranked retrieval. `candidates` (sorted doc ids) restricts the result set,
+        e.g. to apply filters computed elsewhere.
+        """
+        clauses = parse_query(query)
+        if not clauses:
+            return SearchResult(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0)
+
+        docs = self.match(clauses, candidates)
+
+        all_terms = [term for terms, phrases in clauses for term in terms + sum(phrases, [])]
+        scores = self.score(docs, all_terms)
+
+        total = len(docs)
+        if top_k is not None and top_k < total:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(total)
+        # ties are broken by doc id so the order is stable between calls
+        best = best[np.lexsort((docs[best], -scores[best]))]
+        return SearchResult(docs[best].astype(np.int64), scores[best], total, matched=docs.astype(np.int64))
+
+
+def build_bm25_index(documents, index_dir, k1=1.2, b=0.75, extra_meta=None):
+    """
+    Build an index from `documents`, an iterable of {field_name: (text, weight)} dicts,
+    doc ids are the positions in the iterable.
+    """
+    vocabulary = {}
+    doc_ids, term_ids, tfs = [], [], []
+    occurrence_docs, occurrence_terms, occurrence_positions = [], [], []
+    doc_lengths = []
+
+    for doc_id, fields in enumerate(documents):
+        weights = {}
+        terms, positions, position = [], [], 0
+        for text, weight in fields.values():
+            for token in tokenize(text):
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                weights[term_id] = weights.get(term_id, 0.0) + weight
+                terms.append(term_id)
+                positions.append(position)
+                position += 1
+            # a gap between the fields, a phrase never runs from one into the next
+            position += 1
+        doc_lengths.append(sum(weights.values()))
+        if weights:
+            doc_ids.append(np.full(len(weights), doc_id, dtype=np.uint32))
+            term_ids.append(np.fromiter(weights.keys(), dtype=np.uint32, count=len(weights)))
+            tfs.append(np.fromiter(weights.values(), dtype=np.float32, count=len(weights)))
+            occurrence_docs.append(np.full(len(terms), doc_id, dtype=np.uint32))
+            occurrence_terms.append(np.asarray(terms, dtype=np.uint32))
+            occurrence_positions.append(np.asarray(positions, dtype=np.uint32))
+
+    def concatenate(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    doc_ids, term_ids, tfs = concatenate(doc_ids, np.uint32), concatenate(term_ids, np.uint32), concatenate(tfs, np.float32)
+    occurrence_docs = concatenate(occurrence_docs, np.uint32)
+    occurrence_terms = concatenate(occurrence_terms, np.uint32)
+    occurrence_positions = concatenate(occurrence_positions, np.uint32)
+
+    # group the postings by term, doc ids stay sorted inside every group
+    order = np.lexsort((doc_ids, term_ids))
+    term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=term_offsets[1:])
+
+    # the occurrences in the same (term, doc) order, every run of equal pairs is one posting's positions
+    occurrence_order = np.lexsort((occurrence_positions, occurrence_docs, occurrence_terms))
+    occurrence_docs, occurrence_terms = occurrence_docs[occurrence_order], occurrence_terms[occurrence_order]
+    new_posting = np.ones(len(occurrence_order), dtype=bool)
+    new_posting[1:] = (occurrence_terms[1:] != occurrence_terms[:-1]) | (occurrence_docs[1:] != occurrence_docs[:-1])
+    position_offsets = np.append(np.flatnonzero(new_posting), len(occurrence_order)).astype(np.int64)
+
+    doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+    meta = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'doc_count': len(doc_lengths),
+        'avg_doc_length': float(doc_lengths.mean()) if len(doc_lengths) else 0.0,
+        'k1': k1,
+        'b': b,
+        **(extra_meta or {}),
+    }
+
+    tmp_dir = make_build_directory(index_dir)
+    np.save(os.path.join(tmp_dir, 'term_offsets.npy'), term_offsets)
+    np.save(os.path.join(tmp_dir, 'postings_docs.npy'), doc_ids[order])
+    np.save(os.path.join(tmp_dir, 'postings_tf.npy'), tfs[order])
+    np.save(os.path.join(tmp_dir, 'position_offsets.npy'), position_offsets)
+    np.save(os.path.join(tmp_dir, 'positions.npy'), occurrence_positions[occurrence_order])
+    np.save(os.path.join(tmp_dir, 'doc_lengths.npy'), doc_lengths)
+    with open(os.path.join(tmp_dir, 'terms.json'), 'w') as f:
+        json.dump(vocabulary, f)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(tmp_dir, index_dir)
+    return meta
+
+
+def _index_is_current(index_dir, dataset_version):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('format_version') == INDEX_FORMAT_VERSION and meta.get('dataset_version') == dataset_version
+
+
+def build_case_search_index(case_store=None, index_dir=None):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_SEARCH_INDEX_DIR
+    columns = {name: case_store.column(name) for name in CASE_SEARCH_FIELDS}
+    documents = (
+        {name: (columns[name][row], weight) for name, weight in CASE_SEARCH_FIELDS.items()}
+        for row in range(len(case_store))
+    )
+    return build_bm25_index(documents, index_dir, extra_meta={
+        'dataset_version': case_store.version,
+        'fields': list(CASE_SEARCH_FIELDS),
+    })
+
+
+def ensure_case_search_index(case_store=None, index_dir=None, force=False):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_SEARCH_INDEX_DIR
+    if not force and _index_is_current(index_dir, case_store.version):
+        return index_dir
+    with build_lock(index_dir):
+        if force or not _index_is_current(index_dir, case_store.version):
+            build_case_search_index(case_store, index_dir)
+    return index_dir
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_case_search_index():
+    """Process wide BM25 index over the case dataset, opened on first use and built by `manage.py build_case_indexes`."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not _index_is_current(settings.CASE_SEARCH_INDEX_DIR, get_case_store().version):
+                    raise IndexUnavailable(
+                        "The keyword search index is missing or out of date, build it with `manage.py build_case_indexes`")
+                _index = BM25Index(settings.CASE_SEARCH_INDEX_DIR)
+    return _index
@@ -0,0 +1,233 @@
+"""
+Semantic (nearest neighbour) search over the case dataset.
+
+An offline step embeds the title and details of every case in batches and
+stores an approximate nearest neighbour FAISS index (any of the ann_index.py
+types, inner product over L2 normalised vectors) in CASE_SEMANTIC_INDEX_DIR. At query
+time only the query is embedded; the index is opened memory-mapped, so the
+corpus itself is never read.
+
+Embedding backends are pluggable (CASE_SEMANTIC_BACKEND):
+    'hashing' -> local hashed TF-IDF vectors, no network access needed
+    'openai'  -> OpenAI embeddings through helper_functions_llm
+"""
+import os
+import json
+import threading
+import numpy as np
+import faiss
+from django.conf import settings
+
+from .case_store import get_case_store, make_build_directory, replace_directory, build_lock, IndexUnavailable
+from .search_index import SearchResult
+from .ann_index import INDEX_TYPES, make_vector_index, set_search_parameters, training_sample_size, train_vector_index
+
+SEMANTIC_FORMAT_VERSION = 1
+EMBED_BATCH_SIZE = 256
+# OpenAI input limit is 8191 tokens, stay comfortably below it in characters
+MAX_DOCUMENT_CHARS = 8000
+
+
+class HashingEmbeddingBackend:
+    """Hashed unigram/bigram counts with sublinear tf and corpus idf, L2 normalised."""
+    name = 'hashing'
+
+    def __init__(self, dim=1024):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.dim = dim
+        self.vectorizer = HashingVectorizer(
+            n_features=dim, ngram_range=(1, 2), alternate_sign=False, norm=None, lowercase=True,
+        )
+        self.idf = np.ones(dim, dtype=np.float32)
+
+    def fit(self, batches):
+        doc_freq = np.zeros(self.dim, dtype=np.int64)
+        doc_count = 0
+        for texts in batches:
+            counts = self.vectorizer.transform(texts)
+            doc_freq += np.bincount(counts.indices, minlength=self.dim)
+            doc_count += counts.shape[0]
+        self.idf = (np.log((1 + doc_count) / (1 + doc_freq)) + 1).astype(np.float32)
+
+    def embed(self, texts):
+        counts = self.vectorizer.transform(texts).astype(np.float32)
+        counts.data = np.log1p(counts.data)
+        vectors = counts.multiply(self.idf).toarray().astype(np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def save(self, directory):
+        np.save(os.path.join(directory, 'idf.npy'), self.idf)
+
+    def load(self, directory):
+        self.idf = np.load(os.path.join(directory, 'idf.npy'))
+
+
+class OpenAIEmbeddingBackend:
+    name = 'openai'
+    dim = 3072
+
+    def fit(self, batches):
+        pass
+
+    def embed(self, texts):
+        from .helper_functions_llm import generate_embeddings
+        vectors = np.ascontiguousarray(generate_embeddings(texts), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def save(self, directory):
+        pass
+
+    def load(self, directory):
+        pass
+
+
+EMBEDDING_BACKENDS = {
+    HashingEmbeddingBackend.name: HashingEmbeddingBackend,
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+}
+
+
+def get_embedding_backend(name):
+    try:
+        return EMBEDDING_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown embedding backend '{name}', expected one of {sorted(EMBEDDING_BACKENDS)}")
+
+
+def _document_batches(case_store, rows=None, batch_size=EMBED_BATCH_SIZE):
+    titles = case_store.column('Case Title')
+    details = case_store.column('details')
+    rows = np.arange(len(case_store)) if rows is None else rows
+    for start in range(0, len(rows), batch_size):
+        yield [f"{titles[row]}\n{details[row][:MAX_DOCUMENT_CHARS]}" for row in rows[start:start + batch_size]]
+
+
+# 'ivf' is the name of 'ivf_flat' in settings and indexes from before ann_index.py
+SEMANTIC_INDEX_TYPES = ('ivf',) + INDEX_TYPES
+
+
+def make_ann_index(index_type, dim, doc_count):
+    return make_vector_index('ivf_flat' if index_type == 'ivf' else index_type, dim, doc_count, faiss.METRIC_INNER_PRODUCT)
+
+
+def build_semantic_index(case_store=None, index_dir=None, backend_name=None, index_type=None, seed=0):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_SEMANTIC_INDEX_DIR
+    backend = get_embedding_backend(backend_name or settings.CASE_SEMANTIC_BACKEND)
+    index_type = index_type or settings.CASE_SEMANTIC_INDEX_TYPE
+
+    backend.fit(_document_batches(case_store))
+    index = make_ann_index(index_type, backend.dim, len(case_store))
+
+    # the index is trained on a random sample of the cases, embedded first and kept in memory;
+    # the other vectors are then embedded and added batch by batch
+    train_size = min(training_sample_size(index), len(case_store))
+    sample_rows = np.sort(np.random.default_rng(seed).choice(len(case_store), train_size, replace=False))
+    if train_size:
+        sample = np.concatenate([backend.embed(texts) for texts in _document_batches(case_store, sample_rows)])
+        train_vector_index(index, sample)
+    in_sample = np.zeros(len(case_store), dtype=bool)
+    in_sample[sample_rows] = True
+    for start in range(0, len(case_store), EMBED_BATCH_SIZE):
+        rows = np.arange(start, min(start + EMBED_BATCH_SIZE, len(case_store)))
+        sampled = in_sample[rows]
+        vectors = np.empty((len(rows), backend.dim), dtype=np.float32)
+        if sampled.any():
+            vectors[sampled] = sample[np.searchsorted(sample_rows, rows[sampled])]
+        if not sampled.all():
+            vectors[~sampled] = backend.embed(next(_document_batches(case_store, rows[~sampled])))
+        index.add(vectors)
+
+    tmp_dir = make_build_directory(index_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, 'index.faiss'))
+    backend.save(tmp_dir)
+    meta = {
+        'format_version': SEMANTIC_FORMAT_VERSION,
+        'dataset_version': case_store.version,
+        'backend': backend.name,
+        'index_type': index_type,
+        'dim': backend.dim,
+        'doc_count': len(case_store),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(tmp_dir, index_dir)
+    return meta
+
+
+def _read_meta(index_dir):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SemanticIndexUnavailable(IndexUnavailable):
+    """There is no semantic index for the current dataset and settings."""
+
+
+def semantic_index_is_current(case_store, index_dir, backend_name=None, index_type=None):
+    meta = _read_meta(index_dir)
+    return bool(meta) and meta['format_version'] == SEMANTIC_FORMAT_VERSION \
+        and meta['dataset_version'] == case_store.version \
+        and meta['backend'] == (backend_name or settings.CASE_SEMANTIC_BACKEND) \
+        and meta['index_type'] == (index_type or settings.CASE_SEMANTIC_INDEX_TYPE)
+
+
+def ensure_semantic_index(case_store=None, index_dir=None, force=False, **build_options):
+    case_store = case_store or get_case_store()
+    index_dir = index_dir or settings.CASE_SEMANTIC_INDEX_DIR
+
+    def is_current():
+        return semantic_index_is_current(case_store, index_dir, build_options.get('backend_name'),
+                                         build_options.get('index_type'))
+
+    if not force and is_current():
+        return index_dir
+    with build_lock(index_dir):
+        if force or not is_current():
+            build_semantic_index(case_store, index_dir, **build_options)
+    return index_dir
+
+
+class SemanticIndex:
+    def __init__(self, directory):
+        self.meta = _read_meta(directory)
+        self.backend = get_embedding_backend(self.meta['backend'])
+        self.backend.load(directory)
+        self.index = faiss.read_index(os.path.join(directory, 'index.faiss'), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        set_search_parameters(self.index, nprobe=settings.CASE_SEMANTIC_NPROBE, ef_search=settings.CASE_SEMANTIC_EF_SEARCH)
+
+    def search(self, query, top_k=10):
+        top_k = min(top_k, self.index.ntotal)
+        if not query.strip() or top_k <= 0:
+            return SearchResult(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), 0)
+        query_vector = self.backend.embed([query])
+        scores, docs = self.index.search(query_vector, top_k)
+        # FAISS pads with -1 when fewer than top_k neighbours are reachable
+        found = docs[0] >= 0
+        docs, scores = docs[0][found].astype(np.int64), scores[0][found]
+        return SearchResult(docs, scores, len(docs))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_semantic_index():
+    """
+    Process wide semantic index, opened on first use. It is never built here:
+    with the openai backend that would embed the whole corpus inside a request.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not semantic_index_is_current(get_case_store(), settings.CASE_SEMANTIC_INDEX_DIR):
+                    raise SemanticIndexUnavailable(
+                        "The semantic index is missing or out of date, build it with `manage.py build_case_indexes`")
+                _index = SemanticIndex(settings.CASE_SEMANTIC_INDEX_DIR)
+    return _index
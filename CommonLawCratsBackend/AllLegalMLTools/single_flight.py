@@ -0,0 +1,159 @@
+"""
+Single-flight summaries: identical requests that arrive together share one run
+of the pipeline instead of each downloading, embedding and summarizing the same
+document.
+
+Requests are identified by their summary cache key (document hash or case id,
+see summary_cache.py). The first request for a key becomes its leader:
+
+- inside a process it registers a Flight; concurrent duplicates wait on it and
+  get the leader's summary (or its exception) directly,
+- across processes it holds a SummaryLock row, the database being the store
+  all web processes and job workers already share. Duplicates in other
+  processes poll the summary cache until the summary appears, or the lock is
+  released / expires without one, in which case one of them takes over.
+
+A lock expires after SUMMARY_SINGLE_FLIGHT_LEASE seconds so a crashed leader
+never blocks a key for good, and nobody waits longer than
+SUMMARY_SINGLE_FLIGHT_WAIT before doing the work itself.
+"""
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+
+from .models import SummaryLock
+from .metrics import count
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _acquire_lock(key, owner):
+    expires_at = now() + timedelta(seconds=settings.SUMMARY_SINGLE_FLIGHT_LEASE)
+    try:
+        with transaction.atomic():
+            SummaryLock.objects.create(key=key, owner=owner, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        # held by another process, unless its lease ran out
+        return bool(SummaryLock.objects.filter(key=key, expires_at__lt=now()).update(owner=owner, expires_at=expires_at))
+
+
+def _lock_held(key):
+    return SummaryLock.objects.filter(key=key, expires_at__gte=now()).exists()
+
+
+class Lease:
+    """Leadership of a key, held until release(); set `result` before releasing to hand it to waiters."""
+
+    def __init__(self, key, flight, owner):
+        self.key = key
+        self.flight = flight
+        self.owner = owner
+
+    @property
+    def result(self):
+        return self.flight.result
+
+    @result.setter
+    def result(self, value):
+        self.flight.result = value
+
+    def release(self, error=None):
+        SummaryLock.objects.filter(key=self.key, owner=self.owner).delete()
+        self.flight.error = error
+        with _flights_lock:
+            if _flights.get(self.key) is self.flight:
+                del _flights[self.key]
+        self.flight.done.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # a client closing a stream is no failure of the summary, waiters just retry
+        self.release(exc if isinstance(exc, Exception) else None)
+        return False
+
+
+def try_lead(key):
+    """A Lease when nobody else is working on `key`, else None."""
+    flight = Flight()
+    with _flights_lock:
+        if key in _flights:
+            return None
+        _flights[key] = flight
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    try:
+        locked = _acquire_lock(key, owner)
+    except Exception as e:
+        Lease(key, flight, owner).release(e)
+        raise
+    if not locked:
+        Lease(key, flight, owner).release()
+        return None
+    return Lease(key, flight, owner)
+
+
+def wait_for(key, lookup, deadline):
+    """
+    Wait for the leader of `key`. Returns its result, or None when it gave up
+    without one (or the deadline passed) and the caller should try to lead.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+    if flight is not None:
+        flight.done.wait(max(0.0, deadline - time.monotonic()))
+        if flight.error is not None:
+            raise flight.error
+        return flight.result if flight.result is not None else lookup()
+
+    while time.monotonic() < deadline:
+        result = lookup()
+        if result is not None or not _lock_held(key):
+            return result
+        time.sleep(settings.SUMMARY_SINGLE_FLIGHT_POLL_INTERVAL)
+    return None
+
+
+def single_flight(key, compute, lookup):
+    """
+    compute() once for all concurrent callers with the same key. lookup() reads
+    the shared result (the summary cache) and returns None while there is none.
+    Returns (result, computed): computed is False when the result came from
+    another caller or was found by lookup().
+    """
+    deadline = time.monotonic() + settings.SUMMARY_SINGLE_FLIGHT_WAIT
+    while True:
+        lease = try_lead(key)
+        if lease is not None:
+            with lease:
+                # the previous leader may have finished between our lookup and taking the lock
+                lease.result = lookup()
+                if lease.result is not None:
+                    return lease.result, False
+                count('summary_single_flight_total', role='leader')
+                lease.result = compute()
+                return lease.result, True
+
+        count('summary_single_flight_total', role='follower')
+        result = wait_for(key, lookup, deadline)
+        if result is not None:
+            return result, False
+        if time.monotonic() >= deadline:
+            # the leader is taking too long, do the work anyway
+            return compute(), True
@@ -0,0 +1,552 @@
+"""
+Vector index of statute passages (the IPC by default) and retrieval from it.
+
+`manage.py build_vector_index` splits the statute PDFs page by page into
+overlapping passages and embeds them. Every passage is identified by a hash of
+its text and the embedding model, and its embedding is kept in an embedding
+store next to the index (<index dir>.embeddings), appended one shard per batch
+as the build goes.
+A rebuild therefore only embeds the passages of changed pages, and an
+interrupted build resumes where it stopped. The new index is written next to
+IPC_VECTOR_INDEX_DIR and swapped in when it is complete.
+
+Passage texts and metadata live in a memory-mapped docstore (docstore.py).
+IPC_VECTOR_INDEX_DIR may also still be a LangChain FAISS.save_local()
+directory (index.faiss + pickled index.pkl, the original prebuilt index);
+`manage.py convert_docstore` adds the docstore to it. Until then the pickle is
+read at startup, without LangChain, by an unpickler that only admits the two
+LangChain classes it contains.
+
+The index is opened once per process. FAISS (1.7) memory-maps only the
+inverted lists of the IVF types, which the workers then share through the page
+cache; every other type, the default 'flat' included, is read into each
+worker: about passages x dim x 4 bytes per process for 'flat' (a few MB for the
+IPC). A batch of queries is embedded in one embeddings request and answered by
+one FAISS search call.
+
+Next to the vectors every index has a BM25 index of the passages (<index
+dir>/lexical, see search_index.py) whose meta also maps every section number
+to the passages of that section. Searches are 'vector', 'lexical' or 'hybrid':
+hybrid runs the BM25 search while the queries are being embedded and merges
+both rankings by reciprocal rank fusion. In the lexical and hybrid modes the
+passages of the sections a query names ("section 302", "s. 304B") come first,
+followed by the fused results. A query that is nothing but a section
+reference is not embedded: the BM25 results alone fill the rest.
+`manage.py build_vector_index` writes the lexical index (with --lexical-only
+for the prebuilt LangChain index); requests only open it, and without it only
+the 'vector' mode answers.
+"""
+import os
+import re
+import json
+import glob
+import ntpath
+import pickle
+import hashlib
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+from django.conf import settings
+
+from .case_store import make_build_directory, replace_directory, build_lock, IndexUnavailable
+from .metrics import stage
+from .docstore import Docstore, MemoryDocstore, has_docstore, write_docstore
+from .ann_index import build_ann_index, set_search_parameters
+from .search_index import BM25Index, build_bm25_index, tokenize, INDEX_FORMAT_VERSION
+
+STATUTE_INDEX_FORMAT_VERSION = 2
+# bumped when the lexical index or the section map are built differently
+STATUTE_LEXICAL_VERSION = 2
+LEXICAL_DIR = 'lexical'
+SEARCH_MODES = ('hybrid', 'lexical', 'vector')
+
+# a section heading in the text of the act: "302. Punishment for murder.—Whoever ...", "3[304B. Dowry
+# death.—" for amended ones; the title may wrap, the next numbered line is not crossed
+SECTION_HEADING_RE = re.compile(
+    r'(?m)^[ \t]*(?:\d{0,2}\[)?(\d{1,3}[A-Z]{0,2})\.[ \t]+(?:(?!\n[ \t]*(?:\d{0,2}\[)?\d+[A-Z]{0,2}\.)[^—]){1,300}?—')
+# footnotes at the foot of a page, after a rule of blanks or starting "1. Subs. by Act ...", "2. The words ..."
+FOOTNOTES_RE = re.compile(
+    r'(?m)^[ \t]{20,}$|^[ \t]*\d{1,2}\.[ \t]*(?:Subs|Ins|Rep|Added|Omitted|Cl|The|Certain|Now|See|Extended)\b')
+# a line of the arrangement of sections (the table of contents): "302. Punishment for murder."
+CONTENTS_ENTRY_RE = re.compile(r'(?m)^[ \t]*\d{1,3}[A-Z]{0,2}\.[ \t]+[A-Z“][^\n—]*$')
+MIN_CONTENTS_ENTRIES = 3
+# a section named in a query: "section 302", "sections 302 and 34", "s. 304B", "u/s 498-A"
+SECTION_NUMBER = r'\d{1,3}(?:-?[a-z]{1,2})?\b'
+SECTION_REFERENCE_RE = re.compile(
+    rf'\b(?:sections?|secs?\.?|s\.|u/s\.?)\s*({SECTION_NUMBER}(?:\s*(?:,|and|or|&|/)\s*{SECTION_NUMBER})*)', re.I)
+# words that may surround a bare section reference, "section 302 of the IPC"
+REFERENCE_WORDS = {'ipc', 'i', 'p', 'c', 'indian', 'penal', 'code', 'of', 'the', 'under', 'act'}
+
+
+class _PickledObject:
+    """Stand-in for the LangChain classes in index.pkl, keeps their attributes."""
+
+    def __setstate__(self, state):
+        # pydantic models pickle their fields under '__dict__', plain objects pickle the dict itself
+        self.__dict__.update(state.get('__dict__', state))
+
+
+class _LangChainUnpickler(pickle.Unpickler):
+    allowed = {
+        ('langchain_community.docstore.in_memory', 'InMemoryDocstore'),
+        ('langchain_core.documents.base', 'Document'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) in self.allowed:
+            return _PickledObject
+        raise pickle.UnpicklingError(f"Unexpected class {module}.{name} in the docstore")
+
+
+def read_langchain_docstore(directory):
+    """(texts, metadata) of the passages of a FAISS.save_local() directory, in vector id order."""
+    with open(os.path.join(directory, 'index.pkl'), 'rb') as f:
+        docstore, index_to_docstore_id = _LangChainUnpickler(f).load()
+    texts, metadata = [], []
+    for vector_id in range(len(index_to_docstore_id)):
+        document = docstore._dict[index_to_docstore_id[vector_id]]
+        texts.append(document.page_content)
+        metadata.append(dict(document.metadata))
+    return texts, metadata
+
+
+def split_passages(text, chunk_size, overlap):
+    """Passages of at most `chunk_size` characters cut at word boundaries, each repeating up to `overlap` characters of the last."""
+    words = []
+    for word in re.findall(r'\S+\s*', text):
+        # a word longer than a passage is cut anyway
+        words.extend(word[i:i + chunk_size] for i in range(0, len(word), chunk_size))
+    passages, current, size = [], [], 0
+    for word in words:
+        if current and size + len(word) > chunk_size:
+            passages.append(''.join(current).strip())
+            # the next passage starts with as much of this one's tail as fits into `overlap`
+            while current and (size > overlap or size + len(word) > chunk_size):
+                size -= len(current.pop(0))
+        current.append(word)
+        size += len(word)
+    if current:
+        passages.append(''.join(current).strip())
+    return [passage for passage in passages if passage]
+
+
+def passage_hash(text, embedding_model):
+    return hashlib.sha256(f"{embedding_model}\x00{text}".encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """
+    Embeddings by passage hash. Every add() writes one more shard file, so
+    whatever was embedded before a crash is still there for the next build.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.vectors = {}
+        for path in sorted(glob.glob(os.path.join(directory, 'shard-*.npz'))):
+            with np.load(path) as shard:
+                self.vectors.update(zip((row.tobytes() for row in shard['hashes']), shard['vectors']))
+
+    def __contains__(self, key):
+        return key in self.vectors
+
+    def __getitem__(self, key):
+        return self.vectors[key]
+
+    def _write_shard(self, hashes, vectors):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            # raw digests as a uint8 matrix, numpy byte strings would drop trailing zero bytes
+            np.savez(f, hashes=np.frombuffer(b''.join(hashes), dtype=np.uint8).reshape(-1, 32),
+                     vectors=np.asarray(vectors, dtype=np.float32))
+        shard_path = os.path.join(self.directory, f"shard-{os.getpid()}-{os.urandom(4).hex()}.npz")
+        os.replace(tmp_path, shard_path)
+        return shard_path
+
+    def add(self, hashes, vectors):
+        self._write_shard(hashes, vectors)
+        self.vectors.update(zip(hashes, vectors))
+
+    def compact(self, keep):
+        """Rewrite the store as one shard holding only the `keep` hashes."""
+        keep = [key for key in dict.fromkeys(keep) if key in self.vectors]
+        old_shards = glob.glob(os.path.join(self.directory, 'shard-*.npz'))
+        if keep:
+            new_shard = self._write_shard(keep, [self.vectors[key] for key in keep])
+            old_shards = [path for path in old_shards if path != new_shard]
+        for path in old_shards:
+            os.remove(path)
+        self.vectors = {key: self.vectors[key] for key in keep}
+
+
+def read_statute_pdfs(pdf_paths, chunk_size, overlap):
+    """(texts, metadata) of every passage of the PDFs, page by page."""
+    from .pdf_extraction import iter_pages
+    texts, metadata = [], []
+    for path in pdf_paths:
+        with open(path, 'rb') as f:
+            pdf_bytes = f.read()
+        for page_num, page_text in enumerate(iter_pages(pdf_bytes)):
+            for passage in split_passages(page_text, chunk_size, overlap):
+                texts.append(passage)
+                metadata.append({'source': os.path.basename(path), 'page': page_num})
+    return texts, metadata
+
+
+def build_statute_index(pdf_paths=None, index_dir=None, embedding_model=None, chunk_size=None, overlap=None,
+                        index_type=None, cache_dir=None, batch_size=None, progress=None):
+    """
+    Build the index of `pdf_paths` into `index_dir`, embedding only the
+    passages the embedding store does not know yet. Returns the index meta,
+    with the number of passages embedded by this build under 'embedded'.
+    """
+    from .helper_functions_llm import generate_embeddings
+    pdf_paths = pdf_paths or settings.IPC_SOURCE_PDFS
+    index_dir = index_dir or settings.IPC_VECTOR_INDEX_DIR
+    embedding_model = embedding_model or settings.IPC_EMBEDDING_MODEL
+    chunk_size = chunk_size or settings.IPC_CHUNK_SIZE
+    overlap = settings.IPC_CHUNK_OVERLAP if overlap is None else overlap
+    index_type = index_type or settings.IPC_VECTOR_INDEX_TYPE
+    batch_size = batch_size or settings.IPC_EMBEDDING_CHECKPOINT_SIZE
+    store = EmbeddingStore(cache_dir or f"{index_dir}.embeddings")
+
+    texts, metadata = read_statute_pdfs(pdf_paths, chunk_size, overlap)
+    if not texts:
+        raise ValueError("No text found in the statute PDFs")
+    hashes = [passage_hash(text, embedding_model) for text in texts]
+    unique_texts = dict(zip(hashes, texts))
+    new_hashes = [key for key in dict.fromkeys(hashes) if key not in store]
+    for start in range(0, len(new_hashes), batch_size):
+        batch = new_hashes[start:start + batch_size]
+        # generate_embeddings packs the batch into large requests and sends them concurrently
+        vectors = generate_embeddings([unique_texts[key] for key in batch], model=embedding_model)
+        store.add(batch, vectors)
+        if progress:
+            progress(min(start + batch_size, len(new_hashes)), len(new_hashes))
+
+    vectors = np.ascontiguousarray(np.vstack([store[key] for key in hashes]), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    index = build_ann_index(index_type, vectors)
+
+    tmp_dir = make_build_directory(index_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, 'index.faiss'))
+    write_docstore(tmp_dir, texts, metadata)
+    build_lexical_index(texts, metadata, os.path.join(tmp_dir, LEXICAL_DIR))
+    meta = {
+        'format_version': STATUTE_INDEX_FORMAT_VERSION,
+        'sources': [_source_signature(path) for path in pdf_paths],
+        'embedding_model': embedding_model,
+        'chunk_size': chunk_size,
+        'chunk_overlap': overlap,
+        'index_type': index_type,
+        'dim': int(vectors.shape[1]),
+        'passage_count': len(texts),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(tmp_dir, index_dir)
+    # embeddings of passages that are gone are dropped once the index no longer needs them
+    store.compact(hashes)
+    return dict(meta, embedded=len(new_hashes))
+
+
+def _source_signature(path):
+    with open(path, 'rb') as f:
+        return {'name': os.path.basename(path), 'sha256': hashlib.sha256(f.read()).hexdigest()}
+
+
+def _read_meta(index_dir):
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_statute_index(pdf_paths=None, index_dir=None, force=False, **build_options):
+    """Build the index unless it is current for these PDFs and settings. Returns (index_dir, meta of a new build or None)."""
+    pdf_paths = pdf_paths or settings.IPC_SOURCE_PDFS
+    index_dir = index_dir or settings.IPC_VECTOR_INDEX_DIR
+
+    def is_current():
+        meta = _read_meta(index_dir)
+        return bool(meta) and meta['format_version'] == STATUTE_INDEX_FORMAT_VERSION \
+            and meta['sources'] == [_source_signature(path) for path in pdf_paths] \
+            and meta['embedding_model'] == (build_options.get('embedding_model') or settings.IPC_EMBEDDING_MODEL) \
+            and meta['chunk_size'] == (build_options.get('chunk_size') or settings.IPC_CHUNK_SIZE) \
+            and meta['chunk_overlap'] == (settings.IPC_CHUNK_OVERLAP if build_options.get('overlap') is None else build_options['overlap']) \
+            and meta['index_type'] == (build_options.get('index_type') or settings.IPC_VECTOR_INDEX_TYPE)
+
+    if not force and is_current():
+        return index_dir, None
+    with build_lock(index_dir):
+        if force or not is_current():
+            return index_dir, build_statute_index(pdf_paths, index_dir, **build_options)
+    return index_dir, None
+
+
+def _section_texts(texts, metadata):
+    """
+    The texts of the passages without footnotes, None for the passages of the
+    table of contents. Footnotes run from the first footnote line to the end of the page.
+    """
+    bodies, contents_pages = [], set()
+    page, in_footnotes = None, False
+    for passage_id, text in enumerate(texts):
+        passage_page = (metadata[passage_id].get('source'), metadata[passage_id].get('page'))
+        if passage_page != page:
+            page, in_footnotes = passage_page, False
+        if in_footnotes:
+            text = ''
+        footnotes = FOOTNOTES_RE.search(text)
+        if footnotes:
+            text, in_footnotes = text[:footnotes.start()], True
+        if 'ARRANGEMENT OF SECTIONS' in text.upper() or len(CONTENTS_ENTRY_RE.findall(text)) >= MIN_CONTENTS_ENTRIES:
+            contents_pages.add(page)
+        bodies.append(text)
+    # the passages of a contents page without a section heading, the end of the contents
+    # may share its page with the start of the act
+    return [None if (metadata[passage_id].get('source'), metadata[passage_id].get('page')) in contents_pages
+            and (CONTENTS_ENTRY_RE.search(text) or not SECTION_HEADING_RE.search(text)) else text
+            for passage_id, text in enumerate(bodies)]
+
+
+def section_passages(texts, metadata):
+    """Section number -> ids of the passages holding its text, in order."""
+    sections = {}
+    current, source = None, None
+    for passage_id, text in enumerate(_section_texts(texts, metadata)):
+        if metadata[passage_id].get('source') != source:
+            current, source = None, metadata[passage_id].get('source')
+        if text is None:
+            current = None
+            continue
+        headings = list(SECTION_HEADING_RE.finditer(text))
+        # a passage continues the previous section unless it starts with a heading (after a page number)
+        if current and (text[:headings[0].start()] if headings else text).strip(' \t\n0123456789'):
+            sections.setdefault(current, []).append(passage_id)
+        for heading in headings:
+            current = heading.group(1)
+            if passage_id not in sections.setdefault(current, []):
+                sections[current].append(passage_id)
+    return sections
+
+
+def build_lexical_index(texts, metadata, directory):
+    return build_bm25_index(({'text': (text, 1.0)} for text in texts), directory, extra_meta={
+        'lexical_version': STATUTE_LEXICAL_VERSION,
+        'passage_count': len(texts),
+        'sections': section_passages(texts, metadata),
+    })
+
+
+def lexical_index_is_current(directory, docstore):
+    meta = _read_meta(os.path.join(directory, LEXICAL_DIR))
+    return bool(meta) and meta['format_version'] == INDEX_FORMAT_VERSION \
+        and meta.get('lexical_version') == STATUTE_LEXICAL_VERSION and meta.get('passage_count') == len(docstore)
+
+
+def ensure_lexical_index(directory, docstore=None, force=False):
+    """
+    Build the lexical index of an index directory unless it is current. New builds
+    write it with the vectors; directories written before it existed (and the
+    LangChain one) get it from `manage.py build_vector_index --lexical-only`.
+    """
+    lexical_dir = os.path.join(directory, LEXICAL_DIR)
+    docstore = docstore or open_docstore(directory)
+    if force or not lexical_index_is_current(directory, docstore):
+        with build_lock(lexical_dir):
+            if force or not lexical_index_is_current(directory, docstore):
+                passage_ids = range(len(docstore))
+                build_lexical_index([docstore.text(i) for i in passage_ids],
+                                    [docstore.metadata(i) for i in passage_ids], lexical_dir)
+    return lexical_dir
+
+
+def section_reference(query):
+    """(section numbers named in `query`, whether the query is only that reference)."""
+    sections = []
+    for match in SECTION_REFERENCE_RE.finditer(query):
+        for number in re.findall(SECTION_NUMBER, match.group(1), re.I):
+            sections.append(number.replace('-', '').upper())
+    rest = SECTION_REFERENCE_RE.sub(' ', query)
+    bare = bool(sections) and all(token in REFERENCE_WORDS for token in tokenize(rest))
+    return list(dict.fromkeys(sections)), bare
+
+
+def lexical_query(query):
+    # any of the terms may match, BM25 ranks the passages matching more (and rarer) ones first
+    return ' OR '.join(tokenize(query))
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """
+    Merge rankings (name -> ids, best first) by reciprocal rank fusion:
+    every id scores the sum of 1 / (k + rank) over the rankings it appears in.
+    Returns [(id, score, names of the rankings)], best first.
+    """
+    scores, found_by = {}, {}
+    for name, ranking in rankings.items():
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+            found_by.setdefault(item, []).append(name)
+    # ties are broken by id so the order is stable between calls
+    return [(item, scores[item], found_by[item]) for item in sorted(scores, key=lambda item: (-scores[item], item))]
+
+
+def open_docstore(directory):
+    if has_docstore(directory):
+        return Docstore(directory)
+    # an unconverted LangChain index (see `manage.py convert_docstore`)
+    return MemoryDocstore(*read_langchain_docstore(directory))
+
+
+class StatuteIndex:
+    def __init__(self, directory, embedding_model=None):
+        meta = _read_meta(directory) or {}
+        self.embedding_model = embedding_model or meta.get('embedding_model') or settings.IPC_EMBEDDING_MODEL
+        # only the inverted lists of an IVF index are mapped, the other types are read into memory
+        self.index = faiss.read_index(os.path.join(directory, 'index.faiss'), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        set_search_parameters(self.index, nprobe=settings.IPC_VECTOR_NPROBE, ef_search=settings.IPC_VECTOR_EF_SEARCH)
+        self.docstore = open_docstore(directory)
+        if len(self.docstore) != self.index.ntotal:
+            raise ValueError(f"{directory}: {self.index.ntotal} vectors but {len(self.docstore)} passages")
+        # never built here, the index directory may well be read-only
+        self.lexical = BM25Index(os.path.join(directory, LEXICAL_DIR)) \
+            if lexical_index_is_current(directory, self.docstore) else None
+        self.sections = self.lexical.meta['sections'] if self.lexical else {}
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def scores(self, distances):
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distances
+        # squared L2 between unit vectors (OpenAI embeddings are normalised) -> cosine similarity
+        return 1 - distances / 2
+
+    def hit(self, vector_id, score, matched_by=None):
+        metadata = self.docstore.metadata(vector_id)
+        page = metadata.get('page')
+        hit = {
+            'id': int(vector_id),
+            'score': float(score),
+            'text': self.docstore.text(vector_id),
+            # PyPDFLoader counts pages from 0
+            'page': page + 1 if isinstance(page, int) else None,
+            'source': ntpath.basename(metadata.get('source') or ''),
+        }
+        if matched_by is not None:
+            hit['matched_by'] = matched_by
+        return hit
+
+    def nearest(self, vectors, top_k):
+        """(ids, scores) of the `top_k` nearest passages of every row of `vectors`, -1 padded."""
+        with stage('ipc_search'):
+            distances, ids = self.index.search(np.ascontiguousarray(vectors, dtype=np.float32), top_k)
+        return ids, self.scores(distances)
+
+    def search_vectors(self, vectors, top_k=5):
+        """One list of hits, best first, per row of `vectors`."""
+        top_k = min(top_k, self.index.ntotal)
+        if top_k <= 0 or not len(vectors):
+            return [[] for _ in range(len(vectors))]
+        ids, scores = self.nearest(vectors, top_k)
+        # FAISS pads with -1 when fewer than top_k neighbours are reachable
+        return [[self.hit(vector_id, score) for vector_id, score in zip(row_ids, row_scores) if vector_id >= 0]
+                for row_ids, row_scores in zip(ids, scores)]
+
+    def embed(self, queries):
+        from .helper_functions_llm import generate_embeddings
+        vectors = np.ascontiguousarray(generate_embeddings(list(queries), model=self.embedding_model), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def vector_rankings(self, queries, depth):
+        ids, _ = self.nearest(self.embed(queries), min(depth, self.index.ntotal))
+        return [row[row >= 0].tolist() for row in ids]
+
+    def lexical_ranking(self, query, depth):
+        with stage('ipc_lexical'):
+            return self.lexical.search(lexical_query(query), top_k=depth).docs.tolist()
+
+    def section_ranking(self, sections):
+        return list(dict.fromkeys(passage_id for section in sections for passage_id in self.sections.get(section, [])))
+
+    def search_batch(self, queries, top_k=5, mode=None):
+        mode = mode or settings.IPC_SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}")
+        if not queries:
+            return []
+        if mode == 'vector':
+            return self.search_vectors(self.embed(queries), top_k)
+        if self.lexical is None:
+            raise IndexUnavailable(f"The lexical IPC index is missing or out of date, build it with "
+                                   f"`manage.py build_vector_index --lexical-only`; mode 'vector' still works")
+
+        references = [section_reference(query) for query in queries]
+        pinned = [self.section_ranking(sections) for sections, _ in references]
+        # a bare reference to a known section is not worth an embeddings request
+        embedded = [i for i, (_, bare) in enumerate(references) if not (bare and pinned[i])]
+        depth = max(top_k, settings.IPC_HYBRID_DEPTH)
+        vector_rankings = None
+        if mode == 'hybrid' and embedded:
+            # the queries are embedded and searched while the lexical index is searched here
+            vector_rankings = _get_pool().submit(contextvars.copy_context().run, self.vector_rankings,
+                                                 [queries[i] for i in embedded], depth)
+        rankings = [{'lexical': self.lexical_ranking(query, depth)} for query in queries]
+        if vector_rankings is not None:
+            for i, ranking in zip(embedded, vector_rankings.result()):
+                rankings[i]['vector'] = ranking
+
+        results = []
+        for i in range(len(queries)):
+            fused = reciprocal_rank_fusion(rankings[i], settings.IPC_RRF_K)
+            scores = {passage_id: (score, found_by) for passage_id, score, found_by in fused}
+            hits = []
+            for passage_id in pinned[i][:top_k]:
+                score, found_by = scores.get(passage_id, (0.0, []))
+                hits.append(self.hit(passage_id, score, ['section'] + found_by))
+            for passage_id, score, found_by in fused:
+                if len(hits) >= top_k:
+                    break
+                if passage_id not in pinned[i]:
+                    hits.append(self.hit(passage_id, score, found_by))
+            results.append(hits)
+        return results
+
+    def search(self, query, top_k=5, mode=None):
+        return self.search_batch([query], top_k, mode)[0]
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.IPC_SEARCH_WORKERS, thread_name_prefix='ipc-search')
+            _pool_pid = os.getpid()
+    return _pool
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_statute_index():
+    """Process wide IPC index, opened on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = StatuteIndex(settings.IPC_VECTOR_INDEX_DIR)
+    return _index
@@ -0,0 +1,57 @@
+"""
+Server-Sent Events responses for the summarizer endpoints.
+
+A stream is a generator of (event, data) pairs, written to the client as
+
+    event: <event>
+    data: <json data>
+
+blocks as soon as they are produced. Under WSGI the generator is consumed
+directly by StreamingHttpResponse. Under ASGI Django would drain a synchronous
+iterator completely before sending anything, so there the generator is wrapped in
+an async iterator that advances it one event at a time in the sync thread.
+"""
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sse_lines(events):
+    # the headers are already sent, so a failure is reported as the last event
+    try:
+        for event, data in events:
+            yield sse_event(event, data)
+    except Exception as e:
+        logger.exception("Summary stream failed")
+        yield sse_event('error', {'error': str(e)})
+
+
+async def _async_lines(lines):
+    # thread sensitive, so the generator's ORM calls share the request's sync thread and connection
+    next_line = sync_to_async(next, thread_sensitive=True)
+    while True:
+        line = await next_line(lines, _END)
+        if line is _END:
+            break
+        yield line
+
+
+def event_stream_response(request, events):
+    lines = _sse_lines(events)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        lines = _async_lines(lines)
+    response = StreamingHttpResponse(lines, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx buffers proxied responses unless told otherwise
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,221 @@
+"""
+Local stand-ins for the external services the legal tools call, for offline
+runs, CI and benchmarks:
+
+    POST /v1/embeddings          OpenAI embeddings: deterministic unit vectors
+                                 seeded by a hash of each input
+    POST /v1/chat/completions    OpenAI chat completions, streamed or not: a
+                                 deterministic summary shaped like the real one
+    POST /submit_query           chatbot lambda: returns a query id
+    GET  /get_query?query_id=    chatbot lambda: complete once the chatbot
+                                 latency has passed since submission
+    GET  /pdf/<seed>.pdf         a synthetic judgment PDF (sample_pdf)
+
+Every route waits for its configured latency (StubLatency) before answering,
+streamed completions also wait between tokens. Point the app at the stub with
+OPENAI_BASE_URL=http://host:port/v1 and LAWCHATBOT_URL=http://host:port, or
+run it in-process with start_stub_services().
+"""
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+EMBEDDING_DIMENSIONS = {'text-embedding-3-large': 3072, 'text-embedding-3-small': 1536, 'text-embedding-ada-002': 1536}
+SUMMARY_SECTIONS = ['Facts', 'Issues', 'Decision (Holding)', 'Reasoning (Rationale)', 'Disposition', 'Precedent', 'Note']
+LEGAL_WORDS = (
+    "appellant respondent petitioner court high supreme judgment order appeal section act code penal "
+    "criminal civil evidence witness testimony prosecution accused bail conviction sentence acquittal "
+    "contract property land revenue tax tribunal writ article constitution fundamental rights liberty "
+    "statute provision interpretation precedent held dismissed allowed remanded costs limitation decree"
+).split()
+
+
+class StubLatency:
+    """Seconds every stub route waits before answering."""
+
+    def __init__(self, embeddings=0.05, completion=0.3, completion_token=0.0, chatbot=0.5, pdf=0.02):
+        self.embeddings = embeddings
+        self.completion = completion
+        self.completion_token = completion_token
+        self.chatbot = chatbot
+        self.pdf = pdf
+
+
+def stub_embedding(text, dimensions):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def stub_summary(messages, words_per_point=12):
+    """Summary in the shape the summary prompt asks for, derived from the prompt text."""
+    text = ' '.join(str(message.get('content', '')) for message in messages)
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).hexdigest())
+    words = re.findall(r'[a-z]{4,}', text.lower()) or LEGAL_WORDS
+
+    def point():
+        return ' '.join(rng.choice(words) for _ in range(words_per_point)).capitalize() + '.'
+
+    lines = [f"Title: {' '.join(rng.choice(words) for _ in range(4)).title()}"]
+    for number, section in enumerate(SUMMARY_SECTIONS, 1):
+        lines.append(f"{number}. **{section}**:")
+        lines.extend(f"   - {point()}" for _ in range(2))
+    return '\n'.join(lines)
+
+
+def sample_pdf(seed, pages=20, words_per_page=450):
+    """A synthetic judgment, the same bytes for the same seed."""
+    import fitz
+    rng = random.Random(seed)
+    document = fitz.open()
+    for page_num in range(pages):
+        page = document.new_page()
+        text = ' '.join(rng.choice(LEGAL_WORDS) for _ in range(words_per_page))
+        if page_num == 0:
+            text = f"IN THE SUPREME COURT OF INDIA\nCivil Appeal No. {seed} of 2020\n" + text
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+class StubServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def latency(self):
+        return self.server.latency
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.endswith('/embeddings'):
+            return self.embeddings(self._read_json())
+        if path.endswith('/chat/completions'):
+            return self.chat_completion(self._read_json())
+        if path.endswith('/submit_query'):
+            return self.submit_query(self._read_json())
+        self._send(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/get_query'):
+            return self.get_query(parse_qs(url.query).get('query_id', [''])[0])
+        match = re.fullmatch(r'/pdf/(\d+)\.pdf', url.path)
+        if match:
+            time.sleep(self.latency.pdf)
+            return self._send(200, sample_pdf(int(match.group(1))), 'application/pdf')
+        self._send(404, {'error': 'Not found'})
+
+    def embeddings(self, body):
+        time.sleep(self.latency.embeddings)
+        inputs = body.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dimensions = body.get('dimensions') or EMBEDDING_DIMENSIONS.get(body.get('model'), 1536)
+        data = []
+        for index, text in enumerate(inputs):
+            vector = stub_embedding(str(text), dimensions)
+            # the openai client asks for base64 unless told otherwise
+            if body.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode('ascii')
+            else:
+                embedding = vector.tolist()
+            data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+        tokens = sum(len(str(text).split()) for text in inputs)
+        self._send(200, {'object': 'list', 'data': data, 'model': body.get('model'),
+                         'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}})
+
+    def chat_completion(self, body):
+        time.sleep(self.latency.completion)
+        content = stub_summary(body.get('messages', []))
+        base = {'id': 'chatcmpl-' + uuid.uuid4().hex, 'created': int(time.time()), 'model': body.get('model')}
+        if not body.get('stream'):
+            usage = {'prompt_tokens': 0, 'completion_tokens': len(content.split()), 'total_tokens': len(content.split())}
+            return self._send(200, dict(base, object='chat.completion', usage=usage, choices=[{
+                'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop',
+            }]))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # no length for a stream, the connection is closed after [DONE]
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta, finish_reason=None):
+            chunk = dict(base, object='chat.completion.chunk',
+                         choices=[{'index': 0, 'delta': delta, 'finish_reason': finish_reason}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        event({'role': 'assistant', 'content': ''})
+        for piece in re.findall(r'\S+\s*', content):
+            time.sleep(self.latency.completion_token)
+            event({'content': piece})
+        event({}, 'stop')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def submit_query(self, body):
+        query_id = uuid.uuid4().hex
+        with self.server.queries_lock:
+            self.server.queries[query_id] = (time.monotonic(), str(body.get('query_text', '')))
+        self._send(200, {'query_id': query_id})
+
+    def get_query(self, query_id):
+        with self.server.queries_lock:
+            query = self.server.queries.get(query_id)
+        if query is None:
+            return self._send(404, {'error': 'Unknown query id'})
+        submitted_at, query_text = query
+        if time.monotonic() - submitted_at < self.latency.chatbot:
+            return self._send(200, {'query_id': query_id, 'is_complete': False})
+        answer = stub_summary([{'content': query_text}], words_per_point=20).split('\n', 1)[1]
+        self._send(200, {'query_id': query_id, 'query_text': query_text, 'is_complete': True,
+                         'answer_text': answer, 'sources': []})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=None):
+        super().__init__(address, StubServiceHandler)
+        self.latency = latency or StubLatency()
+        self.queries = {}
+        self.queries_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_stub_services(host='127.0.0.1', port=0, latency=None):
+    """Serve the stubs from a background thread; port 0 picks a free port. Stop with server.shutdown()."""
+    server = StubServer((host, port), latency)
+    threading.Thread(target=server.serve_forever, daemon=True, name='stub-services').start()
+    return server
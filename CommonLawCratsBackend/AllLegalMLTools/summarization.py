@@ -0,0 +1,167 @@
+"""
+Case summary pipeline shared by the summarizer endpoints:
+extract -> clean -> tokenize and chunk -> select the most relevant chunks
+(see chunk_selection.py) -> summarize. Documents longer than one summary prompt
+can be summarized by map-reduce instead (see map_reduce.py).
+
+summarize_document() and summarize_case() put the summary cache in front of
+the pipeline, so a document that was summarized before costs one DB read.
+stream_document_summary() and stream_case_summary() do the same but yield the
+summary piece by piece while the model writes it. Identical requests running
+at the same time are coalesced (see single_flight.py): one of them runs the
+pipeline, the others wait for its summary.
+"""
+import time
+from django.conf import settings
+
+from .helper_functions_llm import generate_summary, stream_summary, SUMMARY_TOKEN_BUDGET
+from .chunk_selection import select_chunks, selection_method
+from .map_reduce import map_reduce_inputs
+from .metrics import TimedIterator, record_stage, count
+from .pdf_downloader import download_pdf
+from .pdf_extraction import iter_clean_pages
+from .tokenized_document import TokenizedDocument
+from . import summary_cache
+from .single_flight import single_flight, try_lead
+from .case_store import CASE_ID_COLUMN
+
+# chunk sizes (in tokens) used by the two endpoints
+UPLOAD_CHUNK_TOKENS = 4000
+CASE_CHUNK_TOKENS = 8191
+
+
+def use_map_reduce(map_reduce=None):
+    return settings.SUMMARY_MAP_REDUCE if map_reduce is None else map_reduce
+
+
+def summary_inputs(pdf_bytes, chunk_tokens, selection=None, map_reduce=None):
+    """Texts the summary is written from: the selected chunks, or the map-reduced parts of a long document."""
+    # pages are tokenized while the later ones are still being extracted, and only once:
+    # the chunks are slices of the token array and carry their token counts onwards
+    pages = TimedIterator(iter_clean_pages(pdf_bytes), 'extract')
+    start = time.perf_counter()
+    document = TokenizedDocument.from_pages(pages)
+    record_stage('tokenize', time.perf_counter() - start - pages.elapsed)
+    count('tokens_total', len(document), kind='document')
+    if use_map_reduce(map_reduce) and len(document) > SUMMARY_TOKEN_BUDGET:
+        return map_reduce_inputs(document)
+    chunks = document.chunks(chunk_tokens)
+    count('chunks_total', len(chunks), kind='document')
+    # the start of the document is the query of the embedding selection
+    return select_chunks(chunks, document.text(0, 8191).strip()[:8191], method=selection)
+
+
+def summarize_pdf(pdf_bytes, chunk_tokens, selection=None, map_reduce=None):
+    return generate_summary(summary_inputs(pdf_bytes, chunk_tokens, selection, map_reduce))
+
+
+def _cache_variant(selection, map_reduce):
+    # summaries of the original pipeline keep their cache keys
+    selection = selection_method(selection)
+    parts = [] if selection == 'embedding' else [selection]
+    if use_map_reduce(map_reduce):
+        parts.append('map_reduce')
+    return '+'.join(parts)
+
+
+def case_summary_key(case, dataset_version, selection=None, map_reduce=None):
+    return summary_cache.case_key(case[CASE_ID_COLUMN], dataset_version, _cache_variant(selection, map_reduce))
+
+
+def cached_summary(key, load_pdf, chunk_tokens, selection=None, map_reduce=None):
+    """
+    Returns (summary, cache_hit). A summary written by a concurrent identical
+    request counts as a cache hit.
+    """
+    summary = summary_cache.get_summary(key)
+    if summary is not None:
+        return summary, True
+
+    def compute():
+        summary = summarize_pdf(load_pdf(), chunk_tokens, selection, map_reduce)
+        summary_cache.put_summary(key, summary)
+        return summary
+
+    summary, computed = single_flight(key, compute, lambda: summary_cache.peek_summary(key))
+    return summary, not computed
+
+
+def summarize_document(pdf_bytes, chunk_tokens=UPLOAD_CHUNK_TOKENS, selection=None, map_reduce=None):
+    """Returns (summary, cache_hit)."""
+    return cached_summary(summary_cache.document_key(pdf_bytes, _cache_variant(selection, map_reduce)),
+                          lambda: pdf_bytes, chunk_tokens, selection, map_reduce)
+
+
+def summarize_case(case, dataset_version, chunk_tokens=CASE_CHUNK_TOKENS, selection=None, map_reduce=None):
+    """`case` is a row of the case store. Returns (summary, cache_hit)."""
+    # the pdf is only downloaded when the summary is not cached
+    return cached_summary(case_summary_key(case, dataset_version, selection, map_reduce),
+                          lambda: download_pdf(case['PDF Link']), chunk_tokens, selection, map_reduce)
+
+
+def stream_cached_summary(key, load_pdf, chunk_tokens, selection=None, map_reduce=None):
+    """
+    Yields (event, data) pairs: ('status', stage) while the document is prepared,
+    ('token', text) for every piece of the summary and finally ('done', summary).
+    The whole summary is cached once the model has finished. While an identical
+    request is writing the summary this one reports ('status', 'waiting') and
+    then sends the finished summary at once.
+    """
+    summary = summary_cache.get_summary(key)
+    if summary is not None:
+        yield 'status', 'cached'
+        yield 'token', summary
+        yield 'done', summary
+        return
+
+    lease = try_lead(key)
+    if lease is None:
+        yield 'status', 'waiting'
+        summary, _ = cached_summary(key, load_pdf, chunk_tokens, selection, map_reduce)
+        yield 'token', summary
+        yield 'done', summary
+        return
+
+    with lease:
+        # the previous leader may have finished between the lookup and taking the lock
+        summary = lease.result = summary_cache.peek_summary(key)
+        if summary is not None:
+            yield 'status', 'cached'
+            yield 'token', summary
+            yield 'done', summary
+            return
+        yield 'status', 'preparing'
+        chunks = summary_inputs(load_pdf(), chunk_tokens, selection, map_reduce)
+        yield 'status', 'summarizing'
+        parts = []
+        for piece in stream_summary(chunks):
+            parts.append(piece)
+            yield 'token', piece
+        summary = lease.result = ''.join(parts)
+        summary_cache.put_summary(key, summary)
+    yield 'done', summary
+
+
+def stream_document_summary(pdf_bytes, chunk_tokens=UPLOAD_CHUNK_TOKENS, selection=None, map_reduce=None):
+    return stream_cached_summary(summary_cache.document_key(pdf_bytes, _cache_variant(selection, map_reduce)),
+                                 lambda: pdf_bytes, chunk_tokens, selection, map_reduce)
+
+
+def stream_case_summary(case, dataset_version, chunk_tokens=CASE_CHUNK_TOKENS, selection=None, map_reduce=None):
+    # the pdf is only downloaded when the summary is not cached
+    return stream_cached_summary(case_summary_key(case, dataset_version, selection, map_reduce),
+                                 lambda: download_pdf(case['PDF Link']), chunk_tokens, selection, map_reduce)
+
+
+def case_summary_payload(case, summary):
+    """Response body of case-search-summary/."""
+    return [{
+        'Case ID': case[CASE_ID_COLUMN],
+        'Case Title': case['Case Title'],
+        'Case No': case['Case No'],
+        'Judges': case['Judges'],
+        'Decision Date': case['Decision Date_left'],
+        'Disposal Nature': case['Disposal Nature'],
+        'PDF Link': case['PDF Link'],
+        'Summary': summary
+    }]
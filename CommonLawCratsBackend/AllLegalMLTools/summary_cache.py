@@ -0,0 +1,93 @@
+"""
+Content addressed cache of generated summaries.
+
+Uploaded / downloaded PDFs are keyed by a hash of their bytes, dataset
+cases by case id and dataset version. The model and prompt version are part
+of every key, so changing either one never serves a stale summary. Entries
+live in the SummaryCacheEntry table; when the stored summaries grow past
+SUMMARY_CACHE_MAX_BYTES the least recently used ones are deleted. Pinned
+entries (summaries precomputed by `manage.py precompute_summaries`) are never
+evicted and do not count against that size.
+"""
+import hashlib
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils.timezone import now
+
+from .models import SummaryCacheEntry
+from .helper_functions_llm import SUMMARY_MODEL, SUMMARY_PROMPT_VERSION
+from .metrics import count
+
+EVICTION_BATCH_SIZE = 500
+
+
+def _key(kind, identity):
+    return hashlib.sha256(f"{kind}:{identity}:{SUMMARY_MODEL}:{SUMMARY_PROMPT_VERSION}".encode('utf-8')).hexdigest()
+
+
+def document_key(pdf_bytes, variant=''):
+    """`variant` tells apart summaries written from the same document in different ways."""
+    return _key('pdf', hashlib.sha256(pdf_bytes).hexdigest() + (f"/{variant}" if variant else ''))
+
+
+def case_key(case_id, dataset_version, variant=''):
+    return _key('case', f"{case_id}@{dataset_version}" + (f"/{variant}" if variant else ''))
+
+
+def get_summary(key):
+    entry = SummaryCacheEntry.objects.filter(key=key).only('summary').first()
+    count('summary_cache_total', result='miss' if entry is None else 'hit')
+    if entry is None:
+        return None
+    SummaryCacheEntry.objects.filter(pk=entry.pk).update(last_accessed=now(), hit_count=F('hit_count') + 1)
+    return entry.summary
+
+
+def peek_summary(key):
+    """The cached summary without counting it as a use, for polling."""
+    return SummaryCacheEntry.objects.filter(key=key).values_list('summary', flat=True).first()
+
+
+def pinned_keys(keys):
+    return set(SummaryCacheEntry.objects.filter(key__in=list(keys), pinned=True).values_list('key', flat=True))
+
+
+def pin_summary(key):
+    return SummaryCacheEntry.objects.filter(key=key).update(pinned=True)
+
+
+def put_summary(key, summary):
+    fields = {
+        'summary': summary,
+        'model': SUMMARY_MODEL,
+        'prompt_version': SUMMARY_PROMPT_VERSION,
+        'size_bytes': len(summary.encode('utf-8')),
+        'last_accessed': now(),
+    }
+    # plain UPDATE / INSERT statements instead of update_or_create(): no read-then-write
+    # transaction, which SQLite rejects outright when several workers write at once
+    if not SummaryCacheEntry.objects.filter(key=key).update(**fields):
+        try:
+            SummaryCacheEntry.objects.create(key=key, **fields)
+        except IntegrityError:
+            SummaryCacheEntry.objects.filter(key=key).update(**fields)
+    evict()
+
+
+def evict(max_bytes=None):
+    """Delete least recently used entries until the cache fits in `max_bytes`."""
+    max_bytes = settings.SUMMARY_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    evictable = SummaryCacheEntry.objects.filter(pinned=False)
+    total = evictable.aggregate(total=Sum('size_bytes'))['total'] or 0
+    while total > max_bytes:
+        oldest = list(evictable.order_by('last_accessed').values_list('pk', 'size_bytes')[:EVICTION_BATCH_SIZE])
+        if not oldest:
+            break
+        doomed = []
+        for pk, size in oldest:
+            if total <= max_bytes:
+                break
+            doomed.append(pk)
+            total -= size
+        SummaryCacheEntry.objects.filter(pk__in=doomed).delete()
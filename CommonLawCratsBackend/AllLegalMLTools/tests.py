@@ -1,3 +1,480 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+from unittest import mock
+import fitz
+import numpy as np
+import tiktoken
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
 
-# Create your tests here.
+from . import case_autocomplete, helper_functions_llm, pdf_extraction, tokenized_document
+from .case_autocomplete import AutocompleteIndex, build_autocomplete_index
+from .case_store import CaseStore, IndexUnavailable, build_case_store, build_id_table, make_case_id
+from .metrics import metrics_view
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .search_index import BM25Index, build_bm25_index, parse_query
+from .statute_index import (StatuteIndex, section_passages, section_reference, open_docstore, split_passages,
+                            reciprocal_rank_fusion, ensure_lexical_index)
+from .tokenized_document import TokenizedDocument
+
+# one token per byte, so the tests need no tiktoken download
+BYTE_ENCODING = tiktoken.Encoding('bytes', pat_str=r'\S+|\s+', mergeable_ranks={bytes([i]): i for i in range(256)},
+                                  special_tokens={})
+
+
+class ParseQueryTests(SimpleTestCase):
+    def test_terms_phrases_and_or(self):
+        self.assertEqual(parse_query('Murder "writ petition" OR bail'),
+                         [(['murder'], [['writ', 'petition']]), (['bail'], [])])
+
+    def test_one_word_phrase_is_a_term(self):
+        self.assertEqual(parse_query('"appeal" s.302'), [(['appeal', 's', '302'], [])])
+
+    def test_empty_clauses_are_dropped(self):
+        self.assertEqual(parse_query('OR appeal OR OR'), [(['appeal'], [])])
+        self.assertEqual(parse_query('  ""  '), [])
+
+
+class BM25IndexTests(SimpleTestCase):
+    TEXTS = [
+        'murder murder trial',
+        'murder appeal against the conviction of the accused',
+        'writ petition dismissed',
+        'petition for a writ of mandamus',
+        'bail granted',
+        'awrit petitioners writ filed petition',
+    ]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        directory = os.path.join(tmp.name, 'index')
+        build_bm25_index(({'details': (text, 1.0)} for text in self.TEXTS), directory)
+        self.index = BM25Index(directory)
+
+    def search(self, query, **kwargs):
+        return self.index.search(query, **kwargs)
+
+    def test_term_frequency_ranks_first(self):
+        result = self.search('murder')
+        self.assertEqual(result.docs.tolist(), [0, 1])
+        self.assertGreater(result.scores[0], result.scores[1])
+
+    def test_all_terms_of_a_clause_must_match(self):
+        self.assertEqual(self.search('murder appeal').docs.tolist(), [1])
+        self.assertEqual(sorted(self.search('writ petition').docs.tolist()), [2, 3, 5])
+
+    def test_phrases_match_consecutive_positions(self):
+        self.assertEqual(self.search('"writ petition"').docs.tolist(), [2])
+        self.assertEqual(self.search('"writ petition dismissed"').docs.tolist(), [2])
+        self.assertEqual(self.search('"petition writ"').total, 0)
+        self.assertEqual(self.search('"the conviction of the accused"').docs.tolist(), [1])
+        self.assertEqual(sorted(self.search('"writ petition" OR "writ filed"').docs.tolist()), [2, 5])
+
+    def test_phrases_do_not_span_fields(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'index')
+            build_bm25_index([{'title': ('State v. Writ', 2.0), 'details': ('petition allowed', 1.0)},
+                              {'title': ('Writ petition', 2.0), 'details': ('allowed', 1.0)}], directory)
+            index = BM25Index(directory)
+            self.assertEqual(index.search('"writ petition"').docs.tolist(), [1])
+            self.assertEqual(index.search('"petition allowed"').docs.tolist(), [0])
+
+    def test_or_clauses(self):
+        self.assertEqual(sorted(self.search('murder OR mandamus').docs.tolist()), [0, 1, 3])
+
+    def test_top_k_candidates_and_total(self):
+        result = self.search('murder OR petition OR bail', top_k=2)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result.total, 6)
+        self.assertEqual(result.matched.tolist(), [0, 1, 2, 3, 4, 5])
+        restricted = self.search('murder OR petition', candidates=np.array([1, 3], dtype=np.uint32))
+        self.assertEqual(sorted(restricted.docs.tolist()), [1, 3])
+
+    def test_no_match(self):
+        self.assertEqual(self.search('robbery').total, 0)
+        self.assertEqual(self.search('').total, 0)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(40, 'v1'), 'v1'), 40)
+        self.assertEqual(decode_cursor(None, 'v1'), 0)
+        self.assertEqual(decode_cursor('', 'v1'), 0)
+
+    def test_malformed(self):
+        for cursor in ('not a cursor', encode_cursor('x', 'v1'), 'e30'):
+            with self.subTest(cursor=cursor), self.assertRaisesMessage(InvalidCursor, 'Malformed'):
+                decode_cursor(cursor, 'v1')
+
+    def test_expired_by_a_new_dataset_version(self):
+        with self.assertRaisesMessage(InvalidCursor, 'expired'):
+            decode_cursor(encode_cursor(40, 'v1'), 'v2')
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor(-1, 'v1'), 'v1')
+
+
+class CaseStoreTests(SimpleTestCase):
+    def write_csv(self, path, rows):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Case No', 'Case Title', 'PDF Link'])
+            writer.writerows(rows)
+
+    def test_id_table(self):
+        ids = [make_case_id(f"CRL.A. {n}/2019", f"https://example.org/{n}.pdf") for n in range(100)]
+        keys, rows = build_id_table(ids + [ids[7]])
+        self.assertEqual(len(keys), 256)
+        self.assertEqual(int((rows != -1).sum()), 100)
+        with tempfile.TemporaryDirectory() as tmp:
+            np.save(os.path.join(tmp, 'id_table_keys.npy'), keys)
+            np.save(os.path.join(tmp, 'id_table_rows.npy'), rows)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                f.write('{"columns": [], "rows": 101}')
+            store = CaseStore(tmp)
+            # the duplicated row at the end is never returned, the first one wins
+            self.assertEqual([store.lookup(case_id) for case_id in ids], list(range(100)))
+            self.assertIsNone(store.lookup(make_case_id('CRL.A. 1/2020', 'x')))
+            self.assertIsNone(store.lookup('not an id'))
+
+    def test_case_ids_and_version(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = [['CRL.A.  1/2019', 'State v. A', 'https://example.org/1.pdf'],
+                    ['W.P. 2/2020', 'B v. Union', 'https://example.org/2.pdf']]
+            self.write_csv(os.path.join(tmp, 'a.csv'), rows)
+            self.write_csv(os.path.join(tmp, 'b.csv'), rows)
+            self.write_csv(os.path.join(tmp, 'c.csv'), rows[:1])
+            versions = []
+            for name in ('a', 'b', 'c'):
+                build_case_store(os.path.join(tmp, f'{name}.csv'), os.path.join(tmp, name))
+                versions.append(CaseStore(os.path.join(tmp, name)).version)
+            # the version follows the content, not the file
+            self.assertEqual(versions[0], versions[1])
+            self.assertNotEqual(versions[0], versions[2])
+
+            store = CaseStore(os.path.join(tmp, 'a'))
+            case_id = make_case_id('crl.a. 1/2019', 'https://example.org/1.pdf ')
+            self.assertEqual(store.lookup(case_id), 0)
+            self.assertEqual(store.row(store.lookup(case_id))['case_id'], case_id)
+
+
+class TokenizedDocumentTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tokenized_document, 'get_encoding', return_value=BYTE_ENCODING)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_spans(self):
+        document = TokenizedDocument.from_text('x' * 25)
+        self.assertEqual(document.spans(10, 3), [(0, 10), (7, 17), (14, 24), (21, 25)])
+        self.assertEqual(document.spans(25), [(0, 25)])
+        self.assertEqual(document.spans(30, 5), [(0, 25)])
+        self.assertEqual(TokenizedDocument.from_text('').spans(10, 3), [])
+        with self.assertRaises(ValueError):
+            document.spans(3, 3)
+
+    def test_chunks_carry_their_token_count(self):
+        text = 'The appeal is dismissed with costs.'
+        document = TokenizedDocument.from_pages(['The appeal is ', '', 'dismissed with costs.'])
+        chunks = document.chunks(10, 2)
+        self.assertEqual([(chunk.start, chunk.token_count) for chunk in chunks],
+                         [(0, 10), (8, 10), (16, 10), (24, 10), (32, 3)])
+        self.assertEqual([str(chunk) for chunk in chunks], [text[start:stop] for start, stop in document.spans(10, 2)])
+        self.assertEqual(tokenized_document.token_count(chunks[0]), 10)
+        self.assertEqual(document.truncate(10), text[:10])
+        self.assertEqual(document.truncate(100).token_count, len(text))
+
+    def test_join_within_budget_measures_the_joined_text(self):
+        chunks = TokenizedDocument.from_text('abcdefghij' * 4).chunks(10)
+        # the chunks count 30 tokens, joined with the separators they are 32
+        joined = tokenized_document.join_within_budget(chunks, 30)
+        self.assertEqual(joined, 'abcdefghij abcdefghij')
+        self.assertEqual(joined.token_count, 21)
+        self.assertEqual(tokenized_document.join_within_budget(chunks, 32).token_count, 32)
+
+    def test_join_within_budget_rechecks_decoded_chunks(self):
+        # a cut through 'é' decodes to U+FFFD, one token in the document and three encoded again
+        chunks = TokenizedDocument.from_text('aaaé' + 'b' * 8).chunks(4)
+        self.assertEqual([chunk.token_count for chunk in chunks], [4, 4, 4, 1])
+        joined = tokenized_document.join_within_budget(chunks, 10, separator='')
+        self.assertEqual(joined, 'aaa\ufffd')
+        self.assertEqual(joined.token_count, 6)
+
+    def test_join_within_budget_cuts_a_single_long_text(self):
+        joined = tokenized_document.join_within_budget(['x' * 50, 'y'], 20)
+        self.assertEqual(joined, 'x' * 20)
+        self.assertEqual(tokenized_document.join_within_budget(['aé'], 2), 'a')
+        self.assertEqual(tokenized_document.join_within_budget([], 20), '')
+
+
+class EmbeddingPiecesTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tokenized_document, 'get_encoding', return_value=BYTE_ENCODING)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(helper_functions_llm, 'get_encoding', return_value=BYTE_ENCODING)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_known_counts_near_the_limit_are_measured_again(self):
+        # 'aaa' + half of 'é' counts 4 tokens and decodes to 'aaa\ufffd', 6 tokens encoded again
+        cut = TokenizedDocument.from_text('aaaé').chunk(0, 4)
+        short = TokenizedDocument.from_text('abc').chunk(0, 3)
+        pieces = helper_functions_llm._embedding_pieces([short, cut], max_tokens=5, margin=2)
+        self.assertEqual(pieces, [('abc', 3), ('aaa', 3), ('\ufffd', 3)])
+
+    def test_long_texts_are_split_below_the_limit(self):
+        pieces = helper_functions_llm._embedding_pieces(['x' * 12, 'y' * 5], max_tokens=5, margin=1)
+        self.assertEqual(pieces, [('xxxx', 4), ('xxxx', 4), ('xxxx', 4), ('yyyyy', 5)])
+
+
+class SplitPassagesTests(SimpleTestCase):
+    TEXT = ' '.join(f"word{n}" for n in range(200))
+
+    def test_size_and_coverage(self):
+        passages = split_passages(self.TEXT, 100, 0)
+        self.assertTrue(all(len(passage) <= 100 for passage in passages))
+        self.assertEqual(' '.join(passages).split(), self.TEXT.split())
+
+    def test_overlap(self):
+        passages = split_passages(self.TEXT, 100, 30)
+        self.assertTrue(all(len(passage) <= 100 for passage in passages))
+        for previous, passage in zip(passages, passages[1:]):
+            # every passage repeats the last words of the one before
+            first = passage.split()[0]
+            self.assertIn(first, previous.split())
+            self.assertLessEqual(len(previous) - previous.index(first), 30)
+
+    def test_long_words_are_cut(self):
+        self.assertEqual(split_passages('a' * 25, 10, 0), ['a' * 10, 'a' * 10, 'a' * 5])
+        self.assertEqual(split_passages('   ', 10, 0), [])
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_fusion(self):
+        fused = reciprocal_rank_fusion({'lexical': [3, 1, 2], 'vector': [1, 4]}, k=60)
+        self.assertEqual([item for item, _, _ in fused], [1, 3, 4, 2])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+        self.assertEqual(fused[0][2], ['lexical', 'vector'])
+        self.assertEqual(fused[1][2], ['lexical'])
+
+    def test_ties_are_broken_by_id(self):
+        fused = reciprocal_rank_fusion({'lexical': [5, 2], 'vector': [2, 5]}, k=60)
+        self.assertEqual([item for item, _, _ in fused], [2, 5])
+
+
+class SectionReferenceTests(SimpleTestCase):
+    def test_bare_references(self):
+        self.assertEqual(section_reference('section 302'), (['302'], True))
+        self.assertEqual(section_reference('Section 302 of the IPC'), (['302'], True))
+        self.assertEqual(section_reference('u/s 498-A and 304B'), (['498A', '304B'], True))
+
+    def test_reference_inside_a_question(self):
+        self.assertEqual(section_reference('what does s. 420 say about cheating'), (['420'], False))
+
+    def test_no_reference(self):
+        self.assertEqual(section_reference('culpable homicide'), ([], False))
+        # a number alone is not a reference, nor is a number too long to be a section
+        self.assertEqual(section_reference('302'), ([], False))
+        self.assertEqual(section_reference('section 3000'), ([], False))
+
+
+class SectionPassagesTests(SimpleTestCase):
+    def sections(self, pages):
+        texts, metadata = [], []
+        for page, passages in enumerate(pages):
+            for text in passages:
+                texts.append(text)
+                metadata.append({'source': 'act.pdf', 'page': page})
+        return section_passages(texts, metadata)
+
+    def test_headings_and_continuations(self):
+        sections = self.sections([
+            ['1. Short title .—This Act may be called the Act.\n2. Murder .—Whoever commits murder',
+             'shall be punished with death.'],
+            ['3[3A. Theft .—Whoever takes property'],
+        ])
+        self.assertEqual(sections, {'1': [0], '2': [0, 1], '3A': [2]})
+
+    def test_contents_pages_are_skipped(self):
+        sections = self.sections([
+            ['ARRANGEMENT OF SECTIONS\n1. Short title.\n2. Murder. —if committed by a convict.\n3. Theft.',
+             'if offence be not committed.\n4. Robbery.'],
+            ['1. Short title .—This Act may be called the Act.\n2. Murder .—Whoever commits murder'],
+        ])
+        self.assertEqual(sections, {'1': [2], '2': [2]})
+
+    def test_footnotes_are_skipped(self):
+        sections = self.sections([
+            ['1. Short title .—This Act may be called the Act.\n'
+             '                              \n1. Ins. by Act 8 of 1882.\n2. Subs. by Act 26 of 1955, for “ Secondly.—Fine”.',
+             '3. Subs. by Act 36 of 1957, for “Thirdly.—Forfeiture”.'],
+            ['2. Murder .—Whoever commits murder'],
+        ])
+        self.assertEqual(sections, {'1': [0], '2': [2]})
+
+    def test_shipped_ipc_index(self):
+        directory = settings.IPC_VECTOR_INDEX_DIR
+        if not os.path.exists(os.path.join(directory, 'index.faiss')):
+            self.skipTest("IPC index not available")
+        docstore = open_docstore(directory)
+        texts = [docstore.text(i) for i in range(len(docstore))]
+        sections = section_passages(texts, [docstore.metadata(i) for i in range(len(docstore))])
+        # these resolved to the arrangement of sections or to footnotes
+        for section, title in [('115', 'Abetment of offence punishable with death'),
+                               ('116', 'Abetment of offenc'),
+                               ('153', 'provoca'),
+                               ('201', 'Causing disappearance of evidence'),
+                               ('212', 'Harbouring offender'),
+                               ('213', 'Taking gift'),
+                               ('2', 'Punishment of of fences committed within India'),
+                               ('302', 'Punishment for murder')]:
+            with self.subTest(section=section):
+                first = texts[sections[section][0]]
+                self.assertRegex(first, rf'(?m)^[ \t]*(?:\d{{0,2}}\[)?{section}\. [^\n]*{title}')
+                self.assertLessEqual(len(sections[section]), 6)
+
+    def test_lexical_index_is_never_built_on_open(self):
+        if not os.path.exists(os.path.join(settings.IPC_VECTOR_INDEX_DIR, 'index.faiss')):
+            self.skipTest("IPC index not available")
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'ipc')
+            shutil.copytree(settings.IPC_VECTOR_INDEX_DIR, directory,
+                            ignore=shutil.ignore_patterns('lexical*'))
+            files = sorted(os.listdir(directory))
+            index = StatuteIndex(directory)
+            with self.assertRaisesMessage(IndexUnavailable, 'build_vector_index --lexical-only'):
+                index.search('section 302', mode='lexical')
+            self.assertEqual(sorted(os.listdir(directory)), files)
+
+    def test_bare_reference_fast_path(self):
+        if not os.path.exists(os.path.join(settings.IPC_VECTOR_INDEX_DIR, 'index.faiss')):
+            self.skipTest("IPC index not available")
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, 'ipc')
+            shutil.copytree(settings.IPC_VECTOR_INDEX_DIR, directory,
+                            ignore=shutil.ignore_patterns('lexical*'))
+            ensure_lexical_index(directory)
+            index = StatuteIndex(directory)
+            for section in ('115', '201', '213'):
+                with self.subTest(section=section):
+                    # lexical mode never embeds the query
+                    hits = index.search(f"section {section}", top_k=5, mode='lexical')
+                    self.assertEqual(hits[0]['id'], index.sections[section][0])
+                    self.assertIn('section', hits[0]['matched_by'])
+                    # the slots after the section's passages are filled by the BM25 results
+                    self.assertEqual(len(hits), 5)
+                    self.assertEqual(len({hit['id'] for hit in hits}), 5)
+
+
+class MetricsViewTests(SimpleTestCase):
+    def get(self, address, staff=False):
+        request = RequestFactory().get('/metrics', REMOTE_ADDR=address)
+        request.user = mock.Mock(is_staff=staff)
+        return metrics_view(request)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1', '10.0.0.0/8'], METRICS_DIR=None)
+    def test_access(self):
+        self.assertEqual(self.get('127.0.0.1').status_code, 200)
+        self.assertEqual(self.get('10.1.2.3').status_code, 200)
+        self.assertEqual(self.get('192.0.2.1').status_code, 403)
+        self.assertEqual(self.get('192.0.2.1', staff=True).status_code, 200)
+
+    def test_snapshots_of_exited_processes_are_deleted(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            snapshot = {'counters': [['requests_total', [['endpoint', 'ipc-search'], ['status', 200]], 3]],
+                        'histograms': []}
+            with open(os.path.join(directory, f"{exited.pid}.json"), 'w') as f:
+                json.dump(snapshot, f)
+            body = self.get('127.0.0.1').content.decode()
+            self.assertNotIn('endpoint="ipc-search"', body)
+            self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(pdf_extraction, _page_cache=OrderedDict(), _page_cache_bytes=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(PDF_PAGE_CACHE_MAX_BYTES=12)
+    def test_page_cache_is_bounded_in_utf8_bytes(self):
+        pdf_extraction.cache_pages('a', ('é' * 4,))
+        pdf_extraction.cache_pages('b', ('é' * 2,))
+        self.assertEqual(pdf_extraction._page_cache_bytes, 12)
+        pdf_extraction.cache_pages('c', ('x',))
+        self.assertIsNone(pdf_extraction.cached_pages('a'))
+        self.assertEqual(pdf_extraction._page_cache_bytes, 5)
+        pdf_extraction.cache_pages('d', ('é' * 7,))
+        self.assertIsNone(pdf_extraction.cached_pages('d'))
+
+    @override_settings(PDF_PARALLEL_MIN_PAGES=4, PDF_EXTRACTION_WORKERS=2)
+    def test_page_ranges_are_extracted_from_a_temporary_file(self):
+        document = fitz.open()
+        for page_num in range(6):
+            document.new_page().insert_text((72, 72), f"Page {page_num}")
+        pdf_bytes = document.tobytes()
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(tempfile, 'tempdir', directory):
+            pages = list(pdf_extraction._iter_extracted(pdf_bytes))
+            self.assertEqual([page.strip() for page in pages], [f"Page {page_num}" for page_num in range(6)])
+            self.assertEqual(os.listdir(directory), [])
+
+
+class AutocompleteIndexTests(SimpleTestCase):
+    # sorted keys with the row they come from and its score
+    KEYS = [('kumar', 0, 5), ('ram vs kumar', 0, 5), ('ramesh', 1, 9), ('ravi', 2, 1), ('ravi kumar', 3, 7)]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        keys = [key.encode() for key, _, _ in self.KEYS]
+        with open(os.path.join(tmp.name, 'keys.blob'), 'wb') as f:
+            f.write(b''.join(key + b'\0' for key in keys))
+        np.save(os.path.join(tmp.name, 'key_offsets.npy'), np.cumsum([0] + [len(key) + 1 for key in keys]))
+        np.save(os.path.join(tmp.name, 'key_rows.npy'), np.array([row for _, row, _ in self.KEYS], dtype=np.uint32))
+        np.save(os.path.join(tmp.name, 'key_scores.npy'), np.array([score for _, _, score in self.KEYS], dtype=np.int32))
+        self.index = AutocompleteIndex(tmp.name)
+
+    def complete(self, text, limit=10):
+        rows, truncated = self.index.complete(text, limit)
+        return rows.tolist(), truncated
+
+    def test_completions_by_score(self):
+        self.assertEqual(self.complete('Ra'), ([1, 3, 0, 2], False))
+        self.assertEqual(self.complete('ra', limit=2), ([1, 3], False))
+        self.assertEqual(self.complete('RAVI-'), ([3, 2], False))
+        self.assertEqual(self.complete('kumar'), ([0], False))
+        self.assertEqual(self.complete('x'), ([], False))
+        self.assertEqual(self.complete(' - '), ([], False))
+
+    @override_settings(CASE_FACET_INDEX_DIR='/nonexistent')
+    def test_build_ranks_by_the_dates_of_the_given_store(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'cases.csv')
+            with open(csv_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Case No', 'Case Title', 'PDF Link', 'Decision Date_left'])
+                writer.writerows([['CRL.A. 1/2001', 'Ram vs State', 'a.pdf', '05-03-2001'],
+                                  ['CRL.A. 2/2019', 'Ramesh vs State', 'b.pdf', '17-11-2019'],
+                                  ['CRL.A. 3/2010', 'Ravi vs Union', 'c.pdf', ''],
+                                  ['CRL.A. 4/2012', 'Rakesh vs Union', 'd.pdf', '01-02-2012']])
+            build_case_store(csv_path, os.path.join(tmp, 'store'))
+            build_autocomplete_index(CaseStore(os.path.join(tmp, 'store')), os.path.join(tmp, 'autocomplete'))
+            index = AutocompleteIndex(os.path.join(tmp, 'autocomplete'))
+            # newest first, the undated case last
+            self.assertEqual(index.complete('ra')[0].tolist(), [1, 3, 0, 2])
+            self.assertEqual(index.complete('state')[0].tolist(), [1, 0])
+            self.assertEqual(index.complete('crl a 3')[0].tolist(), [2])
+
+    def test_long_ranges_are_flagged_truncated(self):
+        with mock.patch.object(case_autocomplete, 'MAX_SCANNED_KEYS', 3):
+            # only 'ram vs kumar', 'ramesh' and 'ravi' are ranked
+            self.assertEqual(self.complete('ra'), ([1, 0, 2], True))
+            self.assertEqual(self.complete('rav'), ([3, 2], False))
@@ -0,0 +1,118 @@
+"""
+A document encoded once with tiktoken.
+
+TokenizedDocument keeps the token ids of the whole text as one uint32 array.
+Chunks, overlapping windows and token budgets are slices of that array and
+only the slices whose text is needed are decoded. The decoded chunks are
+TokenChunk strings that remember their token count, so the embedding and
+summary steps never encode them again.
+
+That count is the length of the slice, and decoded text does not always
+encode back into the same tokens: a cut through a word or a multi-byte
+character, and the separators chunks are joined with, tokenize differently.
+Prompts built from several chunks are therefore measured once more, joined
+(join_within_budget).
+"""
+from functools import lru_cache
+import numpy as np
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name):
+    return tiktoken.get_encoding(encoding_name)
+
+
+class TokenChunk(str):
+    """Text of a token span, carrying its token count."""
+
+    def __new__(cls, text, token_count, start=0):
+        chunk = super().__new__(cls, text)
+        chunk.token_count = token_count
+        chunk.start = start
+        return chunk
+
+
+def token_count(text, encoding_name=DEFAULT_ENCODING):
+    """Token count of a string, without encoding it again when it is a TokenChunk."""
+    count = getattr(text, 'token_count', None)
+    return count if count is not None else len(get_encoding(encoding_name).encode(text))
+
+
+def join_within_budget(texts, budget, separator=' ', encoding_name=DEFAULT_ENCODING):
+    """
+    As many of `texts` as fit into `budget` tokens once joined by `separator`, in order, as one TokenChunk.
+    The known token counts only pick the candidates; the joined text is encoded and texts are dropped
+    from the end until it fits. A single text over the budget is cut to it.
+    """
+    encoding = get_encoding(encoding_name)
+    parts, total = [], 0
+    for text in texts:
+        length = token_count(text, encoding_name)
+        if parts and total + length > budget:
+            break
+        parts.append(text)
+        total += length
+    while len(parts) > 1:
+        joined = separator.join(parts)
+        length = len(encoding.encode(joined))
+        if length <= budget:
+            return TokenChunk(joined, length)
+        parts.pop()
+    if not parts:
+        return TokenChunk('', 0)
+    tokens = encoding.encode(parts[0])
+    cut = min(len(tokens), budget)
+    while True:
+        text = encoding.decode(tokens[:cut])
+        length = len(encoding.encode(text))
+        if length <= budget:
+            return TokenChunk(text, length)
+        # over by the few tokens a cut through a character or word re-encodes into
+        cut -= 1
+
+
+class TokenizedDocument:
+    def __init__(self, tokens, encoding_name=DEFAULT_ENCODING):
+        self.tokens = np.asarray(tokens, dtype=np.uint32)
+        self.encoding_name = encoding_name
+        self.encoding = get_encoding(encoding_name)
+
+    @classmethod
+    def from_text(cls, text, encoding_name=DEFAULT_ENCODING):
+        return cls(get_encoding(encoding_name).encode(text), encoding_name)
+
+    @classmethod
+    def from_pages(cls, pages, encoding_name=DEFAULT_ENCODING):
+        """Encode pages as they arrive, e.g. from pdf_extraction.iter_pages()."""
+        encoding = get_encoding(encoding_name)
+        parts = [np.asarray(encoding.encode(page), dtype=np.uint32) for page in pages if page]
+        return cls(np.concatenate(parts) if parts else np.empty(0, dtype=np.uint32), encoding_name)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def text(self, start=0, stop=None):
+        return self.encoding.decode(self.tokens[start:stop].tolist())
+
+    def chunk(self, start, stop):
+        stop = min(len(self.tokens), stop)
+        return TokenChunk(self.text(start, stop), stop - start, start)
+
+    def spans(self, size, overlap=0):
+        """(start, stop) of consecutive windows of `size` tokens, each overlapping the previous by `overlap`."""
+        if size <= overlap:
+            raise ValueError("Chunk size must be larger than the overlap")
+        step = size - overlap
+        return [(start, min(start + size, len(self.tokens)))
+                for start in range(0, max(len(self.tokens) - overlap, 1), step)
+                if start < len(self.tokens)]
+
+    def chunks(self, size, overlap=0):
+        return [self.chunk(start, stop) for start, stop in self.spans(size, overlap)]
+
+    def truncate(self, budget):
+        """The first `budget` tokens as a TokenChunk."""
+        return self.chunk(0, budget)
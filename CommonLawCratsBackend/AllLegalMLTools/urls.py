@@ -1,10 +1,13 @@
 from django.urls import path
-from .views import CaseSearchView, CaseSummaryView, UploadCaseDocumentOrURLView, LawChatBotView
+from .views import CaseSearchView, CaseSummaryView, UploadCaseDocumentOrURLView, LawChatBotView, CaseAutocompleteView, SummaryJobStatusView, StatuteSearchView
 
 urlpatterns = [
     # Define your URL patterns here
     path('case-summarizer/', UploadCaseDocumentOrURLView.as_view(), name='case-summarizer'),
     path('case-search-query/', CaseSearchView.as_view(), name='case-search-query'),
+    path('case-autocomplete/', CaseAutocompleteView.as_view(), name='case-autocomplete'),
     path('case-search-summary/', CaseSummaryView.as_view(), name='case-search-summary'),
+    path('summary-jobs/<uuid:job_id>/', SummaryJobStatusView.as_view(), name='summary-job-status'),
     path('lawchatbot/', LawChatBotView.as_view(), name="lawchatbot"),
+    path('ipc-search/', StatuteSearchView.as_view(), name='ipc-search'),
 ]
\ No newline at end of file
@@ -1,20 +1,57 @@
-import os
 import time
 import requests
-import pandas as pd
-from django.conf import settings
+import numpy as np
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
 from dotenv import load_dotenv
 load_dotenv()
 
-from .helper_functions_llm import extract_text_from_pdf, clean_text, split_text_into_token_chunks, generate_embeddings, index_embeddings, generate_summary, retrieve_similar_chunks, download_pdf_from_url
+from .pdf_downloader import download_pdf, PDFTooLarge, PDFDownloadError
+from .summarization import summarize_document, summarize_case, stream_document_summary, stream_case_summary, case_summary_payload
+from .streaming import event_stream_response
+from .chunk_selection import selection_method
+from .jobs import enqueue_document_job, enqueue_case_job, job_status
+from .models import SummaryJob
+from .case_store import get_case_store, CASE_ID_COLUMN, IndexUnavailable
+from .search_index import get_case_search_index, SearchResult
+from .semantic_search import get_semantic_index
+from .case_facets import get_facet_index, date_ordinal
+from .case_autocomplete import get_autocomplete_index
+from .statute_index import get_statute_index, SEARCH_MODES as STATUTE_SEARCH_MODES
+from .metrics import stage
+from .pagination import InvalidCursor, encode_cursor, decode_cursor, parse_limit, stream_json_rows
 from rest_framework.permissions import AllowAny
 
 
 
+def request_flag(request, name):
+    return str(request.data.get(name, '')).lower() in ('1', 'true', 'yes')
+
+def optional_flag(request, name):
+    """request_flag(), or None when the request leaves the choice to the settings."""
+    return request_flag(request, name) if request.data.get(name) not in (None, '') else None
+
+def job_accepted_response(request, job):
+    status_url = request.build_absolute_uri(reverse('summary-job-status', args=[job.job_id]))
+    return Response({'job_id': str(job.job_id), 'status': job.status, 'status_url': status_url},
+                    status=status.HTTP_202_ACCEPTED)
+
+def download_error_status(error):
+    return status.HTTP_413_REQUEST_ENTITY_TOO_LARGE if isinstance(error, PDFTooLarge) else status.HTTP_502_BAD_GATEWAY
+
+def summary_events(events, payload):
+    """Summary stream events, with the finished summary sent as the endpoint's usual response body."""
+    try:
+        for event, data in events:
+            yield event, payload(data) if event == 'done' else data
+    except (PDFTooLarge, PDFDownloadError) as e:
+        yield 'error', {'error': str(e), 'status': download_error_status(e)}
+
 # Below section is for case summarizer
 class UploadCaseDocumentOrURLView(APIView):
     parser_classes = (MultiPartParser, FormParser)
@@ -24,104 +61,247 @@ class UploadCaseDocumentOrURLView(APIView):
         caseURL = request.data.get('url')
 
         if caseDocument or caseURL:
-            if caseDocument:
-                text = extract_text_from_pdf(caseDocument)
-            else:
-                caseURLPdf_stream = download_pdf_from_url(caseURL)
-                text = extract_text_from_pdf(caseURLPdf_stream)
+            try:
+                selection = selection_method(request.data.get('selection') or None)
+                map_reduce = optional_flag(request, 'map_reduce')
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            cleaned_text = clean_text(text)
-            chunks = split_text_into_token_chunks(cleaned_text, 4000)
+            if request_flag(request, 'async'):
+                # the worker downloads the url itself, the request only stores the job
+                job = enqueue_document_job(pdf_bytes=caseDocument.read() if caseDocument else None,
+                                           url=None if caseDocument else caseURL, selection=selection,
+                                           map_reduce=map_reduce)
+                return job_accepted_response(request, job)
 
-            try:
-                embeddings = generate_embeddings(chunks)
-                index = index_embeddings(embeddings)
+            if request_flag(request, 'stream'):
+                pdf_file = caseDocument.read() if caseDocument else None
 
-                query_embedding = generate_embeddings([cleaned_text[:8191]])[0]  
-                similar_chunks = retrieve_similar_chunks(index, query_embedding, chunks)
+                def events():
+                    if pdf_file is None:
+                        yield 'status', 'downloading'
+                    pdf_bytes = pdf_file if pdf_file is not None else download_pdf(caseURL)
+                    yield from stream_document_summary(pdf_bytes, selection=selection, map_reduce=map_reduce)
 
-                summary = generate_summary(similar_chunks)
+                return event_stream_response(request, summary_events(events(), lambda summary: {'summary': summary}))
+
+            try:
+                pdf_bytes = caseDocument.read() if caseDocument else download_pdf(caseURL)
+                summary, cache_hit = summarize_document(pdf_bytes, selection=selection, map_reduce=map_reduce)
 
                 # here we need to return generated summary to frontend through api endpoint
-                return Response({'summary': summary}, status=status.HTTP_200_OK)
-            
+                response = Response({'summary': summary}, status=status.HTTP_200_OK)
+                response['X-Summary-Cache'] = 'hit' if cache_hit else 'miss'
+                return response
+
+            except (PDFTooLarge, PDFDownloadError) as e:
+                return Response({'error': str(e)}, status=download_error_status(e))
             except Exception as e:
                 return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         else:
             return Response({'error': 'Invalid file type and void url'})
         
+def case_search_rows(case_store, docs, scores):
+    # gather whole columns for the page instead of materialising one row at a time
+    titles = case_store.column('Case Title').take(docs)
+    case_numbers = case_store.column('Case No').take(docs)
+    pdf_links = case_store.column('PDF Link').take(docs)
+    case_ids = case_store.column(CASE_ID_COLUMN).take(docs)
+    return [
+        {
+            'case_id': case_id,
+            'case_title': title,
+            'case_no': case_no,
+            'pdf_link': pdf_link,
+            'index' : int(idx),
+            'score': round(float(score), 4)
+        }
+        for idx, score, case_id, title, case_no, pdf_link in zip(docs, scores, case_ids, titles, case_numbers, pdf_links)
+    ]
+
 # Below classes both together is for handling case search and generating summary functionality
 class CaseSearchView(APIView):
     # in development phase it is made that all can access this class view but before production make sure to change
     # AllowAny to IsAuthenticated or other built-in classes
     permission_classes = [AllowAny]      
+    default_limit = 20
+    max_limit = 200
+    stream_batch_size = 500
+
+    search_modes = ('keyword', 'semantic')
+
+    def search(self, mode, query, top_k, candidates=None):
+        if mode == 'semantic':
+            semantic_index = get_semantic_index()
+            # nearest neighbour search has no natural match count: the whole window of neighbours the client
+            # may page through is fetched, so that `total`, the facets and the cursor all describe the same docs
+            max_results = min(settings.CASE_SEMANTIC_MAX_RESULTS, semantic_index.index.ntotal)
+            results = semantic_index.search(query, top_k=max_results)
+            if candidates is not None:
+                keep = np.isin(results.docs, candidates)
+                return SearchResult(results.docs[keep], results.scores[keep], int(keep.sum()))
+            return results
+        return get_case_search_index().search(query, top_k=top_k, candidates=candidates)
+
+    def filters(self, request):
+        def values(name):
+            if hasattr(request.data, 'getlist'):
+                items = request.data.getlist(name)
+            else:
+                items = request.data.get(name)
+                items = items if isinstance(items, list) else [items]
+            return [str(item) for item in items if item not in (None, '')]
+
+        decided_from = request.data.get('decided_from') or None
+        decided_to = request.data.get('decided_to') or None
+        for value in (decided_from, decided_to):
+            if value is not None:
+                # raises ValueError for anything that is not YYYY-MM-DD
+                date_ordinal(value)
+        return {
+            'judges': values('judge'),
+            'disposal_natures': values('disposal_nature'),
+            'date_from': decided_from,
+            'date_to': decided_to,
+        }
 
     def post(self, request, format=None):
         case_search_query = request.data.get('search_query')
-        file_path = os.path.join(settings.BASE_DIR, 'AllLegalMLTools', 'updated_merged_dataset.csv')
-        merged_df = pd.read_csv(file_path)
 
         if case_search_query:
-            case_search_query = case_search_query.lower()
-            results = merged_df[merged_df['details'].str.contains(case_search_query, na=False)]
+            case_store = get_case_store()
+            stream = request_flag(request, 'stream')
+            try:
+                # a streamed response without an explicit limit sends every match
+                limit = None if stream and request.data.get('limit') in (None, '') else \
+                    parse_limit(request.data.get('limit'), self.default_limit, self.max_limit)
+                offset = decode_cursor(request.data.get('cursor'), case_store.version)
+            except InvalidCursor as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except (TypeError, ValueError):
+                return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+            mode = request.data.get('mode') or 'keyword'
+            if mode not in self.search_modes:
+                return Response({'error': f"mode must be one of {', '.join(self.search_modes)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                filters = self.filters(request)
+            except ValueError:
+                return Response({'error': 'decided_from and decided_to must be dates formatted as YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+            top_k = None if limit is None else offset + limit
+            try:
+                facet_index = get_facet_index()
+                with stage('filter'):
+                    candidates = facet_index.candidates(**filters)
+                with stage(f'search_{mode}'):
+                    results = self.search(mode, case_search_query, top_k, candidates)
+            except IndexUnavailable as e:
+                return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            end = results.total if limit is None else min(offset + limit, results.total)
+            page_docs, page_scores = results.docs[offset:end], results.scores[offset:end]
+            with stage('facets'):
+                facets = facet_index.counts(results.matched)
+            header = {'mode': mode, 'total': results.total, 'limit': limit, 'facets': facets}
+            footer = {'next_cursor': encode_cursor(end, case_store.version) if end < results.total else None}
+
+            if stream:
+                batches = (
+                    case_search_rows(case_store, page_docs[i:i + self.stream_batch_size], page_scores[i:i + self.stream_batch_size])
+                    for i in range(0, len(page_docs), self.stream_batch_size)
+                )
+                return StreamingHttpResponse(stream_json_rows(header, batches, footer), content_type='application/json')
+
+            response_data = {**header, 'results': case_search_rows(case_store, page_docs, page_scores), **footer}
+            if results.total == 0:
+                response_data['message'] = f"No results found for '{case_search_query}'"
+            return Response(response_data, status=status.HTTP_200_OK)
 
-            if results.empty:
-                return Response({'message': f"No results found for '{case_search_query}'"}, status=status.HTTP_200_OK)
+        else:
+            return Response({'error': 'Invalid query'}, status=status.HTTP_400_BAD_REQUEST)
+        
+class CaseAutocompleteView(APIView):
+    permission_classes = [AllowAny]
+    default_limit = 8
+    max_limit = 20
 
-            response_data = [
+    def get(self, request, format=None):
+        return self.complete(request.query_params.get('q', ''), request.query_params.get('limit'))
+
+    def post(self, request, format=None):
+        return self.complete(request.data.get('query', ''), request.data.get('limit'))
+
+    def complete(self, query, limit):
+        try:
+            limit = parse_limit(limit, self.default_limit, self.max_limit)
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        case_store = get_case_store()
+        try:
+            autocomplete_index = get_autocomplete_index()
+        except IndexUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        with stage('autocomplete'):
+            rows, truncated = autocomplete_index.complete(str(query), limit)
+        completions = case_store.rows(rows, columns=[CASE_ID_COLUMN, 'Case Title', 'Case No', 'Decision Date_left'])
+        return Response({
+            'query': query,
+            'completions': [
                 {
+                    'case_id': row[CASE_ID_COLUMN],
                     'case_title': row['Case Title'],
                     'case_no': row['Case No'],
-                    'pdf_link': row['PDF Link'],
-                    'index' : idx
+                    'decision_date': row['Decision Date_left'],
                 }
-                for idx, row in results.iterrows()
-            ]
+                for row in completions
+            ],
+            # the prefix matches too many keys to rank them all, typing more gives the best completions
+            'truncated': truncated,
+        }, status=status.HTTP_200_OK)
 
-            return Response(response_data, status=status.HTTP_200_OK)
-
-        else:
-            return Response({'error': 'Invalid query'}, status=status.HTTP_400_BAD_REQUEST)
-        
 class CaseSummaryView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request, format = None):
+        case_id = request.data.get('case_id')
         case_index = request.data.get('index')
-        file_path = os.path.join(settings.BASE_DIR, 'AllLegalMLTools', 'updated_merged_dataset.csv')
-        merged_df = pd.read_csv(file_path)
 
-        if case_index is not None:
+        if case_id is not None or case_index is not None:
+            try:
+                selection = selection_method(request.data.get('selection') or None)
+                map_reduce = optional_flag(request, 'map_reduce')
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
             try:
-                case_index = int(case_index)
-                results = merged_df.iloc[case_index]
+                case_store = get_case_store()
+                if case_id is not None:
+                    case_index = case_store.lookup(case_id)
+                    if case_index is None:
+                        raise KeyError(case_id)
+                else:
+                    # positional index sent by older clients, only valid for the dataset it was searched on
+                    case_index = int(case_index)
+                results = case_store.row(case_index)
 
-                pdf_url = results['PDF Link']
-                response_data = []
                 try:
-                    pdf_stream = download_pdf_from_url(pdf_url)
-                    text = extract_text_from_pdf(pdf_stream)
-                    cleaned_text = clean_text(text)
-                    chunks = split_text_into_token_chunks(cleaned_text, 8191)
-
-                    embeddings = generate_embeddings(chunks)
-                    index = index_embeddings(embeddings)
-
-                    query_embedding = generate_embeddings([cleaned_text[:8191]])[0] 
-                    similar_chunks = retrieve_similar_chunks(index, query_embedding, chunks)
-
-                    summary = generate_summary(similar_chunks)
-                    response_data.append({
-                        'Case Title': results['Case Title'],
-                        'Case No': results['Case No'],
-                        'Judges': results['Judges'],
-                        'Decision Date': results['Decision Date_left'],
-                        'Disposal Nature': results['Disposal Nature'],
-                        'PDF Link': results['PDF Link'],
-                        'Summary': summary
-                    })
-                    return Response(response_data, )
+                    if request_flag(request, 'async'):
+                        job = enqueue_case_job(results[CASE_ID_COLUMN], selection=selection, map_reduce=map_reduce)
+                        return job_accepted_response(request, job)
+                    if request_flag(request, 'stream'):
+                        events = stream_case_summary(results, case_store.version, selection=selection, map_reduce=map_reduce)
+                        return event_stream_response(
+                            request, summary_events(events, lambda summary: case_summary_payload(results, summary)))
+
+                    summary, cache_hit = summarize_case(results, case_store.version, selection=selection, map_reduce=map_reduce)
+                    response = Response(case_summary_payload(results, summary), )
+                    response['X-Summary-Cache'] = 'hit' if cache_hit else 'miss'
+                    return response
+                except (PDFTooLarge, PDFDownloadError) as e:
+                    return Response({'error': str(e)}, status=download_error_status(e))
                 except Exception as e:
                     return Response({'error': f"Failed to process:'{str(e)}'"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 
@@ -129,16 +309,69 @@ class CaseSummaryView(APIView):
                 return Response({'error': f"Case not found"}, status=status.HTTP_404_NOT_FOUND)
             
         else:
-            return Response({'error': 'case_index is null'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': 'case_id and index are both null'}, status=status.HTTP_400_BAD_REQUEST)
         
+class StatuteSearchView(APIView):
+    """
+    Top IPC passages for a query ({"query": ...}) or for many queries at once ({"queries": [...]}).
+    "mode" is 'hybrid' (BM25 and vector search fused), 'lexical' or 'vector', IPC_SEARCH_MODE by default.
+    """
+    permission_classes = [AllowAny]
+    default_limit = 5
+    max_limit = 50
+
+    def get(self, request, format=None):
+        return self.retrieve(request.query_params.get('q'), None, request.query_params.get('limit'),
+                             request.query_params.get('mode'))
+
+    def post(self, request, format=None):
+        return self.retrieve(request.data.get('query'), request.data.get('queries'), request.data.get('limit'),
+                             request.data.get('mode'))
+
+    def retrieve(self, query, queries, limit, mode):
+        try:
+            limit = parse_limit(limit, self.default_limit, self.max_limit)
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        mode = mode or settings.IPC_SEARCH_MODE
+        if mode not in STATUTE_SEARCH_MODES:
+            return Response({'error': f"mode must be one of {', '.join(STATUTE_SEARCH_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = queries is not None
+        queries = queries if batch else [query]
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(text, str) and text.strip() for text in queries):
+            return Response({'error': 'query must be a non-empty string, queries a non-empty list of them'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(queries) > settings.IPC_SEARCH_MAX_BATCH:
+            return Response({'error': f"At most {settings.IPC_SEARCH_MAX_BATCH} queries per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with stage(f'ipc_search_{mode}'):
+                results = get_statute_index().search_batch(queries, top_k=limit, mode=mode)
+        except IndexUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            return Response({'error': f"Failed to search the IPC index: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if not batch:
+            return Response({'query': query, 'mode': mode, 'results': results[0]}, status=status.HTTP_200_OK)
+        return Response({'mode': mode, 'results': [{'query': text, 'results': hits} for text, hits in zip(queries, results)]},
+                        status=status.HTTP_200_OK)
+
+class SummaryJobStatusView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request, job_id, format=None):
+        job = SummaryJob.objects.filter(job_id=job_id).defer('document').first()
+        if job is None:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job_status(job), status=status.HTTP_200_OK)
+
 class LawChatBotView(APIView):
     permission_classes = [AllowAny]
-    max_retries = 5  # Set the maximum number of retries
-    retry_delay = 10  # Time to wait between retries (in seconds)
 
     def make_submit_query_call(self, query):
 
-        url = "https://7tmdf4lcsil23zs6hcbaptmo5q0dgvla.lambda-url.us-east-1.on.aws/submit_query"
+        url = f"{settings.LAWCHATBOT_URL}/submit_query"
 
         response = requests.post(url, json={"query_text": query})
         response.raise_for_status()
@@ -147,11 +380,11 @@ class LawChatBotView(APIView):
         
     def get_query_response(self, unique_id):
 
-        base_url = "https://7tmdf4lcsil23zs6hcbaptmo5q0dgvla.lambda-url.us-east-1.on.aws/get_query"
+        base_url = f"{settings.LAWCHATBOT_URL}/get_query"
         url = f"{base_url}?query_id={unique_id}"
         
         # for _ in range(max_retries):
-        for attempt in range(self.max_retries):
+        for attempt in range(settings.LAWCHATBOT_MAX_POLLS):
             response = requests.get(url)
             response.raise_for_status()
             response_data = response.json()
@@ -161,7 +394,7 @@ class LawChatBotView(APIView):
                 return response_data  # Return the complete response
 
             # If not complete, wait before the next attempt
-            time.sleep(self.retry_delay)
+            time.sleep(settings.LAWCHATBOT_POLL_INTERVAL)
 
         return None  # Return None if the response is not complete after max retries
 
@@ -74,6 +74,7 @@ INSTALLED_APPS = [
 ASGI_APPLICATION = 'CommonLawCratsBackend.asgi.application'
 
 MIDDLEWARE = [
+    'AllLegalMLTools.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -125,6 +126,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / "db.sqlite3",  # Ensure you have this line for SQLite
+        # the background summary workers write concurrently with the web requests, wait for locks
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -243,4 +246,97 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
 # Media files (Uploaded by users)
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# Case dataset used by the case search / case summary endpoints.
+# The CSV is converted once into a memory-mapped columnar store (see AllLegalMLTools/case_store.py)
+CASE_DATASET_CSV = os.path.join(BASE_DIR, 'AllLegalMLTools', 'updated_merged_dataset.csv')
+CASE_STORE_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'case_store')
+# BM25 inverted index over the case dataset (see AllLegalMLTools/search_index.py)
+CASE_SEARCH_INDEX_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'case_search_index')
+# Semantic (ANN) search over the case dataset (see AllLegalMLTools/semantic_search.py), built by
+# `manage.py build_case_indexes`; it is rebuilt when the backend or the index type change
+CASE_SEMANTIC_INDEX_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'case_semantic_index')
+CASE_SEMANTIC_BACKEND = env('CASE_SEMANTIC_BACKEND', default='hashing')   # 'hashing' (local) or 'openai'
+CASE_SEMANTIC_INDEX_TYPE = env('CASE_SEMANTIC_INDEX_TYPE', default='ivf')  # 'ivf' or a type of AllLegalMLTools/ann_index.py
+CASE_SEMANTIC_NPROBE = 16
+CASE_SEMANTIC_EF_SEARCH = 64
+CASE_SEMANTIC_MAX_RESULTS = 1000
+# Judge / disposal nature / decision date filters (see AllLegalMLTools/case_facets.py)
+CASE_FACET_INDEX_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'case_facet_index')
+# Case title / case number autocomplete (see AllLegalMLTools/case_autocomplete.py)
+CASE_AUTOCOMPLETE_INDEX_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'case_autocomplete_index')
+# Generated summaries are cached in the database, least recently used entries are evicted above this size
+SUMMARY_CACHE_MAX_BYTES = env.int('SUMMARY_CACHE_MAX_BYTES', default=200 * 1024 * 1024)
+# Background summary jobs (see AllLegalMLTools/jobs.py), handled by `manage.py run_summary_workers`
+# and/or, with SUMMARY_JOB_WORKERS_AUTOSTART, by SUMMARY_JOB_WORKERS threads started in every web
+# process as it loads the app. Management commands load it too: set the flag for the web server only
+SUMMARY_JOB_WORKERS_AUTOSTART = env.bool('SUMMARY_JOB_WORKERS_AUTOSTART', default=False)
+SUMMARY_JOB_WORKERS = env.int('SUMMARY_JOB_WORKERS', default=2)
+SUMMARY_JOB_POLL_INTERVAL = 1.0   # seconds between queue polls of an idle worker
+SUMMARY_JOB_TIMEOUT = 15 * 60     # running jobs older than this are considered lost and queued again
+SUMMARY_JOB_MAX_ATTEMPTS = 3
+# PDF downloads of case links (see AllLegalMLTools/pdf_downloader.py), cached on disk and
+# revalidated with ETag / Last-Modified once older than PDF_CACHE_FRESH_SECONDS
+PDF_CACHE_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'pdf_cache')
+PDF_CACHE_MAX_BYTES = env.int('PDF_CACHE_MAX_BYTES', default=2 * 1024 * 1024 * 1024)
+PDF_CACHE_FRESH_SECONDS = 24 * 60 * 60
+PDF_DOWNLOAD_MAX_BYTES = env.int('PDF_DOWNLOAD_MAX_BYTES', default=50 * 1024 * 1024)
+PDF_DOWNLOAD_TIMEOUT = (5, 60)   # (connect, read) seconds
+# PDF text extraction (see AllLegalMLTools/pdf_extraction.py): documents with at least
+# PDF_PARALLEL_MIN_PAGES pages are extracted in a pool of PDF_EXTRACTION_WORKERS processes
+PDF_EXTRACTION_WORKERS = env.int('PDF_EXTRACTION_WORKERS', default=min(4, os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = 40
+PDF_PAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# How the chunks a summary is written from are picked: 'embedding' (remote embeddings), or the
+# local 'tfidf' / 'textrank' (see AllLegalMLTools/chunk_selection.py). Requests can override it
+SUMMARY_CHUNK_SELECTION = env('SUMMARY_CHUNK_SELECTION', default='embedding')
+# Documents longer than one summary prompt are summarized by map-reduce when this is on (requests
+# can override it, see AllLegalMLTools/map_reduce.py): at most SUMMARY_MAP_MAX_GROUPS parts are
+# condensed by SUMMARY_MAP_WORKERS threads, then combined SUMMARY_REDUCE_FAN_OUT at a time
+SUMMARY_MAP_REDUCE = env.bool('SUMMARY_MAP_REDUCE', default=False)
+SUMMARY_MAP_WORKERS = env.int('SUMMARY_MAP_WORKERS', default=8)
+SUMMARY_MAP_MAX_GROUPS = 16
+SUMMARY_REDUCE_FAN_OUT = 4
+SUMMARY_MAP_TIMEOUT = 90      # seconds
+SUMMARY_REDUCE_TIMEOUT = 60   # seconds, per reduce stage
+# Law chatbot service polled by the lawchatbot/ endpoint. OPENAI_BASE_URL / LAWCHATBOT_URL can point
+# at the local stubs of `manage.py run_stub_services` (see AllLegalMLTools/stub_services.py)
+LAWCHATBOT_URL = env('LAWCHATBOT_URL', default='https://7tmdf4lcsil23zs6hcbaptmo5q0dgvla.lambda-url.us-east-1.on.aws')
+LAWCHATBOT_MAX_POLLS = 5
+LAWCHATBOT_POLL_INTERVAL = env.float('LAWCHATBOT_POLL_INTERVAL', default=10)   # seconds between polls
+# Pipeline metrics, served on /metrics (see AllLegalMLTools/metrics.py). With several worker processes
+# METRICS_DIR must be a directory they share; METRICS_SERVER_TIMING adds per-stage Server-Timing headers
+METRICS_DIR = env('METRICS_DIR', default=None)
+METRICS_SERVER_TIMING = env.bool('METRICS_SERVER_TIMING', default=False)
+# client addresses or networks (e.g. 10.0.0.0/8) allowed to read /metrics besides staff users; behind
+# a reverse proxy the address is the proxy's, so let the scraper reach the workers directly
+METRICS_ALLOWED_IPS = env.list('METRICS_ALLOWED_IPS', default=['127.0.0.1', '::1'])
+# Identical summary requests running at the same time share one pipeline run (see
+# AllLegalMLTools/single_flight.py), coordinated across processes through a lock row in the database
+SUMMARY_SINGLE_FLIGHT_LEASE = 300          # seconds before a lock whose holder died can be taken over
+SUMMARY_SINGLE_FLIGHT_WAIT = 300           # seconds a duplicate waits before doing the work itself
+SUMMARY_SINGLE_FLIGHT_POLL_INTERVAL = 0.5  # seconds between looks at the cache while another process works
+# IPC vector index served by the ipc-search/ endpoint, built from IPC_SOURCE_PDFS by
+# `manage.py build_vector_index` (see AllLegalMLTools/statute_index.py); queries are embedded
+# with the model the index was built with
+IPC_VECTOR_INDEX_DIR = os.path.join(BASE_DIR, 'AllLegalMLTools', 'ipc_vector_db_open')
+IPC_SOURCE_PDFS = [os.path.join(BASE_DIR, 'AllLegalMLTools', 'IPC.pdf')]
+IPC_EMBEDDING_MODEL = 'text-embedding-ada-002'
+IPC_CHUNK_SIZE = 1024      # characters per passage
+IPC_CHUNK_OVERLAP = 200    # characters a passage repeats of the previous one
+IPC_EMBEDDING_CHECKPOINT_SIZE = 2048   # passages embedded between two checkpoints of a build
+# FAISS index type of the IPC index, one of AllLegalMLTools/ann_index.py (compare them with
+# `manage.py benchmark_vector_index`), and its search parameters. Every worker holds its own copy of
+# a 'flat', 'hnsw', 'sq8' or 'fp16' index (flat: passages x dim x 4 bytes, ~3.6 MB for the IPC);
+# only the lists of 'ivf_flat' / 'ivf_pq' are memory-mapped and shared, use one of those for large corpora
+IPC_VECTOR_INDEX_TYPE = env('IPC_VECTOR_INDEX_TYPE', default='flat')
+IPC_VECTOR_NPROBE = 8
+IPC_VECTOR_EF_SEARCH = 64
+IPC_SEARCH_MAX_BATCH = 64   # queries per ipc-search/ request
+# Default ipc-search/ mode: 'hybrid' fuses the BM25 and the vector rankings of IPC_HYBRID_DEPTH
+# passages each by reciprocal rank fusion with constant IPC_RRF_K, 'lexical' and 'vector' use one of them
+IPC_SEARCH_MODE = env('IPC_SEARCH_MODE', default='hybrid')
+IPC_HYBRID_DEPTH = 50
+IPC_RRF_K = 60
+IPC_SEARCH_WORKERS = 4    # threads embedding hybrid queries while the BM25 search runs
@@ -18,12 +18,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from AllLegalMLTools.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('rental-agreement-drafting/', include('RentalAgreementDrafting.urls')),
     path('legal-solutions/', include('AllLegalMLTools.urls')),
     path('api/',include('authentication.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG: